@@ -0,0 +1,74 @@
+# bench_backends.py – Side-by-side tokens/sec and peak RSS: transformers vs. llama.cpp GGUF
+#
+# Each backend runs in a fresh subprocess (so peak RSS is its own), loads the model, warms up,
+# then greedily completes the same prompts and reports load time, decode tokens/sec and
+# peak resident memory.
+#
+# Usage: python bench_backends.py --gguf ../output/gguf/kwokbot.Q4_K_M.gguf ../output/gguf/kwokbot.Q8_0.gguf
+
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import subprocess
+from prompt_format import format_prompt
+
+PROMPTS = [
+    "Derive the wave equation from Maxwell's equations in a source-free region.",
+    "What is the skin depth of a good conductor?",
+    "Explain the Poynting vector.",
+    "State Snell's law and when total internal reflection occurs.",
+]
+
+def peak_rss_mb():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024  # bytes on macOS, KB on Linux
+
+def run_one(spec, max_new_tokens, threads):
+    start = time.perf_counter()
+    if spec == "transformers":
+        from inference_backend import TransformersBackend
+        from merged_model import MERGED_PATH, load_merged
+        from runtime import select_runtime
+        runtime = select_runtime(device="cpu", threads=threads)
+        backend = TransformersBackend(*load_merged(MERGED_PATH, dtype=runtime.dtype, device="cpu"))
+    else:
+        from inference_backend import LlamaCppBackend
+        backend = LlamaCppBackend(spec, n_threads=threads)
+    load_s = time.perf_counter() - start
+
+    backend.complete(format_prompt({"instruction": PROMPTS[0], "output": ""}), max_new_tokens=4)  # warm-up
+    tokens, gen_start = 0, time.perf_counter()
+    for question in PROMPTS:
+        _, n = backend.complete(format_prompt({"instruction": question, "output": ""}), max_new_tokens)
+        tokens += n
+    gen_s = time.perf_counter() - gen_start
+    return {"backend": spec, "load_s": load_s, "tokens": tokens, "tokens_per_sec": tokens / gen_s, "peak_rss_mb": peak_rss_mb()}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark inference backends")
+    parser.add_argument("--gguf", nargs="*", default=[], help="GGUF files to run through llama-cpp")
+    parser.add_argument("--skip-transformers", action="store_true")
+    parser.add_argument("--max-new-tokens", type=int, default=64)
+    parser.add_argument("--threads", type=int, default=os.cpu_count())
+    parser.add_argument("--one", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.one:
+        print(json.dumps(run_one(args.one, args.max_new_tokens, args.threads)))
+        sys.exit(0)
+
+    specs = ([] if args.skip_transformers else ["transformers"]) + args.gguf
+    print(f"{'backend':40s} {'load':>8s} {'tok/s':>8s} {'peak RSS':>10s}")
+    for spec in specs:
+        cmd = [sys.executable, os.path.abspath(__file__), "--one", spec,
+               "--max-new-tokens", str(args.max_new_tokens), "--threads", str(args.threads)]
+        proc = subprocess.run(cmd, capture_output=True, text=True)
+        if proc.returncode != 0:
+            print(f"{spec[-40:]:40s} failed: {proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else proc.returncode}")
+            continue
+        r = json.loads(proc.stdout.strip().splitlines()[-1])
+        label = r["backend"] if r["backend"] == "transformers" else os.path.basename(r["backend"])
+        print(f"{label[-40:]:40s} {r['load_s']:7.1f}s {r['tokens_per_sec']:8.1f} {r['peak_rss_mb']:8.0f} MB")
@@ -0,0 +1,69 @@
+# bench_concept_tagger.py – Compare the compiled concept_tagger engine against the old per-rule loops
+#
+# Checks that every tagger returns exactly what the original functions returned, then times both.
+# Usage: python bench_concept_tagger.py [path/to/file.jsonl ...]
+
+import os
+import re
+import sys
+import json
+import time
+from concept_tagger import (CONCEPT_TAGS, INSTRUCTION_KEYWORDS, BLOCK_KEYWORDS,
+                            infer_concept_tags, tag_instruction, classify_tags)
+
+DEFAULT_FILES = [os.path.abspath(os.path.join(os.path.dirname(__file__), "../data/kwokbot_train.jsonl"))]
+
+# -------------- Original implementations (reference) -------------- #
+def legacy_infer_tags(text):
+    tags = set()
+    lowered = text.lower()
+    for pattern, tag in CONCEPT_TAGS.items():
+        if re.search(pattern, lowered):
+            tags.add(tag)
+    return sorted(tags)
+
+def legacy_keyword_tags(rules, text):
+    tags = []
+    low = text.lower()
+    for tag, keywords in rules:
+        if any(k in low for k in keywords):
+            tags.append(tag)
+    return tags if tags else ["other"]
+
+def legacy_tag_instruction(text):
+    return legacy_keyword_tags(INSTRUCTION_KEYWORDS, text)
+
+def legacy_classify_tags(text):
+    return legacy_keyword_tags(BLOCK_KEYWORDS, text)
+
+PAIRS = [
+    ("infer_tags (tag_jsonl_concepts)", legacy_infer_tags, infer_concept_tags),
+    ("tag_instruction (add_metadata)", legacy_tag_instruction, tag_instruction),
+    ("classify_tags (convert_to_jsonl)", legacy_classify_tags, classify_tags),
+]
+
+def timed(fn, texts, repeat=5):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for t in texts:
+            fn(t)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+if __name__ == "__main__":
+    paths = sys.argv[1:] or DEFAULT_FILES
+    texts = []
+    for path in paths:
+        with open(path, "r") as f:
+            for line in f:
+                if line.strip():
+                    texts.append(json.loads(line).get("output", ""))
+    size_mb = sum(len(t.encode()) for t in texts) / 1e6
+    print(f"[📏] {len(texts)} records, {size_mb:.2f} MB of output text from {', '.join(map(os.path.basename, paths))}\n")
+
+    for name, legacy, compiled in PAIRS:
+        mismatches = sum(1 for t in texts if legacy(t) != compiled(t))
+        old_s, new_s = timed(legacy, texts), timed(compiled, texts)
+        status = "identical" if not mismatches else f"{mismatches} MISMATCHES"
+        print(f"  - {name:34s}: {old_s*1000:8.1f} ms -> {new_s*1000:8.1f} ms  ({old_s/new_s:4.1f}x)  [{status}]")
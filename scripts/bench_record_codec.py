@@ -0,0 +1,45 @@
+# bench_record_codec.py – Decode/validate/encode throughput: stdlib dict path vs typed RecordCodec backends
+#
+# Usage: python bench_record_codec.py [path/to/file.jsonl ...]
+
+import os
+import sys
+import json
+import time
+from kwokbot_record import RecordCodec, BACKENDS
+
+DATA_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "../data"))
+DEFAULT_FILES = [os.path.join(DATA_DIR, "kwokbot_train.jsonl"), os.path.join(DATA_DIR, "kwokbot_fallback.jsonl")]
+
+def dict_path(lines):
+    # What every script does today
+    for line in lines:
+        json.dumps(json.loads(line))
+
+def codec_path(codec, lines):
+    for line in lines:
+        codec.encode(codec.decode(line))
+
+def best_of(fn, repeat=5):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+if __name__ == "__main__":
+    for path in sys.argv[1:] or DEFAULT_FILES:
+        with open(path, "rb") as f:
+            lines = [line for line in f if line.strip()]
+        size_mb = sum(map(len, lines)) / 1e6
+        print(f"\n[📏] {os.path.basename(path)}: {len(lines)} records, {size_mb:.2f} MB")
+
+        baseline = best_of(lambda: dict_path(lines))
+        print(f"  - {'json dict (current)':24s}: {baseline*1000:7.1f} ms  ({size_mb/baseline:6.1f} MB/s)")
+        for name in BACKENDS:
+            codec = RecordCodec(name)
+            roundtrip_ok = all(json.loads(codec.encode(codec.decode(l))) == json.loads(l) for l in lines)
+            t = best_of(lambda: codec_path(codec, lines))
+            print(f"  - {name + ' typed + validated':24s}: {t*1000:7.1f} ms  ({size_mb/t:6.1f} MB/s, "
+                  f"{baseline/t:4.1f}x)  [round-trip {'ok' if roundtrip_ok else 'MISMATCH'}]")
@@ -0,0 +1,108 @@
+# bench_server.py – Load generator for serve_kwokbot.py
+#
+# Fires --requests completions with --concurrency clients in flight, streaming each response,
+# and reports client-side TTFT / latency percentiles and throughput next to the server's /metrics.
+# With --spawn-tiny it starts serve_kwokbot.py --tiny itself (once per --max-batch value), so
+# the effect of dynamic batching can be measured on a CPU box without the 7B model:
+#
+#   python bench_server.py --spawn-tiny --max-batch 1,8 --concurrency 16 --requests 128
+
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+import requests
+
+QUESTIONS = [
+    "Derive the wave equation from Maxwell's equations in a source-free region.",
+    "What is the skin depth of a good conductor?",
+    "Explain the Poynting vector.",
+    "State Snell's law and when total internal reflection occurs.",
+    "What is the intrinsic impedance of free space?",
+    "Explain or derive the following expression or concept from EE 140 class: phase velocity",
+]
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else 0.0
+
+def one_request(url, i, max_new_tokens, stream):
+    body = {"instruction": QUESTIONS[i % len(QUESTIONS)], "max_new_tokens": max_new_tokens, "stream": stream}
+    start = time.perf_counter()
+    first, stats = None, {}
+    with requests.post(f"{url}/v1/completions", json=body, stream=stream, timeout=600) as resp:
+        resp.raise_for_status()
+        if stream:
+            for line in resp.iter_lines():
+                if not line:
+                    continue
+                event = json.loads(line)
+                if "text" in event and first is None:
+                    first = time.perf_counter()
+                if "error" in event:
+                    raise RuntimeError(event["error"])
+                if event.get("done"):
+                    stats = event["stats"]
+        else:
+            stats = resp.json()["stats"]
+    end = time.perf_counter()
+    return {"ttft": (first or end) - start, "latency": end - start, "new_tokens": stats.get("new_tokens", 0)}
+
+def run_load(url, n_requests, concurrency, max_new_tokens, stream):
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(lambda i: one_request(url, i, max_new_tokens, stream), range(n_requests)))
+    wall = time.perf_counter() - start
+    tokens = sum(r["new_tokens"] for r in results)
+    print(f"  requests: {n_requests} in {wall:.2f}s ({n_requests / wall:.1f} req/s, {tokens / wall:.1f} tokens/s)")
+    for key in ("ttft", "latency"):
+        values = [r[key] for r in results]
+        print(f"  {key:8s}: p50 {percentile(values, 0.5) * 1000:7.1f} ms   p95 {percentile(values, 0.95) * 1000:7.1f} ms")
+    metrics = requests.get(f"{url}/metrics", timeout=10).json()
+    print(f"  server  : mean batch {metrics['mean_batch_size']}, queue wait p95 {metrics['queue_wait_ms']['p95']} ms, "
+          f"queue depth now {metrics['queue_depth']}")
+
+def wait_until_up(url, proc, timeout=120):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError("server exited during startup")
+        try:
+            requests.get(f"{url}/metrics", timeout=1)
+            return
+        except requests.ConnectionError:
+            time.sleep(0.2)
+    raise RuntimeError("server did not come up")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load-test serve_kwokbot.py")
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--requests", type=int, default=64)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--max-new-tokens", type=int, default=64)
+    parser.add_argument("--no-stream", dest="stream", action="store_false")
+    parser.add_argument("--spawn-tiny", action="store_true", help="start serve_kwokbot.py --tiny for each --max-batch value")
+    parser.add_argument("--max-batch", default="1,8", help="comma-separated, used with --spawn-tiny")
+    parser.add_argument("--port", type=int, default=8765, help="port for the spawned server")
+    args = parser.parse_args()
+
+    if not args.spawn_tiny:
+        print(f"[📈] {args.url}: concurrency {args.concurrency}")
+        run_load(args.url, args.requests, args.concurrency, args.max_new_tokens, args.stream)
+        sys.exit(0)
+
+    server_script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "serve_kwokbot.py")
+    url = f"http://127.0.0.1:{args.port}"
+    for max_batch in [int(b) for b in args.max_batch.split(",")]:
+        proc = subprocess.Popen([sys.executable, server_script, "--tiny", "--port", str(args.port),
+                                 "--max-batch", str(max_batch)], stdout=subprocess.DEVNULL)
+        try:
+            wait_until_up(url, proc)
+            print(f"[📈] tiny model, max batch {max_batch}, concurrency {args.concurrency}")
+            run_load(url, args.requests, args.concurrency, args.max_new_tokens, args.stream)
+        finally:
+            proc.terminate()
+            proc.wait()
@@ -0,0 +1,110 @@
+# build_manifest.py – Per-source manifest for incremental, resumable dataset builds
+#
+# The manifest is an append-only JSONL file next to the output (e.g. kwokbot_train.jsonl.manifest).
+# Each line records one finished source PDF: its content hash, the build config it was produced
+# with, and the entries it produced. A record is appended (and fsync'd) the moment a source
+# finishes, so a crash on PDF 37 of 40 only loses PDF 37. On the next run, sources whose hash
+# and config still match are reused as-is and only new or changed PDFs are reprocessed.
+
+import os
+import json
+import hashlib
+from datetime import datetime
+
+def file_sha256(path, chunk_size=1 << 20):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def manifest_path_for(output_jsonl):
+    return output_jsonl + ".manifest"
+
+class BuildManifest:
+    def __init__(self, path, config=None):
+        self.path = path
+        self.config = json.loads(json.dumps(config or {}, sort_keys=True))
+        self.records = {}
+        self.hashes = {}
+        self._load()
+
+    def _key(self, source_path):
+        return os.path.abspath(source_path)
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "rb+") as f:
+            raw = f.read()
+            # Drop a half-written trailing record left behind by an interrupted run
+            if raw and not raw.endswith(b"\n"):
+                keep = raw.rfind(b"\n") + 1
+                f.truncate(keep)
+                raw = raw[:keep]
+        for line in raw.decode("utf-8").splitlines():
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            self.records[record["source"]] = record
+
+    def source_hash(self, source_path):
+        key = self._key(source_path)
+        if key not in self.hashes:
+            self.hashes[key] = file_sha256(source_path)
+        return self.hashes[key]
+
+    def is_current(self, source_path):
+        record = self.records.get(self._key(source_path))
+        return (record is not None
+                and record["sha256"] == self.source_hash(source_path)
+                and record.get("config") == self.config)
+
+    def entries(self, source_path):
+        return self.records[self._key(source_path)]["entries"]
+
+    def record(self, source_path, entries):
+        record = {
+            "source": self._key(source_path),
+            "sha256": self.source_hash(source_path),
+            "config": self.config,
+            "entries": entries,
+            "completed_at": datetime.now().isoformat(),
+        }
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self.records[record["source"]] = record
+
+    def compact(self, source_paths):
+        # Rewrite with one record per live source; stale and superseded records are dropped
+        keys = [self._key(p) for p in source_paths]
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for key in keys:
+                if key in self.records:
+                    f.write(json.dumps(self.records[key]) + "\n")
+        os.replace(tmp_path, self.path)
+        self.records = {k: self.records[k] for k in keys if k in self.records}
+
+def run_incremental(source_paths, manifest, process_stale, tag_counter):
+    # process_stale(stale_paths, on_source_done) must call on_source_done(path, entries) once per
+    # source as it finishes; results are returned for all sources in their original order
+    stale = [p for p in source_paths if not manifest.is_current(p)]
+    reused = len(source_paths) - len(stale)
+    print(f"[📒] Manifest: reusing {reused} unchanged source(s), processing {len(stale)} new/changed")
+
+    for path in source_paths:
+        if path not in stale:
+            for entry in manifest.entries(path):
+                for tag in entry.get("meta", {}).get("tags", []):
+                    tag_counter[tag] += 1
+
+    if stale:
+        process_stale(stale, manifest.record)
+    manifest.compact(source_paths)
+    return [e for path in source_paths for e in manifest.entries(path)]
@@ -1,55 +1,96 @@
 from transformers import AutoTokenizer, AutoModelForCausalLM
 from peft import PeftModel
 import torch
+import argparse
+from chat_session import ChatSession
+from merged_model import is_merged_export, load_merged
+from inference_backend import BACKENDS, make_backend, PromptChatSession
+from runtime import add_runtime_args, runtime_from_args, maybe_compile
+from retrieval_index import DEFAULT_INDEX_DIR, RetrievalIndex, format_notes
 
 # === Paths ===
 BASE_MODEL_PATH = "/Users/mdanylchuk/Documents/FKwokBot/models/mistral-7b-hf"
 LORA_PATH = "/Users/mdanylchuk/Documents/FKwokBot/output/kwokbot-lora"
+MERGED_PATH = "/Users/mdanylchuk/Documents/FKwokBot/output/kwokbot-merged"  # python merged_model.py export
 
-# === Load tokenizer and base model ===
-print("🔓 Loading tokenizer...")
-tokenizer = AutoTokenizer.from_pretrained(BASE_MODEL_PATH)
+parser = argparse.ArgumentParser(description="KwokBot terminal chat")
+parser.add_argument("--backend", choices=BACKENDS, default="transformers")
+parser.add_argument("--gguf", default=None, help="GGUF file for --backend llama-cpp (gguf_export.py)")
+parser.add_argument("--server-url", default="http://127.0.0.1:8080", help="llama.cpp server for --backend llama-server")
+parser.add_argument("--retrieve-k", type=int, default=0, help="prepend the top-k course passages to each question (0 = off)")
+parser.add_argument("--index-dir", default=DEFAULT_INDEX_DIR, help="index built by retrieval_index.py update")
+add_runtime_args(parser)
+args = parser.parse_args()
+runtime = runtime_from_args(args)
 
-# Patch pad_token if missing
-if tokenizer.pad_token is None:
-    tokenizer.pad_token = tokenizer.eos_token
+retriever = None
+if args.retrieve_k:
+    retriever = RetrievalIndex(args.index_dir)
+    if not retriever.docs:
+        parser.error(f"no retrieval index in {args.index_dir}; run: python retrieval_index.py update")
+    print(f"📚 Retrieval on: {len(retriever.docs)} course chunks, top {args.retrieve_k} per question")
 
-print("🧠 Loading base model...")
-base_model = AutoModelForCausalLM.from_pretrained(
-    BASE_MODEL_PATH,
-    torch_dtype=torch.float32,
-    device_map={"": "mps"},
-)
+# === Load model ===
+if args.backend != "transformers":
+    print(f"🦙 Using {args.backend} backend...")
+    session = PromptChatSession(make_backend(args.backend, args.gguf, args.server_url),
+                                max_context=4096, max_new_tokens=256, temperature=0.7, top_p=0.9)
+elif is_merged_export(MERGED_PATH):
+    # Adapter already folded into the weights (merged_model.py export): one mmap'd artifact, no PEFT overhead
+    print(f"⚡ Loading merged model from {MERGED_PATH}...")
+    model, tokenizer = load_merged(MERGED_PATH, dtype=runtime.dtype, device=runtime.device)
+else:
+    print("🔓 Loading tokenizer...")
+    tokenizer = AutoTokenizer.from_pretrained(BASE_MODEL_PATH)
 
-print("✨ Applying LoRA fine-tuning...")
-model = PeftModel.from_pretrained(base_model, LORA_PATH)
-model = model.to("mps")
-model.eval()
+    # Patch pad_token if missing
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+
+    print("🧠 Loading base model...")
+    base_model = AutoModelForCausalLM.from_pretrained(
+        BASE_MODEL_PATH,
+        torch_dtype=runtime.dtype,
+        device_map={"": runtime.device},
+    )
+
+    print("✨ Applying LoRA fine-tuning...")
+    model = PeftModel.from_pretrained(base_model, LORA_PATH)
+    model = model.to(runtime.device)
 
 # === Chat loop ===
-print("\n🤖 KwokBot Terminal Chat\nType 'exit' to dip out.\n")
+# Multi-turn: the conversation is kept in the Alpaca format the LoRA was trained on, and the KV
+# cache is reused across turns so only the new message is prefilled (see chat_session.py).
+if args.backend == "transformers":
+    print(f"💻 Runtime: {runtime.describe()}")
+    model = maybe_compile(model.eval(), runtime)
+    session = ChatSession(model, tokenizer, max_context=4096, max_new_tokens=256, temperature=0.7, top_p=0.9)
+
+print("\n🤖 KwokBot Terminal Chat\nType 'exit' to dip out, 'reset' to start a new conversation.\n")
 while True:
     user_input = input("You: ")
     if user_input.lower() == "exit":
         break
+    if user_input.lower() == "reset":
+        session.reset()
+        print("🧹 Conversation cleared.\n")
+        continue
 
-    # Tokenize input with attention mask
-    inputs = tokenizer(user_input, return_tensors="pt", return_attention_mask=True).to("mps")
-
-    with torch.no_grad():
-        outputs = model.generate(
-            **inputs,
-            max_new_tokens=256,
-            temperature=0.7,
-            top_p=0.9,
-            do_sample=True,
-            pad_token_id=tokenizer.pad_token_id,
-        )
-
-    response = tokenizer.decode(outputs[0], skip_special_tokens=True)
+    # Retrieved notes go into this turn's prompt only, not into the stored conversation
+    context = None
+    if retriever is not None:
+        hits = retriever.search(user_input, args.retrieve_k)
+        context = format_notes(hits)
+        print("   📎 " + (", ".join(f"{h['source']} p.{h['page']}" for h in hits) or "no matching notes"))
 
-    # Clean response: slice off user prompt if echoed
-    if response.startswith(user_input):
-        response = response[len(user_input):].strip()
+    # Stream tokens to the terminal as they are generated
+    print("KwokBot: ", end="", flush=True)
+    response, stats = session.ask(user_input, on_text=lambda chunk: print(chunk, end="", flush=True), context=context)
+    print("\n")
 
-    print(f"KwokBot: {response}\n")
+    note = f", dropped {stats['dropped_turns']} old turn(s)" if stats["dropped_turns"] else ""
+    if "reused_tokens" in stats:
+        note = f", prefilled {stats['prefill_tokens']}, reused {stats['reused_tokens']} cached tokens" + note
+    print(f"   ⏱️ TTFT {stats['ttft_s'] * 1000:.0f} ms ({stats['prompt_tokens']} prompt tokens{note}), "
+          f"inter-token {stats['itl_mean_s'] * 1000:.0f} ms mean / {stats['itl_p95_s'] * 1000:.0f} ms p95, "
+          f"{stats['decode_tok_s']:.1f} tok/s\n")
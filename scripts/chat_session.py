@@ -0,0 +1,176 @@
+# chat_session.py – Multi-turn KwokBot chat that reuses the KV cache across turns
+#
+# The conversation is kept as Alpaca turns (prompt_format.format_conversation, the template the
+# LoRA was trained on). Each turn the whole transcript is re-tokenized (cheap), compared with
+# the tokens already in the KV cache, the cache is cropped to their longest common prefix, and
+# only the remainder – normally just the new instruction – is prefilled.
+#
+# Truncation: when transcript + max_new_tokens would exceed max_context, the oldest whole turns
+# are dropped (the preamble is kept). Positions shift when that happens, so the cache is reused
+# only up to the preamble and the kept turns are prefilled again once.
+#
+# Streaming: ask(..., on_text=print_fn) hands out text as tokens are sampled. StreamDecoder only
+# ever decodes the reply's own token ids (no prompt echo to slice off), holds back partial UTF-8
+# sequences and anything that could be the start of a stop string.
+
+import time
+import torch
+from prompt_format import format_conversation, with_context
+
+STOP_STRINGS = ("\n### Instruction:", "### Instruction:")
+
+def crop_cache(past, length):
+    # Keep the first `length` positions of a DynamicCache or legacy ((k, v), ...) tuple cache
+    if past is None or length == 0:
+        return None
+    if hasattr(past, "crop"):
+        past.crop(length)
+        return past
+    return tuple((k[:, :, :length], v[:, :, :length]) for k, v in past)
+
+def common_prefix(a, b):
+    n = min(len(a), len(b))
+    i = 0
+    while i < n and a[i] == b[i]:
+        i += 1
+    return i
+
+def sample_token(logits, temperature=0.7, top_p=0.9):
+    if temperature <= 0:
+        return int(logits.argmax())
+    probs = torch.softmax(logits.float() / temperature, dim=-1)
+    sorted_probs, indices = probs.sort(descending=True)
+    sorted_probs[(sorted_probs.cumsum(-1) - sorted_probs) >= top_p] = 0
+    choice = torch.multinomial(sorted_probs / sorted_probs.sum(), 1)
+    return int(indices[choice])
+
+class StreamDecoder:
+    # Incremental detokenizer: decode ids[prefix:] and ids[prefix:read] and emit the difference, so
+    # sentencepiece's leading-space handling and byte-fallback tokens come out right
+    def __init__(self, tokenizer, stop_strings=STOP_STRINGS):
+        self.tokenizer = tokenizer
+        self.stop_strings = stop_strings
+        self.ids = []
+        self.prefix = self.read = 0
+        self.text = ""      # everything decoded so far
+        self.emitted = 0    # how much of self.text was handed out
+        self.stopped = False
+
+    def _decode(self, ids):
+        return self.tokenizer.decode(ids, skip_special_tokens=True)
+
+    def push(self, token_id):
+        self.ids.append(token_id)
+        before = self._decode(self.ids[self.prefix:self.read])
+        after = self._decode(self.ids[self.prefix:])
+        if len(after) > len(before) and not after.endswith("\ufffd"):  # U+FFFD: multi-byte char not complete yet
+            self.text += after[len(before):]
+            self.prefix, self.read = self.read, len(self.ids)
+        return self._release(final=False)
+
+    def finish(self):
+        return self._release(final=True)
+
+    def _release(self, final):
+        if not self.emitted:
+            self.text = self.text.lstrip()
+        found = [self.text.find(s) for s in self.stop_strings if s in self.text]
+        if found:
+            self.stopped = True
+            limit = min(found)
+        elif final:
+            limit = len(self.text)
+        else:
+            # Hold back a tail that might grow into a stop string
+            held = max((n for s in self.stop_strings for n in range(1, len(s)) if self.text.endswith(s[:n])), default=0)
+            limit = len(self.text) - held
+        chunk = self.text[self.emitted:limit] if limit > self.emitted else ""
+        self.emitted = max(self.emitted, limit)
+        return chunk
+
+    def response(self):
+        return self.text[:self.emitted].strip()
+
+class ChatSession:
+    def __init__(self, model, tokenizer, max_context=4096, max_new_tokens=256, temperature=0.7, top_p=0.9):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.max_context = min(max_context, getattr(model.config, "max_position_embeddings", max_context))
+        self.max_new_tokens = max_new_tokens
+        self.temperature = temperature
+        self.top_p = top_p
+        self.reset()
+
+    def reset(self):
+        self.turns = []    # [(instruction, response), ...]
+        self.cached = []   # token ids whose keys/values are in self.past, in order
+        self.past = None
+
+    def _forward(self, ids):
+        with torch.no_grad():
+            out = self.model(input_ids=torch.tensor([ids], device=self.model.device),
+                             past_key_values=self.past, use_cache=True)
+        self.past = out.past_key_values
+        self.cached += ids
+        return out.logits[0, -1]
+
+    def _prompt_ids(self, instruction):
+        # Drop the oldest turns until the prompt plus the reply budget fits
+        budget = self.max_context - self.max_new_tokens
+        dropped = 0
+        while True:
+            ids = self.tokenizer(format_conversation(self.turns, instruction))["input_ids"]
+            if len(ids) <= budget or not self.turns:
+                break
+            self.turns.pop(0)
+            dropped += 1
+        if len(ids) > budget:
+            ids = ids[:1] + ids[len(ids) - budget + 1:]  # a single oversized instruction: keep BOS + the tail
+        return ids, dropped
+
+    def ask(self, instruction, on_text=None, context=None):
+        # Returns (response, stats) for one turn; on_text(chunk) is called as text becomes final.
+        # context (e.g. retrieved notes) goes into this turn's prompt only; the history keeps the
+        # bare instruction, so it doesn't pile up and crowd out real turns.
+        start = time.perf_counter()
+        ids, dropped = self._prompt_ids(with_context(instruction, context))
+        reused = common_prefix(self.cached, ids)
+        reused = min(reused, len(ids) - 1)  # always feed at least one token to get next-token logits
+        self.past = crop_cache(self.past, reused)
+        self.cached = self.cached[:reused]
+
+        decoder = StreamDecoder(self.tokenizer)
+        logits = self._forward(ids[reused:])
+        token_times = []
+        for _ in range(self.max_new_tokens):
+            token = sample_token(logits, self.temperature, self.top_p)
+            token_times.append(time.perf_counter())
+            if token == self.tokenizer.eos_token_id:
+                break
+            chunk = decoder.push(token)
+            if chunk and on_text:
+                on_text(chunk)
+            if decoder.stopped:
+                break
+            logits = self._forward([token])
+        chunk = decoder.finish()
+        if chunk and on_text:
+            on_text(chunk)
+        elapsed = time.perf_counter() - start
+
+        response = decoder.response()
+        self.turns.append((instruction, response))
+
+        gaps = sorted(b - a for a, b in zip(token_times, token_times[1:]))
+        stats = {
+            "prompt_tokens": len(ids),
+            "reused_tokens": reused,
+            "prefill_tokens": len(ids) - reused,
+            "new_tokens": len(token_times),
+            "dropped_turns": dropped,
+            "ttft_s": token_times[0] - start if token_times else elapsed,
+            "itl_mean_s": sum(gaps) / len(gaps) if gaps else 0.0,
+            "itl_p95_s": gaps[int(0.95 * (len(gaps) - 1))] if gaps else 0.0,
+            "decode_tok_s": len(gaps) / max(token_times[-1] - token_times[0], 1e-9) if gaps else 0.0,
+        }
+        return response, stats
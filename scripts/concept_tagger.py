@@ -0,0 +1,144 @@
+# concept_tagger.py – Shared keyword/regex tagging engine for the KwokBot data scripts
+#
+# Every rule set is compiled once: each rule's top-level alternatives are split into plain
+# keywords (checked with C-speed substring search) and whatever is left that really needs
+# regex (merged into one compiled pattern per tag). A tag stops being checked as soon as it
+# fires. Results are identical to running re.search / `k in text` rule by rule.
+
+import re
+
+# Concept-level rules from tag_jsonl_concepts.py (regex pattern -> tag)
+CONCEPT_TAGS = {
+    r"gauss.*law|∇•e|flux|∮e": "gauss_law",
+    r"faraday|∇×e|∂b/∂t": "faradays_law",
+    r"lhcp": "left_hand_circular_polarization",
+    r"rhcp": "right_hand_circular_polarization",
+    r"reflection coefficient": "reflection_coefficient",
+    r"transmission coefficient": "transmission_coefficient",
+    r"z₀": "impedance",
+    r"∇×h": "ampere_law",
+    r"∇•b": "gauss_magnetic",
+    r"wave impedance": "impedance",
+    r"β|gamma|propagation": "propagation_constant",
+    r"lossy|conductivity|σ": "lossy_medium",
+    r"plane wave": "plane_wave",
+    r"electric field|e field": "electric_field",
+    r"magnetic field|b field": "magnetic_field",
+    r"cylindrical": "coordinate_system_cylindrical",
+    r"spherical": "coordinate_system_spherical",
+    r"cartesian": "coordinate_system_cartesian",
+    r"boundary condition": "boundary_conditions",
+    r"vector algebra|dot product|cross product": "vector_algebra",
+    r"transmission line": "transmission_lines",
+    r"matching|impedance match": "impedance_matching",
+    r"eigenvalue|eigenvector": "linear_algebra",
+    r"divergence|curl|gradient": "vector_operators",
+    r"∫|∮|∬": "integration",
+    r"∂": "partial_derivative",
+    r"∇": "del_operator"
+}
+
+# Instruction-level topic keywords from add_metadata.py (tag -> keywords)
+INSTRUCTION_KEYWORDS = [
+    ("vector", ["vector", "dot product", "cross product", "torque", "curl", "projection", "scalar triple"]),
+    ("coordinate", ["coordinate", "cartesian", "cylindrical", "spherical", "polar", "unit vector", "transform"]),
+    ("differential_operator", ["divergence", "gradient", "laplacian", "∇", "nabla", "operator", "partial derivative", "scale factor"]),
+    ("electromagnetics", ["electric", "magnetic", "em", "maxwell", "e-field", "b-field", "∇·e", "∇×b"]),
+    ("mechanics", ["center of mass", "moment of inertia", "mass distribution", "dm", "triangle", "disc", "sphere"]),
+]
+
+# Block-level keywords from convert_to_jsonl.py (tag -> keywords)
+BLOCK_KEYWORDS = [
+    ("electromagnetics", ["divergence", "curl", "laplacian", "gradient"]),
+    ("coordinate", ["cylindrical", "spherical"]),
+    ("calculus", ["∂", "integral", "derivative"]),
+    ("visual_reasoning", ["diagram explanation"]),
+]
+
+REGEX_META = set(".^$*+?{}[]()|\\")
+
+def split_alternatives(pattern):
+    # Split on top-level "|" only (not inside groups, classes or after a backslash)
+    parts, current, depth, in_class, escaped = [], [], 0, False, False
+    for ch in pattern:
+        if escaped:
+            escaped = False
+        elif ch == "\\":
+            escaped = True
+        elif in_class:
+            in_class = ch != "]"
+        elif ch == "[":
+            in_class = True
+        elif ch == "(":
+            depth += 1
+        elif ch == ")":
+            depth -= 1
+        elif ch == "|" and depth == 0:
+            parts.append("".join(current))
+            current = []
+            continue
+        current.append(ch)
+    parts.append("".join(current))
+    return parts
+
+class ConceptTagger:
+    def __init__(self, regex_rules=(), keyword_rules=(), default=None):
+        # regex_rules: (pattern, tag) pairs; keyword_rules: (tag, [keywords]) pairs.
+        # Several rules may share a tag; tag order is first appearance.
+        self.default = default
+        self.tag_order = []
+        keywords, regexes = {}, {}
+
+        def add_tag(tag):
+            if tag not in keywords:
+                self.tag_order.append(tag)
+                keywords[tag], regexes[tag] = [], []
+
+        for pattern, tag in regex_rules:
+            add_tag(tag)
+            for alt in split_alternatives(pattern):
+                if REGEX_META.intersection(alt):
+                    regexes[tag].append(alt)
+                else:
+                    keywords[tag].append(alt)
+        for tag, words in keyword_rules:
+            add_tag(tag)
+            keywords[tag].extend(words)
+
+        self.rules = [
+            (tag, tuple(keywords[tag]), re.compile("|".join(f"(?:{r})" for r in regexes[tag])) if regexes[tag] else None)
+            for tag in self.tag_order
+        ]
+
+    def match(self, text):
+        lowered = text.lower()
+        found = set()
+        for tag, words, regex in self.rules:
+            for w in words:
+                if w in lowered:
+                    found.add(tag)
+                    break
+            else:
+                if regex is not None and regex.search(lowered):
+                    found.add(tag)
+        return found
+
+    def tags(self, text):
+        found = self.match(text)
+        tags = [tag for tag in self.tag_order if tag in found]
+        if not tags and self.default is not None:
+            tags.append(self.default)
+        return tags
+
+CONCEPT_TAGGER = ConceptTagger(regex_rules=CONCEPT_TAGS.items())
+INSTRUCTION_TAGGER = ConceptTagger(keyword_rules=INSTRUCTION_KEYWORDS, default="other")
+BLOCK_TAGGER = ConceptTagger(keyword_rules=BLOCK_KEYWORDS, default="other")
+
+def infer_concept_tags(text):
+    return sorted(CONCEPT_TAGGER.match(text))
+
+def tag_instruction(text):
+    return INSTRUCTION_TAGGER.tags(text)
+
+def classify_tags(text):
+    return BLOCK_TAGGER.tags(text)
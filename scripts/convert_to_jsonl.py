@@ -3,10 +3,11 @@
 import os
 import re
 import io
-import fitz  # PyMuPDF
 import json
 import time
 import base64
+import asyncio
+import argparse
 import requests
 from PIL import Image
 from dotenv import load_dotenv
@@ -14,32 +15,45 @@ from tqdm import tqdm
 from transformers import LayoutLMv3Processor, LayoutLMv3ForTokenClassification
 from datetime import timedelta, datetime
 from collections import defaultdict
+from ocr_cache import OCRCache, add_cache_args, cache_from_args
+from rasterize import iter_page_images, add_raster_args, raster_options_from_args
+from build_manifest import BuildManifest, manifest_path_for, run_incremental
+from concept_tagger import classify_tags
 
 # Load API keys from .env in scripts directory
 load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), ".env"))
 MATHPIX_APP_ID = os.getenv("MATHPIX_APP_ID")
 MATHPIX_APP_KEY = os.getenv("MATHPIX_APP_KEY")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+MATHPIX_API_URL = os.getenv("MATHPIX_API_URL", "https://api.mathpix.com").rstrip("/")
 
 # Adjusted Paths
 PDF_SLIDES_FOLDER = os.path.abspath(os.path.join(os.path.dirname(__file__), "../materials/Slides"))
 PDF_TEXTBOOK_FOLDER = os.path.abspath(os.path.join(os.path.dirname(__file__), "../materials/TextBook"))
 OUTPUT_IMAGES = os.path.abspath(os.path.join(os.path.dirname(__file__), "../output_images"))
 OUTPUT_JSONL = os.path.abspath(os.path.join(os.path.dirname(__file__), "../data/kwokbot_train.jsonl"))
-os.makedirs(OUTPUT_IMAGES, exist_ok=True)
+CACHE = OCRCache()
+RASTER_OPTIONS = {"dpi": 300, "fmt": "png", "quality": 85, "grayscale": False}
+SAVE_IMAGES = False
 
 # -------------- MATHPIX Convert API -------------- #
+MATHPIX_PDF_OPTIONS = {
+    "formats": ["text", "latex_styled", "text+latex", "json"],
+    "output_format": "json",
+    "math_inline_delims": ["$", "$"],
+    "math_display_delims": ["$$", "$$"]
+}
+# Cache keys and the manifest config include the endpoint, so results from a test server
+# (fake_mathpix_server.py) are never served to a run against the real API
+MATHPIX_PDF_CACHE_OPTIONS = dict(MATHPIX_PDF_OPTIONS, endpoint=MATHPIX_API_URL)
+MATHPIX_TEXT_CACHE_OPTIONS = {"formats": ["text"], "endpoint": MATHPIX_API_URL}
+
 def upload_pdf_convert_api(file_path):
-    url = "https://api.mathpix.com/v3/pdf"
+    url = f"{MATHPIX_API_URL}/v3/pdf"
     with open(file_path, "rb") as f:
         files = {"file": f}
         data = {
-            "options_json": json.dumps({
-                "formats": ["text", "latex_styled", "text+latex", "json"],
-                "output_format": "json",
-                "math_inline_delims": ["$", "$"],
-                "math_display_delims": ["$$", "$$"]
-            })
+            "options_json": json.dumps(MATHPIX_PDF_OPTIONS)
         }
         headers = {
             "app_id": MATHPIX_APP_ID,
@@ -48,75 +62,134 @@ def upload_pdf_convert_api(file_path):
         res = requests.post(url, headers=headers, files=files, data=data)
         return res.json().get("pdf_id")
 
-def poll_pdf_result(pdf_id):
-    url = f"https://api.mathpix.com/v3/pdf/{pdf_id}"
+def fetch_pdf_status(pdf_id):
+    url = f"{MATHPIX_API_URL}/v3/pdf/{pdf_id}"
     headers = {"app_id": MATHPIX_APP_ID, "app_key": MATHPIX_APP_KEY}
+    return requests.get(url, headers=headers).json()
+
+def extract_pdf_text(result):
+    # ✅ New logic to extract text from structured JSON
+    try:
+        pages = result.get("json", {}).get("pages", [])
+        full_text = "\n\n".join(page.get("text", "") for page in pages)
+        if not full_text.strip():
+            print("[!] Mathpix finished but returned empty structured JSON content.")
+        return full_text
+    except Exception as e:
+        print(f"[!] Failed to parse JSON text from Mathpix: {e}")
+        return ""
+
+def poll_pdf_result(pdf_id):
     with tqdm(total=100, desc="Processing PDF with Mathpix", bar_format="{l_bar}{bar} [ time left: {remaining} ]") as pbar:
         while True:
-            res = requests.get(url, headers=headers)
-            result = res.json()
+            result = fetch_pdf_status(pdf_id)
             if result.get("status") == "completed":
                 pbar.n = 100
                 pbar.refresh()
-
-                # ✅ New logic to extract text from structured JSON
-                try:
-                    pages = result.get("json", {}).get("pages", [])
-                    full_text = "\n\n".join(page.get("text", "") for page in pages)
-                    if not full_text.strip():
-                        print("[!] Mathpix finished but returned empty structured JSON content.")
-                    return full_text
-                except Exception as e:
-                    print(f"[!] Failed to parse JSON text from Mathpix: {e}")
-                    return ""
+                return extract_pdf_text(result)
             elif result.get("status") == "error":
                 raise Exception(f"[✗] Mathpix error: {result.get('error', 'Unknown error')}")
             time.sleep(3)
             pbar.update(5 if pbar.n < 95 else 0)
 
+def convert_pdf_text(pdf_path):
+    # Upload + poll, served from the cache when this exact PDF was converted before
+    with open(pdf_path, "rb") as f:
+        cache_key = CACHE.key("mathpix_pdf", f.read(), MATHPIX_PDF_CACHE_OPTIONS)
+    cached = CACHE.get(cache_key)
+    if cached is not None:
+        return cached
+    text = poll_pdf_result(upload_pdf_convert_api(pdf_path))
+    if text.strip():
+        CACHE.put(cache_key, text)
+    return text
+
+# -------------- Async Convert API fan-out -------------- #
+POLL_MIN_DELAY = 1.0
+POLL_MAX_DELAY = 15.0
+POLL_BACKOFF = 1.5
+
+async def poll_pdf_result_async(pdf_id):
+    # Back off while a job makes no visible progress, tighten again once it moves
+    delay = POLL_MIN_DELAY
+    last_progress = None
+    while True:
+        result = await asyncio.to_thread(fetch_pdf_status, pdf_id)
+        if result.get("status") == "completed":
+            return extract_pdf_text(result)
+        elif result.get("status") == "error":
+            raise Exception(f"[✗] Mathpix error: {result.get('error', 'Unknown error')}")
+        progress = result.get("percent_done")
+        if progress is not None and progress != last_progress:
+            delay = POLL_MIN_DELAY
+        else:
+            delay = min(POLL_MAX_DELAY, delay * POLL_BACKOFF)
+        last_progress = progress
+        await asyncio.sleep(delay)
+
+async def convert_pdf_text_async(pdf_path, job_slots):
+    with open(pdf_path, "rb") as f:
+        cache_key = CACHE.key("mathpix_pdf", f.read(), MATHPIX_PDF_CACHE_OPTIONS)
+    cached = CACHE.get(cache_key)
+    if cached is not None:
+        return cached
+    async with job_slots:
+        pdf_id = await asyncio.to_thread(upload_pdf_convert_api, pdf_path)
+        if not pdf_id:
+            raise Exception(f"[✗] Mathpix upload failed for {os.path.basename(pdf_path)}")
+        text = await poll_pdf_result_async(pdf_id)
+    if text.strip():
+        CACHE.put(cache_key, text)
+    return text
+
 # -------------- Local OCR / Image fallback -------------- #
-def convert_pdf_to_images(pdf_path):
-    doc = fitz.open(pdf_path)
-    images = []
-    for page_num in range(len(doc)):
-        pix = doc.load_page(page_num).get_pixmap(dpi=300)
-        img_path = os.path.join(OUTPUT_IMAGES, f"page_{page_num}.png")
-        pix.save(img_path)
-        images.append((page_num, img_path))
-    return images
-
-def mathpix_image_ocr(image_path):
-    with open(image_path, "rb") as f:
-        b64_img = base64.b64encode(f.read()).decode()
+def iter_pdf_images(pdf_path):
+    save_dir = OUTPUT_IMAGES if SAVE_IMAGES else None
+    return iter_page_images(pdf_path, save_dir=save_dir, **RASTER_OPTIONS)
+
+def mathpix_image_ocr(img_bytes, mime="image/png"):
+    cache_key = CACHE.key("mathpix_text", img_bytes, MATHPIX_TEXT_CACHE_OPTIONS)
+    cached = CACHE.get(cache_key)
+    if cached is not None:
+        return cached
+    b64_img = base64.b64encode(img_bytes).decode()
     headers = {
         "app_id": MATHPIX_APP_ID,
         "app_key": MATHPIX_APP_KEY,
         "Content-type": "application/json"
     }
     payload = {
-        "src": f"data:image/png;base64,{b64_img}",
+        "src": f"data:{mime};base64,{b64_img}",
         "formats": ["text"]
     }
-    res = requests.post("https://api.mathpix.com/v3/text", headers=headers, json=payload)
-    return res.json().get("text", "")
+    result = requests.post(f"{MATHPIX_API_URL}/v3/text", headers=headers, json=payload).json()
+    text = result.get("text", "")
+    if "error" not in result:
+        CACHE.put(cache_key, text)
+    return text
 
 # -------------- GPT-4V Diagram Description -------------- #
-def gpt4v_image_prompt(image_path, context="Explain this diagram in EE 140 context"):
+GPT4V_MODEL = "gpt-4-vision-preview"
+
+def gpt4v_image_prompt(img_bytes, mime="image/png", context="Explain this diagram in EE 140 context"):
     if not OPENAI_API_KEY:
         print("[!] GPT-4V disabled: OPENAI_API_KEY not found.")
         return ""
 
     try:
-        with open(image_path, "rb") as img:
-            b64_img = base64.b64encode(img.read()).decode()
+        cache_key = CACHE.key("gpt4v", img_bytes, {"model": GPT4V_MODEL, "context": context, "max_tokens": 500})
+        cached = CACHE.get(cache_key)
+        if cached is not None:
+            return cached
+        b64_img = base64.b64encode(img_bytes).decode()
 
         payload = {
-            "model": "gpt-4-vision-preview",
+            "model": GPT4V_MODEL,
             "messages": [
                 {"role": "system", "content": "You're an expert tutor who explains diagrams clearly."},
                 {"role": "user", "content": [
                     {"type": "text", "text": context},
-                    {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{b64_img}"}}
+                    {"type": "image_url", "image_url": {"url": f"data:{mime};base64,{b64_img}"}}
                 ]}
             ],
             "max_tokens": 500
@@ -131,7 +204,9 @@ def gpt4v_image_prompt(image_path, context="Explain this diagram in EE 140 conte
         res.raise_for_status()
 
         result = res.json()
-        return result.get("choices", [{}])[0].get("message", {}).get("content", "")
+        content = result.get("choices", [{}])[0].get("message", {}).get("content", "")
+        CACHE.put(cache_key, content)
+        return content
 
     except Exception as e:
         print(f"[!] GPT-4V diagram interpretation failed: {str(e)}")
@@ -139,15 +214,6 @@ def gpt4v_image_prompt(image_path, context="Explain this diagram in EE 140 conte
 
 
 # -------------- Tagging / Cleaning Helpers -------------- #
-def classify_tags(text):
-    tags = []
-    low = text.lower()
-    if any(k in low for k in ["divergence", "curl", "laplacian", "gradient"]): tags.append("electromagnetics")
-    if any(k in low for k in ["cylindrical", "spherical"]): tags.append("coordinate")
-    if any(k in low for k in ["∂", "integral", "derivative"]): tags.append("calculus")
-    if any(k in low for k in ["diagram explanation"]): tags.append("visual_reasoning")
-    return tags if tags else ["other"]
-
 def clean_and_group_blocks(text):
     blocks = text.split("\n\n")
     grouped, current = [], []
@@ -167,21 +233,27 @@ def write_jsonl(entries, output_path):
             f.write(json.dumps(e) + "\n")
 
 # -------------- Master Runner -------------- #
+def local_ocr_text(pdf_path):
+    text = ""
+    for page in iter_pdf_images(pdf_path):
+        text += mathpix_image_ocr(page.data, page.mime)
+        text += "\n\n"
+        diagram_desc = gpt4v_image_prompt(page.data, page.mime)
+        if diagram_desc:
+            text += f"[Diagram Explanation]\n{diagram_desc}\n\n"
+    return text
+
 def process_pdf(pdf_path, tag_counter):
     print(f"[+] Processing {pdf_path}")
-    entries = []
     try:
-        pdf_id = upload_pdf_convert_api(pdf_path)
-        text = poll_pdf_result(pdf_id)
+        text = convert_pdf_text(pdf_path)
     except Exception as e:
         print("[!] Convert API failed, falling back to local OCR...")
-        text = ""
-        for i, image_path in convert_pdf_to_images(pdf_path):
-            text += mathpix_image_ocr(image_path)
-            text += "\n\n"
-            diagram_desc = gpt4v_image_prompt(image_path)
-            if diagram_desc:
-                text += f"[Diagram Explanation]\n{diagram_desc}\n\n"
+        text = local_ocr_text(pdf_path)
+    return build_entries(pdf_path, text, tag_counter)
+
+def build_entries(pdf_path, text, tag_counter):
+    entries = []
     blocks = clean_and_group_blocks(text)
     for i, block in enumerate(blocks):
         if len(block.strip()) < 10:
@@ -202,9 +274,55 @@ def process_pdf(pdf_path, tag_counter):
         entries.append(entry)
     return entries
 
+def process_pdfs_serial(pdf_files, tag_counter, on_source_done=None):
+    entries = []
+    with tqdm(total=len(pdf_files), desc="Total Progress", unit="pdf") as overall:
+        for pdf_path in pdf_files:
+            pdf_entries = process_pdf(pdf_path, tag_counter)
+            if on_source_done:
+                on_source_done(pdf_path, pdf_entries)
+            entries.extend(pdf_entries)
+            overall.update(1)
+    return entries
+
+async def process_pdfs_async(pdf_files, tag_counter, max_jobs=8, on_source_done=None):
+    # Upload every PDF up front (capped at max_jobs live conversions), poll all jobs
+    # together, and group/tag each result the moment its job completes
+    job_slots = asyncio.Semaphore(max_jobs)
+    entries_by_pdf = {}
+
+    async def run(pdf_path):
+        try:
+            text = await convert_pdf_text_async(pdf_path, job_slots)
+        except Exception as e:
+            print(f"[!] Convert API failed for {os.path.basename(pdf_path)}, falling back to local OCR...")
+            text = await asyncio.to_thread(local_ocr_text, pdf_path)
+        return pdf_path, text
+
+    with tqdm(total=len(pdf_files), desc="Total Progress", unit="pdf") as overall:
+        for finished in asyncio.as_completed([run(p) for p in pdf_files]):
+            pdf_path, text = await finished
+            entries_by_pdf[pdf_path] = build_entries(pdf_path, text, tag_counter)
+            if on_source_done:
+                on_source_done(pdf_path, entries_by_pdf[pdf_path])
+            overall.update(1)
+
+    return [e for pdf_path in pdf_files for e in entries_by_pdf[pdf_path]]
+
 # -------------- Entry Point -------------- #
 if __name__ == "__main__":
-    all_entries = []
+    parser = argparse.ArgumentParser(description="Convert course PDFs into Alpaca JSONL via Mathpix")
+    parser.add_argument("--async-convert", action="store_true", help="upload all PDFs and poll their jobs concurrently")
+    parser.add_argument("--max-jobs", type=int, default=8, help="max concurrent Mathpix conversions (async mode)")
+    parser.add_argument("--incremental", action="store_true",
+                        help="only reprocess new/changed PDFs (tracked in <output>.manifest); resumes after a crash")
+    add_cache_args(parser)
+    add_raster_args(parser)
+    args = parser.parse_args()
+    CACHE = cache_from_args(args)
+    RASTER_OPTIONS = raster_options_from_args(args)
+    SAVE_IMAGES = args.save_images
+
     tag_counter = defaultdict(int)
     start_time = datetime.now()
 
@@ -214,15 +332,23 @@ if __name__ == "__main__":
         if os.path.exists(folder):
             pdf_files.extend([os.path.join(folder, f) for f in os.listdir(folder) if f.endswith(".pdf")])
 
-    with tqdm(total=len(pdf_files), desc="Total Progress", unit="pdf") as overall:
-        for pdf_path in pdf_files:
-            all_entries.extend(process_pdf(pdf_path, tag_counter))
-            overall.update(1)
+    def run(files, on_source_done=None):
+        if args.async_convert:
+            return asyncio.run(process_pdfs_async(files, tag_counter, args.max_jobs, on_source_done))
+        return process_pdfs_serial(files, tag_counter, on_source_done)
+
+    if args.incremental:
+        manifest = BuildManifest(manifest_path_for(OUTPUT_JSONL), config={"mathpix": MATHPIX_PDF_CACHE_OPTIONS, "raster": RASTER_OPTIONS})
+        all_entries = run_incremental(pdf_files, manifest, run, tag_counter)
+    else:
+        all_entries = run(pdf_files)
 
     write_jsonl(all_entries, OUTPUT_JSONL)
     end_time = datetime.now()
     duration = str(timedelta(seconds=int((end_time - start_time).total_seconds())))
     print(f"[✓] Done! {len(all_entries)} entries saved to {OUTPUT_JSONL} in {duration}")
+    print(f"[💾] OCR cache: {CACHE.summary()}")
+    CACHE.close()
 
     print("\n📊 Summary by Tag:")
     for tag, count in sorted(tag_counter.items(), key=lambda x: -x[1]):
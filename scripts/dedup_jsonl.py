@@ -0,0 +1,274 @@
+# dedup_jsonl.py – Collapse near-duplicate KwokBot records with MinHash signatures + LSH banding
+#
+# convert_to_jsonl.py (Mathpix) and ocr_to_josnl.py (per-page OCR) extract the same PDFs, and
+# slides repeat the same header on every page, so the mixed training data holds many
+# near-identical "output" blocks. Three streaming passes over the input file(s):
+#
+#   1. signatures – word k-shingles of the field, one-permutation MinHash with rotation
+#                   densification (each shingle is hashed once, not once per permutation);
+#                   chunks run in a process pool, in order. Signatures go to a flat uint32 file
+#                   that is memory-mapped later; every band of rows is hashed into a bucket key
+#                   in a temporary SQLite table.
+#   2. clustering – buckets are read back sorted (SQLite sorts on disk), each member is checked
+#                   against the bucket's first record by signature agreement, and records at or
+#                   above --threshold are merged with union-find.
+#   3. output     – one record per cluster is kept (first seen, or --keep longest), the rest are
+#                   dropped; input order is preserved. --report writes one JSON line per cluster.
+#
+# Memory: no text is held between records; per record only a parent pointer and a length (plus
+# cluster membership for records that have duplicates). Signatures and buckets live on disk.
+#
+# Usage:
+#   python dedup_jsonl.py ../data/kwokbot_train.jsonl ../data/kwokbot_fallback.jsonl \
+#       --output ../data/kwokbot_dedup.jsonl --report ../data/kwokbot_dedup_clusters.jsonl --workers 4
+
+import os
+import re
+import json
+import mmap
+import time
+import sqlite3
+import hashlib
+import argparse
+import tempfile
+from array import array
+from itertools import islice
+from collections import deque
+from multiprocessing import Pool
+
+MASK32 = 0xFFFFFFFF
+EMPTY = MASK32
+ROTATION = 0x9E3779B1  # odd constant added per step when an empty bin borrows from its neighbour
+MIN_RECALL = 0.945  # candidate chance at --threshold that choose_bands() must reach
+_WORD = re.compile(r"\w+")
+
+# -------------- Signatures -------------- #
+def shingles(text, k=5):
+    words = _WORD.findall(text.lower())
+    if len(words) <= k:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i:i + k]) for i in range(len(words) - k + 1)}
+
+def minhash(shingle_set, num_perm=128):
+    # One-permutation hashing: bin = h mod P, keep the minimum of the remaining bits per bin
+    sig = [EMPTY] * num_perm
+    for s in shingle_set:
+        h = int.from_bytes(hashlib.blake2b(s.encode(), digest_size=8).digest(), "little")
+        b, v = h % num_perm, (h // num_perm) & MASK32
+        if v < sig[b]:
+            sig[b] = v
+    if EMPTY in sig and len(set(sig)) > 1:
+        # Densify: an empty bin takes the next non-empty bin to its right, shifted per step
+        for i in range(num_perm):
+            if sig[i] == EMPTY:
+                t = 1
+                while sig[(i + t) % num_perm] == EMPTY:
+                    t += 1
+                sig[i] = (sig[(i + t) % num_perm] + t * ROTATION) & MASK32
+    return sig
+
+def signature_line(line, field, k, num_perm):
+    # -> (signature or None, text length); None for records that can't be compared (kept as-is)
+    try:
+        entry = json.loads(line)
+        text = entry.get(field, "") if isinstance(entry, dict) else ""
+    except json.JSONDecodeError:
+        return None, 0
+    if not isinstance(text, str):
+        return None, 0
+    shingle_set = shingles(text, k)
+    return (minhash(shingle_set, num_perm) if shingle_set else None), len(text)
+
+def signature_chunk(args):
+    lines, field, k, num_perm = args
+    return [signature_line(line, field, k, num_perm) for line in lines]
+
+def iter_records(paths):
+    # (file index, line number, raw line) for every non-empty line of every input, in order
+    for file_idx, path in enumerate(paths):
+        with open(path, "r", encoding="utf-8") as f:
+            for line_no, line in enumerate(f, 1):
+                if line.strip():
+                    yield file_idx, line_no, line
+
+def signature_stream(lines, field, k, num_perm, workers=1, chunk_size=1000):
+    # Same bounded in-flight scheme as tag_jsonl_concepts.tag_stream
+    if workers <= 1:
+        for line in lines:
+            yield signature_line(line, field, k, num_perm)
+        return
+    with Pool(workers) as pool:
+        pending = deque()
+        while True:
+            chunk = list(islice(lines, chunk_size))
+            if not chunk:
+                break
+            pending.append(pool.apply_async(signature_chunk, ((chunk, field, k, num_perm),)))
+            if len(pending) >= 2 * workers:
+                yield from pending.popleft().get()
+        while pending:
+            yield from pending.popleft().get()
+
+# -------------- LSH -------------- #
+def candidate_probability(similarity, bands, rows):
+    # Chance that a pair at this Jaccard similarity shares at least one band bucket
+    return 1 - (1 - similarity ** rows) ** bands
+
+def choose_bands(num_perm, threshold, recall=MIN_RECALL):
+    # Widest bands (fewest low-similarity candidates) that still catch a pair at the threshold
+    # with probability >= recall; bands * rows may leave the last num_perm % rows values unused.
+    # 128 values at 0.8 -> 16 x 8 (0.947); the S-curve midpoint would put pairs at the threshold
+    # at ~50% and silently miss about half of them.
+    for rows in range(num_perm, 0, -1):
+        bands = num_perm // rows
+        if candidate_probability(threshold, bands, rows) >= recall:
+            return bands, rows
+    return num_perm, 1
+
+def band_keys(sig, bands, rows):
+    raw = array("I", sig).tobytes()
+    width = rows * 4
+    return [int.from_bytes(hashlib.blake2b(raw[i * width:(i + 1) * width], digest_size=8).digest(), "little", signed=True)
+            for i in range(bands)]
+
+def similarity(sigs, num_perm, a, b):
+    sa, sb = sigs[a * num_perm:(a + 1) * num_perm], sigs[b * num_perm:(b + 1) * num_perm]
+    return sum(x == y for x, y in zip(sa, sb)) / num_perm
+
+def find(parent, x):
+    while parent[x] != x:
+        parent[x] = parent[parent[x]]
+        x = parent[x]
+    return x
+
+# -------------- Driver -------------- #
+def dedup(paths, output_path, report_path=None, field="output", threshold=0.8, num_perm=128, shingle_size=5,
+          bands=None, keep="first", workers=1, chunk_size=1000, work_dir=None):
+    start = time.perf_counter()
+    if bands:
+        if not 1 <= bands <= num_perm:
+            raise ValueError(f"--bands must be between 1 and --num-perm ({num_perm})")
+        rows = num_perm // bands  # any remainder of the signature is not banded
+    else:
+        bands, rows = choose_bands(num_perm, threshold)
+    work_dir = work_dir or os.path.dirname(os.path.abspath(output_path))
+    stats = {"records": 0, "unhashed": 0, "candidate_checks": 0}
+
+    with tempfile.TemporaryDirectory(dir=work_dir, prefix=".dedup_") as tmp:
+        sig_path = os.path.join(tmp, "signatures.u32")
+        db = sqlite3.connect(os.path.join(tmp, "buckets.sqlite"))
+        db.execute("PRAGMA journal_mode=OFF")
+        db.execute("PRAGMA synchronous=OFF")
+        db.execute("PRAGMA temp_store=FILE")
+        db.execute("CREATE TABLE buckets (band INTEGER, key INTEGER, rec INTEGER)")
+
+        # Pass 1: signatures + band buckets
+        lengths = array("Q")
+        with open(sig_path, "wb") as sig_file:
+            lines = (line for _, _, line in iter_records(paths))
+            batch = []
+            for rec, (sig, length) in enumerate(signature_stream(lines, field, shingle_size, num_perm, workers, chunk_size)):
+                lengths.append(length)
+                if sig is None:
+                    stats["unhashed"] += 1
+                    sig = [EMPTY] * num_perm
+                else:
+                    batch.extend((band, key, rec) for band, key in enumerate(band_keys(sig, bands, rows)))
+                sig_file.write(array("I", sig).tobytes())
+                if len(batch) >= 100_000:
+                    db.executemany("INSERT INTO buckets VALUES (?, ?, ?)", batch)
+                    batch.clear()
+            db.executemany("INSERT INTO buckets VALUES (?, ?, ?)", batch)
+            db.commit()
+        n = stats["records"] = len(lengths)
+
+        # Pass 2: verify bucket members against the bucket's first record, union-find
+        parent = array("Q", range(n))
+        if n and os.path.getsize(sig_path):
+            with open(sig_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                sigs = memoryview(mm).cast("I")
+                current, head = None, None
+                for band, key, rec in db.execute("SELECT band, key, rec FROM buckets ORDER BY band, key, rec"):
+                    if (band, key) != current:
+                        current, head = (band, key), rec
+                        continue
+                    ra, rb = find(parent, head), find(parent, rec)
+                    if ra == rb:
+                        continue
+                    stats["candidate_checks"] += 1
+                    if similarity(sigs, num_perm, head, rec) >= threshold:
+                        parent[max(ra, rb)] = min(ra, rb)
+                clusters = {}  # root (smallest record id of the set) -> members, duplicates only
+                for rec in range(n):
+                    root = find(parent, rec)
+                    if root != rec:
+                        clusters.setdefault(root, [root]).append(rec)
+                keepers = {}
+                for root, members in clusters.items():
+                    keepers[root] = max(members, key=lambda r: (lengths[r], -r)) if keep == "longest" else root
+                sims = {root: {r: similarity(sigs, num_perm, keepers[root], r) for r in members}
+                        for root, members in clusters.items()} if report_path else {}
+                sigs.release()
+        else:
+            clusters, keepers, sims = {}, {}, {}
+        db.close()
+
+    # Pass 3: write survivors in input order (+ cluster report)
+    drop = {r for root, members in clusters.items() for r in members if r != keepers[root]}
+    kept = set(keepers.values())
+    where = {}
+    previews = {}
+    report_recs = {r for members in clusters.values() for r in members} if report_path else set()
+    written = 0
+    with open(output_path, "w", encoding="utf-8") as out:
+        for rec, (file_idx, line_no, line) in enumerate(iter_records(paths)):
+            if rec in report_recs:
+                where[rec] = f"{os.path.basename(paths[file_idx])}:{line_no}"
+                if rec in kept:
+                    previews[rec] = json.loads(line).get(field, "")[:120]
+            if rec in drop:
+                continue
+            out.write(line if line.endswith("\n") else line + "\n")
+            written += 1
+
+    if report_path:
+        with open(report_path, "w", encoding="utf-8") as rep:
+            for root, members in sorted(clusters.items(), key=lambda item: -len(item[1])):
+                kept = keepers[root]
+                rep.write(json.dumps({
+                    "size": len(members),
+                    "kept": where[kept],
+                    "preview": previews[kept],
+                    "dropped": [{"at": where[r], "similarity": round(sims[root][r], 3)} for r in members if r != kept],
+                }, ensure_ascii=False) + "\n")
+
+    stats.update(written=written, dropped=len(drop), clusters=len(clusters), bands=bands, rows=rows,
+                 recall=candidate_probability(threshold, bands, rows),
+                 seconds=time.perf_counter() - start)
+    return stats
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Drop near-duplicate KwokBot records (MinHash + LSH)")
+    parser.add_argument("inputs", nargs="+", help="JSONL file(s); records are compared across all of them")
+    parser.add_argument("--output", required=True)
+    parser.add_argument("--report", default=None, help="write one JSON line per duplicate cluster here")
+    parser.add_argument("--field", default="output", help="record field to compare")
+    parser.add_argument("--threshold", type=float, default=0.8, help="estimated Jaccard similarity to merge at")
+    parser.add_argument("--num-perm", type=int, default=128, help="MinHash signature length")
+    parser.add_argument("--shingle", type=int, default=5, help="words per shingle")
+    parser.add_argument("--bands", type=int, default=None, help="LSH bands (default: the widest bands that still catch ~95%% of pairs at --threshold)")
+    parser.add_argument("--keep", choices=["first", "longest"], default="first", help="which cluster member survives")
+    parser.add_argument("--workers", type=int, default=1, help="compute signatures in this many processes")
+    parser.add_argument("--chunk-size", type=int, default=1000, help="lines per worker task")
+    parser.add_argument("--work-dir", default=None, help="where signatures/buckets are spilled (default: next to --output)")
+    args = parser.parse_args()
+
+    stats = dedup(args.inputs, args.output, args.report, args.field, args.threshold, args.num_perm, args.shingle,
+                  args.bands, args.keep, args.workers, args.chunk_size, args.work_dir)
+    print(f"[✓] {stats['written']} of {stats['records']} records written to {args.output} "
+          f"({stats['dropped']} near-duplicates in {stats['clusters']} clusters dropped) in {stats['seconds']:.1f}s")
+    print(f"    LSH {stats['bands']} bands × {stats['rows']} rows ({stats['recall']:.0%} candidate chance at the threshold), "
+          f"{stats['candidate_checks']} candidate checks, "
+          f"{stats['unhashed']} record(s) without comparable text kept as-is")
+    if args.report:
+        print(f"    Cluster report → {args.report}")
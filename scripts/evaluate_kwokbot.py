@@ -1,19 +1,53 @@
 from transformers import AutoTokenizer, AutoModelForCausalLM
 from datasets import load_dataset
+from train_data import load_tokenized
+from merged_model import is_merged_export, load_merged
+from inference_backend import BACKENDS, make_backend
+from runtime import add_runtime_args, runtime_from_args, maybe_compile
+from prefix_cache import PrefixCache, find_shared_prefixes, middle_pad
+from score_answers import score_results, summarize, format_summary
 import torch
 from tqdm import tqdm
+import argparse
+import time
 import json
 
 # === CONFIG ===
 model_path = "output/kwokbot-lora"
+merged_path = "output/kwokbot-merged"  # used instead when merged_model.py export has been run
 eval_file = "data/kwokbot_eval.jsonl"
-device = torch.device("mps" if torch.backends.mps.is_available() else "cpu")
+
+parser = argparse.ArgumentParser(description="Greedy regression eval for KwokBot")
+parser.add_argument("--batch-size", type=int, default=8, help="prompts per generate() call (1 = old one-by-one loop)")
+parser.add_argument("--max-new-tokens", type=int, default=128)
+parser.add_argument("--quiet", action="store_true", help="don't print every expected/got pair")
+parser.add_argument("--backend", choices=BACKENDS, default="transformers")
+parser.add_argument("--gguf", default=None, help="GGUF file for --backend llama-cpp (gguf_export.py)")
+parser.add_argument("--server-url", default="http://127.0.0.1:8080", help="llama.cpp server for --backend llama-server")
+parser.add_argument("--no-prefix-cache", dest="prefix_cache", action="store_false",
+                    help="prefill every prompt in full (to A/B the shared-prefix KV cache)")
+parser.add_argument("--score-workers", type=int, default=1, help="processes for scoring (score_answers.py)")
+add_runtime_args(parser)
+args = parser.parse_args()
+runtime = runtime_from_args(args)
+device = torch.device(runtime.device)
 
 # === LOAD TOKENIZER AND MODEL ===
 print("🔓 Loading tokenizer and model...")
-tokenizer = AutoTokenizer.from_pretrained(model_path)
-model = AutoModelForCausalLM.from_pretrained(model_path).to(device)
-model.eval()
+if args.backend != "transformers":
+    backend = make_backend(args.backend, args.gguf, args.server_url)
+elif is_merged_export(merged_path):
+    model, tokenizer = load_merged(merged_path, dtype=runtime.dtype, device=device)
+else:
+    tokenizer = AutoTokenizer.from_pretrained(model_path)
+    model = AutoModelForCausalLM.from_pretrained(model_path, torch_dtype=runtime.dtype).to(device)
+if args.backend == "transformers":
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+    # Left-pad so every prompt in a batch ends right where generation starts
+    tokenizer.padding_side = "left"
+    print(f"💻 Runtime: {runtime.describe()}")
+    model = maybe_compile(model.eval(), runtime)
 
 # === LOAD EVAL QUESTIONS ===
 print("📚 Loading eval questions...")
@@ -27,26 +61,90 @@ def letter_grade(percent):
     elif percent >= 60: return "D"
     else: return "F"
 
-# === EVALUATE ===
-print("🧠 Running evaluation using greedy forward pass...\n")
-correct = 0
-results = []
-
-for i, item in enumerate(tqdm(dataset, desc="Evaluating")):
-    prompt = f"{item['instruction']}\n\n{item['input']}".strip()
-    expected = item["output"].strip()
-
-    inputs = tokenizer(prompt, return_tensors="pt").to(device)
+# === BATCHED GREEDY GENERATION ===
+def count_new_tokens(generated):
+    # Tokens up to and including the first EOS; everything after it is padding
+    eos_positions = (generated == tokenizer.eos_token_id).nonzero()
+    return int(eos_positions[0]) + 1 if len(eos_positions) else len(generated)
 
+def generate_batch(prompt_ids, prefix=None):
+    # prompt_ids: pre-tokenized prompts from the tokenized-dataset cache, left-padded here.
+    # With a cached shared prefix the batch is laid out [prefix][pads][suffix] and starts from
+    # a fork of the prefix's KV cache, so only the suffixes are prefilled.
+    if prefix is None:
+        inputs = tokenizer.pad({"input_ids": prompt_ids}, return_tensors="pt").to(device)
+    else:
+        input_ids, attention_mask = middle_pad(prompt_ids, len(prefix), tokenizer.pad_token_id)
+        inputs = {"input_ids": torch.tensor(input_ids, device=device),
+                  "attention_mask": torch.tensor(attention_mask, device=device),
+                  "past_key_values": prefix_cache.fork(prefix, len(prompt_ids))}
     with torch.no_grad():
         outputs = model.generate(
             **inputs,
-            max_new_tokens=128,
+            max_new_tokens=args.max_new_tokens,
             do_sample=False,  # Greedy
-            pad_token_id=tokenizer.eos_token_id  # avoid warning
+            pad_token_id=tokenizer.pad_token_id,
+            eos_token_id=tokenizer.eos_token_id,  # each row stops on its own EOS
         )
+    prompt_len = inputs["input_ids"].shape[1]
+    decoded = [tokenizer.decode(out, skip_special_tokens=True).strip() for out in outputs]
+    new_tokens = [count_new_tokens(out[prompt_len:]) for out in outputs]
+    return decoded, new_tokens
+
+# === EVALUATE ===
+print(f"🧠 Running evaluation using greedy forward pass (batch size {args.batch_size})...\n")
+def eval_prompt(item):
+    return f"{item['instruction']}\n\n{item['input']}".strip()
 
-    decoded = tokenizer.decode(outputs[0], skip_special_tokens=True).strip()
+prompts = [eval_prompt(item) for item in dataset]
+expected_all = [item["output"].strip() for item in dataset]
+
+decoded_all = [None] * len(prompts)
+total_new_tokens = 0
+gen_start = time.perf_counter()
+if args.backend == "transformers":
+    # Prompt token ids come from the shared cache (cache/tokenized/), so reruns skip tokenization
+    tokenized, _ = load_tokenized(eval_file, tokenizer, eval_prompt, max_length=None, with_response=False)
+    prompt_ids = tokenized["input_ids"]
+
+    # Most prompts open with the same instruction: prefill each shared prefix once (prefix_cache.py).
+    # Building the prefixes counts toward generation time so --no-prefix-cache is a fair A/B.
+    gen_start = time.perf_counter()
+    prefix_cache = PrefixCache(model) if args.prefix_cache else None
+    if prefix_cache is not None:
+        for prefix in find_shared_prefixes(prompt_ids):
+            prefix_cache.add(prefix)
+    prefix_of = [prefix_cache.longest(ids) if prefix_cache else None for ids in prompt_ids]
+
+    # Group by shared prefix, then sort by tokenized length so each batch pads as little as possible
+    lengths = tokenized["length"]
+    order = sorted(range(len(prompts)), key=lambda i: (len(prefix_of[i] or ()), prefix_of[i] or (), lengths[i]))
+    batches = []
+    for i in order:
+        if batches and len(batches[-1]) < args.batch_size and prefix_of[batches[-1][0]] == prefix_of[i]:
+            batches[-1].append(i)
+        else:
+            batches.append([i])
+
+    for batch_idx in tqdm(batches, desc="Evaluating"):
+        prefix = prefix_cache.match([prompt_ids[i] for i in batch_idx]) if prefix_of[batch_idx[0]] else None
+        decoded, new_tokens = generate_batch([prompt_ids[i] for i in batch_idx], prefix)
+        for i, text in zip(batch_idx, decoded):
+            decoded_all[i] = text
+        total_new_tokens += sum(new_tokens)
+    if prefix_cache is not None:
+        print(f"🧩 {prefix_cache.summary()}")
+else:
+    for i in tqdm(range(len(prompts)), desc=f"Evaluating ({args.backend})"):
+        text, n_tokens = backend.complete(prompts[i], args.max_new_tokens, temperature=0.0)
+        # Same shape as the transformers path, which decodes prompt + continuation
+        decoded_all[i] = f"{prompts[i]} {text}".strip()
+        total_new_tokens += n_tokens
+gen_seconds = time.perf_counter() - gen_start
+
+correct = 0
+results = []
+for i, (prompt, expected, decoded) in enumerate(zip(prompts, expected_all, decoded_all)):
     match = expected.lower() in decoded.lower()
 
     results.append({
@@ -56,10 +154,11 @@ for i, item in enumerate(tqdm(dataset, desc="Evaluating")):
         "correct": match
     })
 
-    print(f"--- Question {i+1} ---")
-    print(f"✅ Expected: {expected}")
-    print(f"🤖 Got: {decoded}")
-    print(f"{'✔️ MATCH' if match else '❌ MISMATCH'}\n")
+    if not args.quiet:
+        print(f"--- Question {i+1} ---")
+        print(f"✅ Expected: {expected}")
+        print(f"🤖 Got: {decoded}")
+        print(f"{'✔️ MATCH' if match else '❌ MISMATCH'}\n")
 
     if match:
         correct += 1
@@ -68,6 +167,11 @@ for i, item in enumerate(tqdm(dataset, desc="Evaluating")):
 accuracy = (correct / len(dataset)) * 100
 grade = letter_grade(accuracy)
 print(f"📊 Final Grade: {correct}/{len(dataset)} correct — {accuracy:.2f}% ({grade})")
+scores = score_results(results, args.score_workers)
+for item, item_scores in zip(results, scores):
+    item["scores"] = item_scores
+print(f"📐 Scores: {format_summary(summarize(scores))}")
+print(f"⚡ Throughput: {total_new_tokens} new tokens in {gen_seconds:.1f}s — {total_new_tokens / max(gen_seconds, 1e-9):.1f} tokens/sec")
 
 # === SAVE RESULTS ===
 with open("eval_results_greedy.json", "w") as f:
@@ -0,0 +1,107 @@
+# fake_mathpix_server.py – Local stand-in for the Mathpix API with injected latency
+#
+# Covers /v3/text (page OCR) and /v3/pdf + /v3/pdf/<id> (Convert API upload + polling).
+#
+# Point the extractors at it with MATHPIX_API_URL=http://127.0.0.1:8765 to benchmark
+# pipelined vs serial runs without paying for (or waiting on) the real API.
+
+import json
+import time
+import uuid
+import random
+import hashlib
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+class FakeMathpixHandler(BaseHTTPRequestHandler):
+    latency = 0.5
+    jitter = 0.0
+    pdf_seconds = 5.0
+    jobs = {}
+    stats = {"requests": 0, "polls": 0, "in_flight": 0, "max_in_flight": 0}
+    stats_lock = threading.Lock()
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, body):
+        raw = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(raw)))
+        self.end_headers()
+        self.wfile.write(raw)
+
+    def _delay(self):
+        time.sleep(max(0.0, self.latency + random.uniform(-self.jitter, self.jitter)))
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        with self.stats_lock:
+            self.stats["requests"] += 1
+            self.stats["in_flight"] += 1
+            self.stats["max_in_flight"] = max(self.stats["max_in_flight"], self.stats["in_flight"])
+        try:
+            self._delay()
+            if self.path == "/v3/text":
+                src = json.loads(body or b"{}").get("src", "")
+                digest = hashlib.sha1(src.encode()).hexdigest()[:12]
+                self._send_json(200, {"text": f"Fake OCR text for image {digest}"})
+            elif self.path == "/v3/pdf":
+                pdf_id = uuid.uuid4().hex
+                digest = hashlib.sha1(body).hexdigest()[:12]
+                with self.stats_lock:
+                    self.jobs[pdf_id] = (time.monotonic(), digest)
+                self._send_json(200, {"pdf_id": pdf_id})
+            else:
+                self._send_json(404, {"error": f"unknown endpoint {self.path}"})
+        finally:
+            with self.stats_lock:
+                self.stats["in_flight"] -= 1
+
+    def do_GET(self):
+        if self.path == "/stats":
+            with self.stats_lock:
+                self._send_json(200, dict(self.stats))
+        elif self.path.startswith("/v3/pdf/"):
+            self._delay()
+            with self.stats_lock:
+                self.stats["polls"] += 1
+                job = self.jobs.get(self.path.rsplit("/", 1)[-1])
+            if job is None:
+                self._send_json(200, {"status": "error", "error": "unknown pdf_id"})
+                return
+            started, digest = job
+            elapsed = time.monotonic() - started
+            if elapsed < self.pdf_seconds:
+                self._send_json(200, {"status": "split", "percent_done": int(elapsed / self.pdf_seconds * 100)})
+            else:
+                pages = [{"text": f"Fake page {i} of PDF {digest}\n\nE = -\\nabla V"} for i in range(3)]
+                self._send_json(200, {"status": "completed", "percent_done": 100, "json": {"pages": pages}})
+        else:
+            self._send_json(404, {"error": f"unknown endpoint {self.path}"})
+
+def serve(host="127.0.0.1", port=8765, latency=0.5, jitter=0.0, pdf_seconds=5.0):
+    FakeMathpixHandler.latency = latency
+    FakeMathpixHandler.jitter = jitter
+    FakeMathpixHandler.pdf_seconds = pdf_seconds
+    server = ThreadingHTTPServer((host, port), FakeMathpixHandler)
+    server.daemon_threads = True
+    return server
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fake Mathpix API server for local benchmarks")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.5, help="seconds added to every request")
+    parser.add_argument("--jitter", type=float, default=0.0, help="± random seconds on top of latency")
+    parser.add_argument("--pdf-seconds", type=float, default=5.0, help="time before a /v3/pdf job reports completed")
+    args = parser.parse_args()
+
+    server = serve(args.host, args.port, args.latency, args.jitter, args.pdf_seconds)
+    print(f"[🧪] Fake Mathpix listening on http://{args.host}:{args.port} (latency {args.latency}s ± {args.jitter}s)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
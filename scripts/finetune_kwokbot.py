@@ -1,16 +1,23 @@
 # kwokbot_finetune.py
-from transformers import AutoTokenizer, AutoModelForCausalLM, TrainingArguments, Trainer, DataCollatorForLanguageModeling
-from datasets import load_dataset
+from transformers import AutoTokenizer, AutoModelForCausalLM, TrainingArguments
 from peft import get_peft_model, LoraConfig, TaskType
+import os
 import torch
+from runtime import detect_device, select_runtime, upcast_trainable
+from train_data import DynamicPaddingCollator, TokenStatsTrainer, report_padding, load_tokenized
 
-# MPS check
-device = torch.device("mps" if torch.backends.mps.is_available() else "cpu")
+# Device / dtype / threads (override with KWOKBOT_DEVICE, KWOKBOT_DTYPE, KWOKBOT_THREADS)
+# This script has always trained the MPS model in full precision
+device = os.environ.get("KWOKBOT_DEVICE") or detect_device()
+runtime = select_runtime(device=device, dtype=os.environ.get("KWOKBOT_DTYPE") or (torch.float32 if device == "mps" else None))
+print(f"💻 Runtime: {runtime.describe()}")
 
 # Load tokenizer + model
 model_name = "~/Documents/FKwokBot/models/mistral-7b-hf"
 tokenizer = AutoTokenizer.from_pretrained(model_name)
-model = AutoModelForCausalLM.from_pretrained(model_name, device_map={"": device})
+if tokenizer.pad_token is None:
+    tokenizer.pad_token = tokenizer.eos_token
+model = AutoModelForCausalLM.from_pretrained(model_name, torch_dtype=runtime.dtype, device_map={"": runtime.device})
 
 # Enable gradient checkpointing
 model.gradient_checkpointing_enable()
@@ -25,29 +32,29 @@ lora_config = LoraConfig(
     task_type=TaskType.CAUSAL_LM
 )
 
-model = get_peft_model(model, lora_config)
+model = upcast_trainable(get_peft_model(model, lora_config))  # fp32 adapters when the base is bf16
 
-# Load Alpaca-style JSONL
+# Load Alpaca-style JSONL, tokenized (no padding here – each batch is padded to its own longest sample).
+# The result is cached under cache/tokenized/, so reruns on unchanged data skip tokenization.
 print("Loading dataset...")
-dataset = load_dataset("json", data_files="/data/kwokbot_train.jsonl")
+MAX_LENGTH = 512
+BATCH_SIZE = 1  # per device; dynamic padding already removes the padding at batch size 1
+GRAD_ACCUM = 4  # effective batch of 4 without the activation memory of 4 sequences
 
-# Tokenize
-print("Tokenizing...")
-def tokenize(sample):
-    prompt = sample["instruction"] + "\n" + sample["input"] + "\n"
-    response = sample["output"]
-    full_text = prompt + response
-    return tokenizer(full_text, truncation=True, padding="max_length", max_length=512)
+def prompt(entry):
+    return entry["instruction"] + "\n" + entry["input"] + "\n"
 
-dataset = dataset["train"].map(tokenize)
+dataset, _ = load_tokenized("/data/kwokbot_train.jsonl", tokenizer, prompt, MAX_LENGTH)
+report_padding(dataset["length"], MAX_LENGTH, BATCH_SIZE)
 
-data_collator = DataCollatorForLanguageModeling(tokenizer=tokenizer, mlm=False)
+data_collator = DynamicPaddingCollator(tokenizer)
 
 # Training args
 training_args = TrainingArguments(
     output_dir="/Users/mdanylchuk/Documents/FKwokBot/models/kwokbot-finetuned",
-    per_device_train_batch_size=1,
-    gradient_accumulation_steps=4,
+    per_device_train_batch_size=BATCH_SIZE,
+    gradient_accumulation_steps=GRAD_ACCUM,
+    group_by_length=True,  # uses the "length" column
     num_train_epochs=3,
     logging_dir="logs",
     logging_strategy="steps",
@@ -63,7 +70,7 @@ training_args = TrainingArguments(
 )
 
 # Trainer setup
-trainer = Trainer(
+trainer = TokenStatsTrainer(
     model=model,
     args=training_args,
     train_dataset=dataset,
@@ -74,6 +81,8 @@ trainer = Trainer(
 print("Starting training...")
 trainer.train()
 
+print(f"⚡ {trainer.token_stats()}")
+
 print("Saving model...")
 trainer.save_model("/Users/mdanylchuk/Documents/FKwokBot/models/kwokbot-finetuned")
 
@@ -1,16 +1,35 @@
-from transformers import AutoModelForCausalLM, AutoTokenizer, TrainingArguments, Trainer, DataCollatorForLanguageModeling
+from transformers import AutoModelForCausalLM, AutoTokenizer, TrainingArguments
 from peft import LoraConfig, get_peft_model
-from datasets import load_dataset
+from datasets import Dataset
 import torch
 import os
+import argparse
+from prompt_format import format_prompt
+from runtime import add_runtime_args, runtime_from_args, upcast_trainable
+from train_data import DynamicPaddingCollator, TokenStatsTrainer, report_padding, load_tokenized
+from train_data import pack_samples, PackedCollator, report_packing, cache_key, load_or_build
 
 # ========== CONFIG ==========
 model_path = "/Users/mdanylchuk/Documents/FKwokBot/models/mistral-7b-hf"
 data_path = "/Users/mdanylchuk/Documents/FKwokBot/data/kwokbot_train.jsonl"
 output_dir = "/Users/mdanylchuk/Documents/FKwokBot/output/kwokbot-lora"
-
-device = torch.device("mps" if torch.backends.mps.is_available() else "cpu")
-print(f"💻 Using device: {device}")
+max_length = 512
+batch_size = 1  # per device; a 7B model with gradient checkpointing has little headroom on MPS
+grad_accum = 2  # effective batch of 2
+split_seed = 42  # fixed so the packed train split can be cached between runs
+
+parser = argparse.ArgumentParser(description="LoRA fine-tune KwokBot")
+parser.add_argument("--pack", action="store_true",
+                    help="concatenate samples into full max_length rows (per-sample attention + position ids)")
+parser.add_argument("--refresh-cache", action="store_true", help="re-tokenize (and re-pack) even if cached")
+add_runtime_args(parser)
+args = parser.parse_args()
+
+# float16 weights on CPU are emulated and slow; the runtime picks bf16 (native) or float32 there,
+# and keeps float16 on MPS
+runtime = runtime_from_args(args)
+device = torch.device(runtime.device)
+print(f"💻 Using runtime: {runtime.describe()}")
 
 # ========== LOAD TOKENIZER ==========
 print("🔓 Loading tokenizer...")
@@ -22,7 +41,7 @@ if tokenizer.pad_token is None:
 print("🧠 Loading base model...")
 base_model = AutoModelForCausalLM.from_pretrained(
     model_path,
-    torch_dtype=torch.float16,
+    torch_dtype=runtime.dtype,
     low_cpu_mem_usage=True
 ).to(device)
 
@@ -35,41 +54,40 @@ lora_config = LoraConfig(
     bias="none",
     task_type="CAUSAL_LM"
 )
-model = get_peft_model(base_model, lora_config).to(device)
+model = upcast_trainable(get_peft_model(base_model, lora_config)).to(device)  # fp32 adapters over a half-precision base
 print("🛠️ LoRA applied!")
 
 # ========== LOAD & FORMAT DATA ==========
+def lora_prompt(entry):
+    # Prompt = everything format_prompt puts before the output; it is masked out of the loss
+    return format_prompt({"instruction": entry["instruction"], "output": ""})
+
 print("📚 Loading dataset...")
-dataset = load_dataset("json", data_files=data_path)["train"]
-split = dataset.train_test_split(test_size=0.1)
+# Tokenized once and cached under cache/tokenized/ (keyed by data hash, tokenizer, template, max_length)
+dataset, tokenized_key = load_tokenized(data_path, tokenizer, lora_prompt, max_length, refresh=args.refresh_cache)
+split = dataset.train_test_split(test_size=0.1, seed=split_seed, keep_in_memory=True)
 train_dataset = split["train"]
 eval_dataset = split["test"]
 
-def format_prompt(entry):
-    return f"""Below is an instruction that describes a task. Write a response that appropriately completes the request.
-
-### Instruction:
-{entry['instruction']}
-
-### Response:
-{entry['output']}"""
+def build_packed():
+    packed = pack_samples(train_dataset["input_ids"], train_dataset["labels"], max_length)
+    report_packing(train_dataset["length"], packed["length"], max_length, batch_size * grad_accum)
+    return Dataset.from_dict(packed)
 
-def tokenize(entry):
-    return tokenizer(
-        format_prompt(entry),
-        truncation=True,
-        max_length=512,
-        padding="max_length"
-    )
-
-train_dataset = train_dataset.map(tokenize)
-eval_dataset = eval_dataset.map(tokenize)
+if args.pack:
+    key = cache_key(tokenized=tokenized_key, split=[0.1, split_seed], max_length=max_length)
+    train_dataset = load_or_build(f"lora-{key}", build_packed, refresh=args.refresh_cache)
+    data_collator = PackedCollator(tokenizer, dtype=base_model.dtype)
+else:
+    report_padding(train_dataset["length"], max_length, batch_size)
+    data_collator = DynamicPaddingCollator(tokenizer)
 
 # ========== TRAINING SETUP ==========
 training_args = TrainingArguments(
     output_dir=output_dir,
-    per_device_train_batch_size=1,
-    gradient_accumulation_steps=2,
+    per_device_train_batch_size=batch_size,
+    gradient_accumulation_steps=grad_accum,
+    group_by_length=not args.pack,  # uses the "length" column; packed rows are all ~max_length
     learning_rate=2e-4,
     num_train_epochs=5,
     logging_steps=10,
@@ -82,12 +100,7 @@ training_args = TrainingArguments(
     logging_dir=os.path.join(output_dir, "logs")
 )
 
-data_collator = DataCollatorForLanguageModeling(
-    tokenizer=tokenizer,
-    mlm=False
-)
-
-trainer = Trainer(
+trainer = TokenStatsTrainer(
     model=model,
     args=training_args,
     train_dataset=train_dataset,
@@ -100,6 +113,8 @@ trainer = Trainer(
 print("🚀 Starting fine-tuning...")
 trainer.train()
 
+print(f"⚡ {trainer.token_stats()}")
+
 print("💾 Saving...")
 model.save_pretrained(output_dir)
 tokenizer.save_pretrained(output_dir)
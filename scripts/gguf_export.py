@@ -0,0 +1,77 @@
+# gguf_export.py – Convert the merged KwokBot model to GGUF for llama.cpp CPU inference
+#
+# Two steps with the llama.cpp checkout in tools/llama.cpp (override with LLAMA_CPP_DIR):
+#   1. convert_hf_to_gguf.py  merged HF model -> f16 GGUF
+#   2. llama-quantize         f16 GGUF -> Q4_K_M / Q8_0 / ...
+# The input is a float export from merged_model.py (int8 exports are our own format and
+# can't be read by the converter – export with --dtype bf16 or float16 first).
+#
+# Usage: python gguf_export.py --quant Q4_K_M,Q8_0
+
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+from merged_model import MERGED_PATH, EXPORT_INFO
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+LLAMA_CPP_DIR = os.environ.get("LLAMA_CPP_DIR", os.path.join(ROOT, "tools", "llama.cpp"))
+GGUF_DIR = "/Users/mdanylchuk/Documents/FKwokBot/output/gguf"
+QUANT_TYPES = ("Q4_K_M", "Q5_K_M", "Q8_0", "F16")
+
+def find_tool(candidates):
+    # Script/binary names changed across llama.cpp versions
+    for rel in candidates:
+        path = os.path.join(LLAMA_CPP_DIR, rel)
+        if os.path.isfile(path):
+            return path
+    raise FileNotFoundError(f"none of {', '.join(candidates)} found under {LLAMA_CPP_DIR} "
+                            "(clone/build llama.cpp there or set LLAMA_CPP_DIR)")
+
+def convert_to_f16(merged_dir, out_path):
+    script = find_tool(["convert_hf_to_gguf.py", "convert-hf-to-gguf.py"])
+    subprocess.run([sys.executable, script, merged_dir, "--outtype", "f16", "--outfile", out_path], check=True)
+
+def quantize(f16_path, out_path, quant):
+    binary = find_tool(["build/bin/llama-quantize", "llama-quantize", "build/bin/quantize", "quantize"])
+    subprocess.run([binary, f16_path, out_path, quant], check=True)
+
+def export_gguf(merged_dir=MERGED_PATH, out_dir=GGUF_DIR, quants=("Q4_K_M",), keep_f16=False):
+    with open(os.path.join(merged_dir, EXPORT_INFO)) as f:
+        if json.load(f)["dtype"] == "int8":
+            raise ValueError(f"{merged_dir} is an int8 export; re-export with merged_model.py export --dtype bf16")
+    os.makedirs(out_dir, exist_ok=True)
+    f16_path = os.path.join(out_dir, "kwokbot.F16.gguf")
+    if not os.path.isfile(f16_path):
+        start = time.perf_counter()
+        convert_to_f16(merged_dir, f16_path)
+        print(f"[✓] {f16_path} ({os.path.getsize(f16_path) / 1e9:.2f} GB, {time.perf_counter() - start:.0f}s)")
+    outputs = []
+    for quant in quants:
+        if quant == "F16":
+            outputs.append(f16_path)
+            continue
+        out_path = os.path.join(out_dir, f"kwokbot.{quant}.gguf")
+        start = time.perf_counter()
+        quantize(f16_path, out_path, quant)
+        print(f"[✓] {out_path} ({os.path.getsize(out_path) / 1e9:.2f} GB, {time.perf_counter() - start:.0f}s)")
+        outputs.append(out_path)
+    if not keep_f16 and "F16" not in quants:
+        os.remove(f16_path)
+    return outputs
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export the merged KwokBot model to quantized GGUF")
+    parser.add_argument("--merged", default=MERGED_PATH)
+    parser.add_argument("--out-dir", default=GGUF_DIR)
+    parser.add_argument("--quant", default="Q4_K_M", help=f"comma-separated: {', '.join(QUANT_TYPES)}")
+    parser.add_argument("--keep-f16", action="store_true", help="keep the intermediate f16 GGUF")
+    args = parser.parse_args()
+
+    quants = [q.strip().upper() for q in args.quant.split(",") if q.strip()]
+    unknown = [q for q in quants if q not in QUANT_TYPES]
+    if unknown:
+        parser.error(f"unsupported quantization(s): {', '.join(unknown)}")
+    export_gguf(args.merged, args.out_dir, quants, args.keep_f16)
@@ -0,0 +1,179 @@
+# inference_backend.py – Pluggable text-generation backends for chat / eval
+#
+#   transformers  – the HF model in-process (merged export or base + LoRA)
+#   llama-cpp     – a GGUF file through the llama-cpp-python bindings (CPU, quantized)
+#   llama-server  – a running llama.cpp server (tools/llama.cpp: llama-server -m kwokbot.Q4_K_M.gguf)
+#
+# Every backend exposes stream(prompt, ...) -> iterator of text chunks, complete(...) -> (text, n_tokens)
+# and count_tokens(text). Prompts are plain strings (prompt_format.py builds them), and every
+# backend stops at the next "### Instruction:" header like the transformers chat loop does.
+# PromptChatSession gives the llama.cpp backends the same ask() interface as ChatSession;
+# llama.cpp reuses the KV cache for the shared transcript prefix on its own.
+
+import json
+import time
+import torch
+from prompt_format import format_conversation, with_context
+from chat_session import StreamDecoder, sample_token, STOP_STRINGS
+
+BACKENDS = ("transformers", "llama-cpp", "llama-server")
+
+class TransformersBackend:
+    name = "transformers"
+
+    def __init__(self, model, tokenizer):
+        self.model = model
+        self.tokenizer = tokenizer
+
+    def count_tokens(self, text):
+        return len(self.tokenizer(text)["input_ids"])
+
+    def _generate(self, prompt, max_new_tokens, temperature, top_p, usage):
+        # usage["completion_tokens"] counts the sampled ids (stop-string tokens included, EOS not),
+        # which is what llama.cpp reports, so the backends' tokens/sec compare like for like
+        ids = self.tokenizer(prompt)["input_ids"]
+        decoder = StreamDecoder(self.tokenizer)
+        past = None
+        usage["completion_tokens"] = 0
+        with torch.no_grad():
+            for _ in range(max_new_tokens):
+                out = self.model(input_ids=torch.tensor([ids], device=self.model.device), past_key_values=past, use_cache=True)
+                past = out.past_key_values
+                token = sample_token(out.logits[0, -1], temperature, top_p)
+                if token == self.tokenizer.eos_token_id:
+                    break
+                usage["completion_tokens"] += 1
+                chunk = decoder.push(token)
+                if chunk:
+                    yield chunk
+                if decoder.stopped:
+                    break
+                ids = [token]
+        tail = decoder.finish()
+        if tail:
+            yield tail
+
+    def stream(self, prompt, max_new_tokens=256, temperature=0.0, top_p=1.0):
+        yield from self._generate(prompt, max_new_tokens, temperature, top_p, {})
+
+    def complete(self, prompt, max_new_tokens=256, temperature=0.0, top_p=1.0):
+        usage = {}
+        text = "".join(self._generate(prompt, max_new_tokens, temperature, top_p, usage))
+        return text.strip(), usage["completion_tokens"]
+
+class LlamaCppBackend:
+    name = "llama-cpp"
+
+    def __init__(self, gguf_path, n_ctx=4096, n_threads=None):
+        from llama_cpp import Llama
+        self.llm = Llama(model_path=gguf_path, n_ctx=n_ctx, n_threads=n_threads, n_gpu_layers=0, verbose=False)
+
+    def count_tokens(self, text):
+        return len(self.llm.tokenize(text.encode("utf-8")))
+
+    def stream(self, prompt, max_new_tokens=256, temperature=0.0, top_p=1.0):
+        chunks = self.llm.create_completion(prompt, max_tokens=max_new_tokens, temperature=temperature, top_p=top_p,
+                                            stop=list(STOP_STRINGS), stream=True)
+        for chunk in chunks:
+            text = chunk["choices"][0]["text"]
+            if text:
+                yield text
+
+    def complete(self, prompt, max_new_tokens=256, temperature=0.0, top_p=1.0):
+        out = self.llm.create_completion(prompt, max_tokens=max_new_tokens, temperature=temperature, top_p=top_p,
+                                         stop=list(STOP_STRINGS))
+        return out["choices"][0]["text"].strip(), out["usage"]["completion_tokens"]
+
+class LlamaServerBackend:
+    # llama.cpp's own HTTP server (/completion, /tokenize); cache_prompt keeps the prefix KV between calls
+    name = "llama-server"
+
+    def __init__(self, url="http://127.0.0.1:8080"):
+        import requests
+        self.session = requests.Session()
+        self.url = url.rstrip("/")
+
+    def count_tokens(self, text):
+        resp = self.session.post(f"{self.url}/tokenize", json={"content": text}, timeout=60)
+        resp.raise_for_status()
+        return len(resp.json()["tokens"])
+
+    def _body(self, prompt, max_new_tokens, temperature, top_p, stream):
+        return {"prompt": prompt, "n_predict": max_new_tokens, "temperature": temperature, "top_p": top_p,
+                "stop": list(STOP_STRINGS), "cache_prompt": True, "stream": stream}
+
+    def stream(self, prompt, max_new_tokens=256, temperature=0.0, top_p=1.0):
+        body = self._body(prompt, max_new_tokens, temperature, top_p, True)
+        with self.session.post(f"{self.url}/completion", json=body, stream=True, timeout=600) as resp:
+            resp.raise_for_status()
+            for line in resp.iter_lines():
+                if not line.startswith(b"data: "):
+                    continue
+                event = json.loads(line[len(b"data: "):])
+                if event.get("content"):
+                    yield event["content"]
+                if event.get("stop"):
+                    break
+
+    def complete(self, prompt, max_new_tokens=256, temperature=0.0, top_p=1.0):
+        resp = self.session.post(f"{self.url}/completion", json=self._body(prompt, max_new_tokens, temperature, top_p, False), timeout=600)
+        resp.raise_for_status()
+        out = resp.json()
+        return out["content"].strip(), out.get("tokens_predicted", 0)
+
+def make_backend(name, gguf_path=None, server_url=None, n_ctx=4096, n_threads=None):
+    # The transformers backend wraps an already-loaded model; build it with TransformersBackend(model, tokenizer)
+    if name == "llama-cpp":
+        if not gguf_path:
+            raise ValueError("--gguf is required for the llama-cpp backend (see gguf_export.py)")
+        return LlamaCppBackend(gguf_path, n_ctx, n_threads)
+    if name == "llama-server":
+        return LlamaServerBackend(server_url or "http://127.0.0.1:8080")
+    raise ValueError(f"Unknown backend '{name}' (choose from {', '.join(BACKENDS)})")
+
+class PromptChatSession:
+    # Multi-turn chat over any backend: same transcript format, truncation policy and stats as ChatSession
+    def __init__(self, backend, max_context=4096, max_new_tokens=256, temperature=0.7, top_p=0.9):
+        self.backend = backend
+        self.max_context = max_context
+        self.max_new_tokens = max_new_tokens
+        self.temperature = temperature
+        self.top_p = top_p
+        self.reset()
+
+    def reset(self):
+        self.turns = []
+
+    def ask(self, instruction, on_text=None, context=None):
+        start = time.perf_counter()
+        dropped = 0
+        current = with_context(instruction, context)  # context is not stored in self.turns
+        prompt = format_conversation(self.turns, current)
+        n_prompt = self.backend.count_tokens(prompt)
+        while self.turns and n_prompt + self.max_new_tokens > self.max_context:
+            self.turns.pop(0)
+            dropped += 1
+            prompt = format_conversation(self.turns, current)
+            n_prompt = self.backend.count_tokens(prompt)
+
+        parts, times = [], []
+        for chunk in self.backend.stream(prompt, self.max_new_tokens, self.temperature, self.top_p):
+            times.append(time.perf_counter())
+            if not parts:
+                chunk = chunk.lstrip()
+            parts.append(chunk)
+            if on_text and chunk:
+                on_text(chunk)
+        response = "".join(parts).strip()
+        self.turns.append((instruction, response))
+
+        gaps = sorted(b - a for a, b in zip(times, times[1:]))
+        return response, {
+            "prompt_tokens": n_prompt,
+            "new_tokens": len(times),
+            "dropped_turns": dropped,
+            "ttft_s": (times[0] if times else time.perf_counter()) - start,
+            "itl_mean_s": sum(gaps) / len(gaps) if gaps else 0.0,
+            "itl_p95_s": gaps[int(0.95 * (len(gaps) - 1))] if gaps else 0.0,
+            "decode_tok_s": len(gaps) / max(times[-1] - times[0], 1e-9) if gaps else 0.0,
+        }
@@ -0,0 +1,210 @@
+# jsonl_pipeline.py – One-pass JSONL pipeline chaining the clean / metadata / tag / salvage transforms
+#
+# Each line is parsed once, pushed through every stage, and serialized once. Stages take
+# (entry, ctx) and return the entry (possibly modified) or None to drop it. With --workers N
+# the input is split into N byte ranges on line boundaries, each range runs in its own process
+# into a temp shard, and shards are concatenated in order, so output is deterministic and in
+# the original order.
+#
+# Example – replaces clean_kwokbot_jsonl.py + add_metadata.py + tag_jsonl_concepts.py:
+#   python jsonl_pipeline.py ../data/kwokbot_train.jsonl ../data/kwokbot_train_ready.jsonl \
+#       --stages validate,add_metadata,concept_tags --workers 4
+
+import os
+import json
+import shutil
+import argparse
+import tempfile
+from collections import Counter
+from multiprocessing import Pool
+from clean_kwokbot_eval import clean_text
+from concept_tagger import tag_instruction, infer_concept_tags
+from kwokbot_record import AlpacaRecord, RecordCodec, RecordError, DECODE_ERRORS
+from jsonl_salvage import salvage_lines
+
+# -------------- Stages -------------- #
+def stage_validate(entry, ctx):
+    # clean_kwokbot_jsonl.py: Alpaca structure check + whitespace strip
+    if not isinstance(entry, dict):
+        return None
+    if "instruction" not in entry or "output" not in entry:
+        return None
+    if not entry["instruction"].strip() or not entry["output"].strip():
+        return None
+    entry["instruction"] = entry["instruction"].strip()
+    entry["input"] = entry.get("input", "").strip()
+    entry["output"] = entry["output"].strip()
+    return entry
+
+def stage_schema(entry, ctx):
+    # kwokbot_record.py: drop anything that isn't a well-typed Alpaca record
+    try:
+        AlpacaRecord.from_dict(entry)
+    except RecordError:
+        return None
+    return entry
+
+def stage_require_fields(entry, ctx):
+    # salvage_kwokbot_jsonl.py: keep only objects carrying the essential keys
+    if isinstance(entry, dict) and all(k in entry for k in ["instruction", "output"]):
+        return entry
+    return None
+
+def stage_clean_text(entry, ctx):
+    # clean_kwokbot_eval.py: strip control characters and collapse whitespace
+    entry["instruction"] = clean_text(entry.get("instruction", ""))
+    entry["input"] = clean_text(entry.get("input", ""))
+    entry["output"] = clean_text(entry.get("output", ""))
+    return entry
+
+def stage_add_metadata(entry, ctx):
+    # add_metadata.py: source/line/topic tags from the instruction text
+    entry["meta"] = {
+        "source": ctx["source"],
+        "line": ctx["line"],
+        "tags": tag_instruction(entry.get("instruction", ""))
+    }
+    return entry
+
+def stage_concept_tags(entry, ctx):
+    # tag_jsonl_concepts.py: concept-level tags from the output text
+    if "meta" not in entry:
+        entry["meta"] = {}
+    entry["meta"]["concept_tags"] = infer_concept_tags(entry.get("output", ""))
+    return entry
+
+STAGES = {
+    "validate": stage_validate,
+    "schema": stage_schema,
+    "require_fields": stage_require_fields,
+    "clean_text": stage_clean_text,
+    "add_metadata": stage_add_metadata,
+    "concept_tags": stage_concept_tags,
+}
+
+def resolve_stages(names):
+    unknown = [n for n in names if n not in STAGES]
+    if unknown:
+        raise ValueError(f"Unknown stage(s): {', '.join(unknown)} (choose from {', '.join(STAGES)})")
+    return [STAGES[n] for n in names]
+
+# -------------- Readers -------------- #
+def iter_lines(f, start, end, first_line):
+    # (line_no, text) for every line whose first byte lies in [start, end)
+    f.seek(start)
+    pos, line_no = start, first_line
+    while pos < end:
+        raw = f.readline()
+        if not raw:
+            break
+        pos += len(raw)
+        line_no += 1
+        yield line_no, raw.decode("utf-8")
+
+def iter_salvaged(f, start, end, first_line):
+    # Re-join objects that were split across several lines (jsonl_salvage.py); key checks are left to stages
+    lines = (text for _, text in iter_lines(f, start, end, first_line))
+    for line_no, obj in salvage_lines(lines, required_keys=()):
+        yield first_line + line_no, obj
+
+# -------------- Runner -------------- #
+def run_range(input_path, output_path, start, end, first_line, stage_names, source, ensure_ascii=True, salvage=False, codec="json"):
+    stages = resolve_stages(stage_names)
+    stats = Counter()
+    codec = RecordCodec(codec)
+    if codec.name == "json":
+        loads, dumps = json.loads, lambda entry: json.dumps(entry, ensure_ascii=ensure_ascii)
+    else:
+        loads, dumps = codec.loads, lambda entry: codec.dumps(entry).decode()
+    with open(input_path, "rb") as f, open(output_path, "w", encoding="utf-8") as out:
+        if salvage:
+            records = iter_salvaged(f, start, end, first_line)
+        else:
+            records = iter_lines(f, start, end, first_line)
+        for line_no, item in records:
+            if salvage:
+                entry = item
+            else:
+                if not item.strip():
+                    stats["empty"] += 1
+                    continue
+                try:
+                    entry = loads(item)
+                except DECODE_ERRORS:
+                    stats["bad_json"] += 1
+                    continue
+            ctx = {"line": line_no, "source": source}
+            for stage, name in zip(stages, stage_names):
+                entry = stage(entry, ctx)
+                if entry is None:
+                    stats[f"dropped_by_{name}"] += 1
+                    break
+            else:
+                out.write(dumps(entry) + "\n")
+                stats["written"] += 1
+    return stats
+
+def shard_ranges(path, shards):
+    # Split into byte ranges that start on line boundaries, with the line count before each start
+    size = os.path.getsize(path)
+    starts = [0]
+    with open(path, "rb") as f:
+        for i in range(1, shards):
+            f.seek(size * i // shards)
+            f.readline()
+            if f.tell() > starts[-1] and f.tell() < size:
+                starts.append(f.tell())
+        first_lines, count, pos = [0], 0, 0
+        f.seek(0)
+        for boundary in starts[1:]:
+            count += f.read(boundary - pos).count(b"\n")
+            pos = boundary
+            first_lines.append(count)
+    ends = starts[1:] + [size]
+    return list(zip(starts, ends, first_lines))
+
+def _run_shard(args):
+    return run_range(*args)
+
+def run_pipeline(input_path, output_path, stage_names, workers=1, ensure_ascii=True, salvage=False, source=None, codec="json"):
+    resolve_stages(stage_names)
+    source = source or os.path.basename(input_path)
+    size = os.path.getsize(input_path)
+    if workers <= 1 or salvage:
+        # Multi-line salvage needs to see the file as one stream
+        return run_range(input_path, output_path, 0, size, 0, stage_names, source, ensure_ascii, salvage, codec)
+
+    ranges = shard_ranges(input_path, workers)
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(output_path))) as tmp:
+        jobs = [
+            (input_path, os.path.join(tmp, f"shard_{i:04d}.jsonl"), start, end, first_line, stage_names, source, ensure_ascii, False, codec)
+            for i, (start, end, first_line) in enumerate(ranges)
+        ]
+        with Pool(min(workers, len(jobs))) as pool:
+            shard_stats = pool.map(_run_shard, jobs)
+        with open(output_path, "w", encoding="utf-8") as out:
+            for job in jobs:
+                with open(job[1], "r", encoding="utf-8") as shard:
+                    shutil.copyfileobj(shard, out)
+    return sum(shard_stats, Counter())
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run KwokBot JSONL transforms as one pipeline pass")
+    parser.add_argument("input")
+    parser.add_argument("output")
+    parser.add_argument("--stages", default="validate", help=f"comma-separated, in order: {', '.join(STAGES)}")
+    parser.add_argument("--workers", type=int, default=1, help="shard the file across this many processes")
+    parser.add_argument("--salvage", action="store_true", help="re-join JSON objects split across lines (single process)")
+    parser.add_argument("--no-ensure-ascii", dest="ensure_ascii", action="store_false",
+                        help="write non-ASCII characters as-is (like clean_kwokbot_eval.py)")
+    parser.add_argument("--source", default=None, help="meta.source for add_metadata (default: input file name)")
+    parser.add_argument("--codec", default="json", help="json (byte-compatible), orjson, msgspec or auto (compact output)")
+    args = parser.parse_args()
+
+    stage_names = [s.strip() for s in args.stages.split(",") if s.strip()]
+    stats = run_pipeline(args.input, args.output, stage_names, args.workers, args.ensure_ascii, args.salvage, args.source, args.codec)
+
+    print(f"[✓] {stats['written']} entries written to {args.output} ({' → '.join(stage_names)})")
+    for key, count in sorted(stats.items()):
+        if key != "written":
+            print(f"[!] {key}: {count}")
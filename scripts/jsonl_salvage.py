@@ -0,0 +1,163 @@
+# jsonl_salvage.py – Linear-time salvage of broken KwokBot JSONL dumps
+#
+# Like the old salvage scripts, non-empty lines are stripped and concatenated, so objects whose
+# strings were split across raw newlines still parse. Instead of re-running json.loads on the
+# whole buffer after every line (quadratic, and one bad fragment poisoned the rest of the
+# file), a JSONDecoder.raw_decode cursor walks a sliding window:
+#   - a complete value is consumed and the window advances past it;
+#   - an incomplete value waits for more input, but is only retried once the window has doubled,
+#     so a long object costs O(length) in total; a new line starting with "{" triggers a retry at
+#     once (it either continues the value or proves it truncated, so runs of cut-off records are
+#     skipped one by one instead of piling up);
+#   - the consumed part of the window is dropped once it outweighs the rest, so decoder errors
+#     (whose line/column are computed from the window start) stay proportional to the live data;
+#   - a corrupt span (or one longer than max_object_chars) is skipped by the resync strategy
+#     ("line": jump to the next line starting with "{", "brace": jump to the next "{") and
+#     recorded in the report with its line range and the decoder's error.
+
+import os
+import json
+import argparse
+from bisect import bisect_left, bisect_right
+from tqdm import tqdm
+
+INPUT_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), "../data/kwokbot_train.jsonl"))
+OUTPUT_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), "../data/kwokbot_salvaged.jsonl"))
+
+REQUIRED_KEYS = ("instruction", "output")
+_decoder = json.JSONDecoder()
+
+class SalvageReport:
+    def __init__(self):
+        self.recovered = 0
+        self.missing_keys = 0
+        self.skipped = []
+
+    def skip(self, start_line, end_line, chars, reason):
+        self.skipped.append({"start_line": start_line, "end_line": end_line, "chars": chars, "reason": reason})
+
+    def to_dict(self):
+        return {"recovered": self.recovered, "missing_keys": self.missing_keys,
+                "skipped_spans": len(self.skipped), "skipped_chars": sum(s["chars"] for s in self.skipped),
+                "skipped": self.skipped}
+
+def _is_incomplete(err, window):
+    # The value ran off the end of what we have so far (vs. being malformed mid-window)
+    return err.pos >= len(window) or err.msg.startswith("Unterminated string")
+
+def salvage_lines(lines, resync="line", max_object_chars=1 << 20, required_keys=REQUIRED_KEYS, report=None):
+    # Yields (line_no, obj) for every recovered object carrying required_keys
+    report = report if report is not None else SalvageReport()
+    window = ""
+    pending, pending_len = [], 0  # lines not yet joined into window (joined lazily, see retry_at)
+    offsets, line_nos = [], []    # window offset + line number of every line currently buffered
+    pos = 0                       # decode cursor into window
+    retry_at = 0                  # an incomplete value is retried once the buffer reaches this length
+
+    def line_at(offset):
+        return line_nos[max(0, bisect_right(offsets, offset) - 1)] if line_nos else 0
+
+    def skip_to(new_pos, reason):
+        report.skip(line_at(pos), line_at(max(pos, new_pos - 1)), new_pos - pos, reason)
+        return new_pos
+
+    def next_start(after):
+        if resync == "brace":
+            found = window.find("{", after + 1)
+            return found if found != -1 else len(window)
+        for i in range(bisect_right(offsets, after), len(offsets)):
+            if window.startswith("{", offsets[i]):
+                return offsets[i]
+        return len(window)
+
+    def compact():
+        # Drop everything before the cursor
+        nonlocal window, offsets, line_nos, pos, retry_at
+        window = window[pos:]
+        keep = bisect_left(offsets, pos)
+        offsets = [o - pos for o in offsets[keep:]]
+        line_nos = line_nos[keep:]
+        retry_at = max(0, retry_at - pos)
+        pos = 0
+
+    def drain(at_eof, force=False):
+        nonlocal window, pending, pending_len, pos, retry_at
+        while True:
+            total = len(window) + pending_len
+            if retry_at and not at_eof and not force and total < retry_at and total - pos <= max_object_chars:
+                return
+            if pending:
+                window += "".join(pending)
+                pending, pending_len = [], 0
+            if pos and 2 * pos >= len(window):
+                compact()  # amortized: each char is copied at most once per halving
+            while pos < len(window) and window[pos].isspace():
+                pos += 1
+            if pos >= len(window):
+                return
+            if window[pos] not in "{[":
+                pos = skip_to(next_start(pos), "not the start of a JSON object")
+                continue
+            try:
+                obj, end = _decoder.raw_decode(window, pos)
+            except json.JSONDecodeError as err:
+                oversized = len(window) - pos > max_object_chars
+                if _is_incomplete(err, window) and not at_eof and not oversized:
+                    retry_at = pos + 2 * (len(window) - pos)
+                    return
+                reason = "object exceeds max_object_chars" if oversized else err.msg
+                pos = skip_to(next_start(pos), f"{reason} (line {line_at(pos)})")
+                retry_at = 0
+                continue
+            retry_at = 0
+            line_no = line_at(end - 1)
+            pos = end
+            if isinstance(obj, dict) and all(k in obj for k in required_keys):
+                report.recovered += 1
+                yield line_no, obj
+            else:
+                report.missing_keys += 1
+
+    for line_no, line in enumerate(lines, 1):
+        stripped = line.strip()
+        if not stripped:
+            continue
+        # Compact once everything before the cursor is dead weight
+        if pos and (pos == len(window) or pos > (1 << 16)):
+            compact()
+        new_record = stripped[0] == "{" and (pending or pos < len(window))
+        offsets.append(len(window) + pending_len)
+        line_nos.append(line_no)
+        pending.append(stripped)
+        pending_len += len(stripped)
+        if new_record or stripped[-1] in "}]" or len(window) + pending_len - pos > max_object_chars:
+            yield from drain(at_eof=False, force=new_record)
+    yield from drain(at_eof=True)
+
+def salvage_file(input_path=INPUT_PATH, output_path=OUTPUT_PATH, resync="line", max_object_chars=1 << 20):
+    report = SalvageReport()
+    with open(input_path, "r") as infile, open(output_path, "w") as outfile:
+        lines = tqdm(infile, desc="Scanning for salvageable entries")
+        for _, obj in salvage_lines(lines, resync, max_object_chars, report=report):
+            outfile.write(json.dumps(obj) + "\n")
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recover Alpaca entries from a broken JSONL dump")
+    parser.add_argument("--input", default=INPUT_PATH)
+    parser.add_argument("--output", default=OUTPUT_PATH)
+    parser.add_argument("--resync", choices=["line", "brace"], default="line",
+                        help="after a corrupt span, restart at the next line beginning with '{' or at the next '{'")
+    parser.add_argument("--max-object-kb", type=int, default=1024, help="give up on a single object beyond this size")
+    parser.add_argument("--report", default=None, help="write a JSON report of skipped spans here")
+    args = parser.parse_args()
+
+    report = salvage_file(args.input, args.output, args.resync, args.max_object_kb * 1024)
+    print(f"[✓] Salvaged {report.recovered} entries and saved to: {args.output}")
+    if report.skipped or report.missing_keys:
+        print(f"[!] Skipped {len(report.skipped)} corrupt span(s), {report.missing_keys} object(s) missing instruction/output")
+        for span in report.skipped[:10]:
+            print(f"    lines {span['start_line']}-{span['end_line']}: {span['reason']}")
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(report.to_dict(), f, indent=2)
@@ -0,0 +1,139 @@
+# kwokbot_record.py – Typed Alpaca record schema + pluggable fast JSON codec
+#
+# Every KwokBot JSONL line is an Alpaca entry {"instruction", "input", "output", "meta"}.
+# `meta` varies by producer: convert_to_jsonl.py / add_metadata.py write `line`,
+# ocr_to_josnl.py writes `page`, tag_jsonl_concepts.py adds `concept_tags`, and the
+# pix2text scripts add filename/chapter/etc. Known keys get typed fields; anything else
+# is kept in `extra` so records round-trip without losing data.
+#
+# RecordCodec parses + validates in one call and uses orjson or msgspec when installed,
+# falling back to the stdlib json module otherwise.
+
+import json
+from dataclasses import dataclass, field
+from typing import Optional
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+class RecordError(ValueError):
+    pass
+
+def _check(value, expected, name):
+    if not isinstance(value, expected) or (expected is int and isinstance(value, bool)):
+        raise RecordError(f"{name} must be {expected.__name__}, got {type(value).__name__}")
+    return value
+
+def _check_str_list(value, name):
+    _check(value, list, name)
+    for i, item in enumerate(value):
+        _check(item, str, f"{name}[{i}]")
+    return value
+
+@dataclass
+class Meta:
+    source: Optional[str] = None
+    line: Optional[int] = None
+    page: Optional[int] = None
+    tags: Optional[list] = None
+    concept_tags: Optional[list] = None
+    extra: dict = field(default_factory=dict)
+
+    KNOWN = ("source", "line", "page", "tags", "concept_tags")
+
+    @classmethod
+    def from_dict(cls, d):
+        _check(d, dict, "meta")
+        meta = cls(extra={k: v for k, v in d.items() if k not in cls.KNOWN})
+        if "source" in d:
+            meta.source = _check(d["source"], str, "meta.source")
+        if "line" in d:
+            meta.line = _check(d["line"], int, "meta.line")
+        if "page" in d:
+            meta.page = _check(d["page"], int, "meta.page")
+        if "tags" in d:
+            meta.tags = _check_str_list(d["tags"], "meta.tags")
+        if "concept_tags" in d:
+            meta.concept_tags = _check_str_list(d["concept_tags"], "meta.concept_tags")
+        return meta
+
+    def to_dict(self):
+        d = {k: getattr(self, k) for k in self.KNOWN if getattr(self, k) is not None}
+        d.update(self.extra)
+        return d
+
+@dataclass
+class AlpacaRecord:
+    instruction: str
+    output: str
+    input: str = ""
+    meta: Optional[Meta] = None
+
+    @classmethod
+    def from_dict(cls, d):
+        _check(d, dict, "record")
+        for key in ("instruction", "output"):
+            if key not in d:
+                raise RecordError(f"missing required field '{key}'")
+        unknown = set(d) - {"instruction", "input", "output", "meta"}
+        if unknown:
+            raise RecordError(f"unexpected field(s): {', '.join(sorted(unknown))}")
+        return cls(
+            instruction=_check(d["instruction"], str, "instruction"),
+            output=_check(d["output"], str, "output"),
+            input=_check(d.get("input", ""), str, "input"),
+            meta=Meta.from_dict(d["meta"]) if d.get("meta") is not None else None,
+        )
+
+    def to_dict(self):
+        d = {"instruction": self.instruction, "input": self.input, "output": self.output}
+        if self.meta is not None:
+            d["meta"] = self.meta.to_dict()
+        return d
+
+# -------------- Codecs -------------- #
+def _stdlib_dumps(obj):
+    return json.dumps(obj).encode()
+
+BACKENDS = {"json": (json.loads, _stdlib_dumps)}
+DECODE_ERRORS = (ValueError,)
+if orjson is not None:
+    BACKENDS["orjson"] = (orjson.loads, orjson.dumps)
+if msgspec is not None:
+    BACKENDS["msgspec"] = (msgspec.json.decode, msgspec.json.encode)
+    DECODE_ERRORS += (msgspec.DecodeError,)
+
+def resolve_backend(name="auto"):
+    if name == "auto":
+        for candidate in ("orjson", "msgspec", "json"):
+            if candidate in BACKENDS:
+                return candidate
+    if name not in BACKENDS:
+        print(f"[!] JSON backend '{name}' not installed, falling back to stdlib json")
+        return "json"
+    return name
+
+class RecordCodec:
+    # loads/dumps work on plain dicts; decode/encode on validated AlpacaRecords.
+    # Only the "json" backend reproduces json.dumps byte-for-byte (", " separators,
+    # ASCII escapes); orjson/msgspec write compact UTF-8 that parses to the same data.
+    def __init__(self, backend="auto"):
+        self.name = resolve_backend(backend)
+        self.loads, self.dumps = BACKENDS[self.name]
+
+    def decode(self, line):
+        try:
+            obj = self.loads(line)
+        except DECODE_ERRORS as e:
+            raise RecordError(f"invalid JSON: {e}") from e
+        return AlpacaRecord.from_dict(obj)
+
+    def encode(self, record):
+        return self.dumps(record.to_dict())
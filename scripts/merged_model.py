@@ -0,0 +1,172 @@
+# merged_model.py – Merge the KwokBot LoRA adapter into the base weights for fast inference startup
+#
+# export: base model + adapter -> merge_and_unload() -> one safetensors artifact (+ tokenizer),
+#         stored as float32, bf16, or int8 (per-output-channel symmetric weight-only quantization
+#         of every 2D weight, dequantized to the requested dtype at load time). int8 only shrinks
+#         the file on disk (about half of bf16); in memory the model is as large as a bf16 export.
+# load_merged(): what chat_kwokbot.py / evaluate_kwokbot.py call. bf16/float32 exports go through
+#         from_pretrained(low_cpu_mem_usage=True), which memory-maps the safetensors file;
+#         int8 exports are read tensor by tensor with safe_open and assigned into a model built
+#         without allocated weights (init_empty_weights), so only one float copy exists.
+# bench:  cold start and per-token latency, current base+PeftModel path vs. the merged artifact;
+#         each load runs in a fresh subprocess so neither benefits from the other's warm state.
+#
+# Usage:
+#   python merged_model.py export --dtype bf16
+#   python merged_model.py bench --device cpu
+
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+import torch
+from runtime import select_runtime
+
+BASE_MODEL_PATH = "/Users/mdanylchuk/Documents/FKwokBot/models/mistral-7b-hf"
+LORA_PATH = "/Users/mdanylchuk/Documents/FKwokBot/output/kwokbot-lora"
+MERGED_PATH = "/Users/mdanylchuk/Documents/FKwokBot/output/kwokbot-merged"
+
+EXPORT_INFO = "kwokbot_export.json"
+INT8_FILE = "model.int8.safetensors"
+DTYPES = {"float32": torch.float32, "bf16": torch.bfloat16, "float16": torch.float16}
+
+def is_merged_export(path):
+    return os.path.isfile(os.path.join(path, EXPORT_INFO))
+
+# -------------- Export -------------- #
+def quantize_int8(tensor):
+    # Symmetric per-output-channel: w ≈ q * scale, q in [-127, 127]
+    w = tensor.float()
+    scale = (w.abs().amax(dim=1, keepdim=True) / 127).clamp(min=1e-12)
+    q = torch.round(w / scale).clamp(-127, 127).to(torch.int8)
+    return q, scale.to(torch.float16)
+
+def export_merged(base_path=BASE_MODEL_PATH, lora_path=LORA_PATH, out_dir=MERGED_PATH, dtype="bf16"):
+    from transformers import AutoTokenizer, AutoModelForCausalLM
+    from peft import PeftModel
+    from safetensors.torch import save_file
+
+    start = time.perf_counter()
+    print("🧠 Loading base model + adapter...")
+    base = AutoModelForCausalLM.from_pretrained(base_path, torch_dtype=torch.float32, low_cpu_mem_usage=True)
+    model = PeftModel.from_pretrained(base, lora_path).merge_and_unload()  # W += B·A·(alpha/r), adapter layers removed
+    tokenizer = AutoTokenizer.from_pretrained(lora_path if os.path.isfile(os.path.join(lora_path, "tokenizer_config.json")) else base_path)
+    os.makedirs(out_dir, exist_ok=True)
+
+    if dtype == "int8":
+        state = {}
+        for name, tensor in model.state_dict().items():
+            if tensor.dim() == 2 and tensor.is_floating_point():
+                state[name], state[name + ".scale"] = quantize_int8(tensor)
+            else:
+                state[name] = tensor.to(torch.bfloat16) if tensor.is_floating_point() else tensor
+        # Tied weights share storage; safetensors refuses aliases, so store contiguous copies
+        save_file({k: v.contiguous().clone() for k, v in state.items()}, os.path.join(out_dir, INT8_FILE))
+        model.config.save_pretrained(out_dir)
+        if model.generation_config is not None:
+            model.generation_config.save_pretrained(out_dir)
+    else:
+        model.to(DTYPES[dtype]).save_pretrained(out_dir, safe_serialization=True)
+    tokenizer.save_pretrained(out_dir)
+
+    with open(os.path.join(out_dir, EXPORT_INFO), "w") as f:
+        json.dump({"base_model": base_path, "lora": lora_path, "dtype": dtype}, f, indent=2)
+    size = sum(os.path.getsize(os.path.join(out_dir, n)) for n in os.listdir(out_dir) if n.endswith(".safetensors"))
+    print(f"[✓] Merged {dtype} model written to {out_dir} ({size / 1e9:.2f} GB) in {time.perf_counter() - start:.0f}s")
+
+# -------------- Load -------------- #
+def load_merged(path=MERGED_PATH, dtype=None, device="cpu"):
+    # Returns (model, tokenizer). dtype (name or torch.dtype) defaults to the export dtype (bf16 for int8 exports).
+    from transformers import AutoConfig, AutoTokenizer, AutoModelForCausalLM
+    with open(os.path.join(path, EXPORT_INFO)) as f:
+        info = json.load(f)
+    tokenizer = AutoTokenizer.from_pretrained(path)
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+
+    if info["dtype"] == "int8":
+        from safetensors import safe_open
+        target = dtype if isinstance(dtype, torch.dtype) else DTYPES[dtype or "bf16"]
+        state = {}
+        with safe_open(os.path.join(path, INT8_FILE), framework="pt") as f:
+            names = [n for n in f.keys() if not n.endswith(".scale")]
+            for name in names:
+                tensor = f.get_tensor(name)
+                if tensor.dtype == torch.int8:
+                    tensor = (tensor.to(target) * f.get_tensor(name + ".scale").to(target))
+                state[name] = tensor.to(target) if tensor.is_floating_point() else tensor
+        from accelerate import init_empty_weights
+        config = AutoConfig.from_pretrained(path)
+        with init_empty_weights():  # parameters on the meta device; buffers (rotary freqs) are real
+            model = AutoModelForCausalLM.from_config(config, torch_dtype=target)
+        model.load_state_dict(state, assign=True)  # takes the dequantized tensors as the parameters
+        model.tie_weights()
+    else:
+        target = dtype if isinstance(dtype, torch.dtype) else DTYPES[dtype or info["dtype"]]
+        model = AutoModelForCausalLM.from_pretrained(path, torch_dtype=target,
+                                                     low_cpu_mem_usage=True)
+    return model.to(device).eval(), tokenizer
+
+def load_peft(base_path=BASE_MODEL_PATH, lora_path=LORA_PATH, device="cpu"):
+    # The current chat_kwokbot.py path: float32 base + runtime adapter
+    from transformers import AutoTokenizer, AutoModelForCausalLM
+    from peft import PeftModel
+    tokenizer = AutoTokenizer.from_pretrained(base_path)
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+    base = AutoModelForCausalLM.from_pretrained(base_path, torch_dtype=torch.float32, device_map={"": device})
+    return PeftModel.from_pretrained(base, lora_path).eval(), tokenizer
+
+# -------------- Bench -------------- #
+def time_generation(model, tokenizer, n_tokens=64, device="cpu"):
+    inputs = tokenizer("Explain the Poynting vector.", return_tensors="pt").to(device)
+    with torch.no_grad():
+        model.generate(**inputs, max_new_tokens=4, do_sample=False, pad_token_id=tokenizer.pad_token_id)  # warm-up
+        start = time.perf_counter()
+        out = model.generate(**inputs, max_new_tokens=n_tokens, min_new_tokens=n_tokens, do_sample=False,
+                             pad_token_id=tokenizer.pad_token_id)
+    produced = out.shape[1] - inputs["input_ids"].shape[1]
+    return (time.perf_counter() - start) / max(produced, 1)
+
+def bench_one(kind, args):
+    # Runs in a subprocess: prints one JSON line with load and per-token timings
+    runtime = select_runtime(device=args.device)  # same thread settings for both paths
+    start = time.perf_counter()
+    if kind == "peft":
+        model, tokenizer = load_peft(args.base_model, args.lora, args.device)
+    else:
+        model, tokenizer = load_merged(args.merged, runtime.dtype, args.device)
+    load_s = time.perf_counter() - start
+    per_token = time_generation(model, tokenizer, args.tokens, args.device)
+    print(json.dumps({"kind": kind, "load_s": load_s, "per_token_ms": per_token * 1000}))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export / load / benchmark a merged KwokBot model")
+    parser.add_argument("command", choices=["export", "bench", "bench-one"])
+    parser.add_argument("--base-model", default=BASE_MODEL_PATH)
+    parser.add_argument("--lora", default=LORA_PATH)
+    parser.add_argument("--merged", default=MERGED_PATH)
+    parser.add_argument("--dtype", choices=["float32", "bf16", "float16", "int8"], default="bf16",
+                        help="export dtype; int8 only halves the file size, it is dequantized to bf16 when loaded")
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--tokens", type=int, default=64, help="tokens generated for the per-token latency")
+    parser.add_argument("--kind", choices=["peft", "merged"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.command == "export":
+        export_merged(args.base_model, args.lora, args.merged, args.dtype)
+    elif args.command == "bench-one":
+        bench_one(args.kind, args)
+    else:
+        results = {}
+        for kind in ("peft", "merged"):
+            cmd = [sys.executable, os.path.abspath(__file__), "bench-one", "--kind", kind, "--base-model", args.base_model,
+                   "--lora", args.lora, "--merged", args.merged, "--device", args.device, "--tokens", str(args.tokens)]
+            out = subprocess.run(cmd, capture_output=True, text=True, check=True).stdout
+            results[kind] = json.loads(out.strip().splitlines()[-1])
+        print(f"{'path':28s} {'cold start':>12s} {'per token':>12s}")
+        for kind, label in (("peft", "base fp32 + PeftModel"), ("merged", f"merged ({args.merged})")):
+            r = results[kind]
+            print(f"{label[:28]:28s} {r['load_s']:10.1f} s {r['per_token_ms']:9.1f} ms")
@@ -0,0 +1,114 @@
+# ocr_cache.py – Content-addressed on-disk cache for Mathpix / GPT-4V extraction results
+#
+# Keys are sha256(kind + request options + file/page bytes), so a rebuild over unchanged
+# materials is served entirely from disk. Callers put the API endpoint in the options, so a
+# benchmark against fake_mathpix_server.py never feeds its placeholder text to a real run. Values live in a single SQLite file with
+# size-bounded LRU eviction; safe to share between the pipelined OCR worker threads.
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+DEFAULT_CACHE_PATH = os.path.join(ROOT, "cache", "ocr_cache.sqlite")
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+class OCRCache:
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_bytes=DEFAULT_MAX_BYTES, enabled=True, refresh=False):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self.refresh = refresh
+        self.stats = {"hits": 0, "misses": 0, "writes": 0, "evictions": 0}
+        self.lock = threading.Lock()
+        self.conn = None
+
+    def _db(self):
+        if self.conn is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self.conn = sqlite3.connect(self.path, check_same_thread=False)
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, last_used REAL NOT NULL)"
+            )
+            self.conn.execute("CREATE INDEX IF NOT EXISTS entries_last_used ON entries(last_used)")
+        return self.conn
+
+    @staticmethod
+    def key(kind, data, options=None):
+        h = hashlib.sha256()
+        h.update(kind.encode())
+        h.update(b"\0")
+        h.update(json.dumps(options or {}, sort_keys=True).encode())
+        h.update(b"\0")
+        h.update(data)
+        return h.hexdigest()
+
+    def get(self, key):
+        if not self.enabled or self.refresh:
+            self.stats["misses"] += 1
+            return None
+        with self.lock:
+            db = self._db()
+            row = db.execute("SELECT value FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.stats["misses"] += 1
+                return None
+            db.execute("UPDATE entries SET last_used = ? WHERE key = ?", (time.time(), key))
+            db.commit()
+            self.stats["hits"] += 1
+            return json.loads(row[0])
+
+    def put(self, key, value):
+        if not self.enabled:
+            return
+        raw = json.dumps(value)
+        with self.lock:
+            db = self._db()
+            db.execute(
+                "INSERT OR REPLACE INTO entries (key, value, size, last_used) VALUES (?, ?, ?, ?)",
+                (key, raw, len(raw), time.time()),
+            )
+            self.stats["writes"] += 1
+            self._evict(db)
+            db.commit()
+
+    def _evict(self, db):
+        total = db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in db.execute("SELECT key, size FROM entries ORDER BY last_used").fetchall():
+            if total <= self.max_bytes:
+                break
+            db.execute("DELETE FROM entries WHERE key = ?", (key,))
+            total -= size
+            self.stats["evictions"] += 1
+
+    def summary(self):
+        lookups = self.stats["hits"] + self.stats["misses"]
+        rate = (self.stats["hits"] / lookups * 100) if lookups else 0.0
+        return (f"hits={self.stats['hits']} misses={self.stats['misses']} ({rate:.1f}% hit rate) "
+                f"writes={self.stats['writes']} evictions={self.stats['evictions']}")
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+def add_cache_args(parser):
+    parser.add_argument("--no-cache", action="store_true", help="bypass the OCR result cache entirely")
+    parser.add_argument("--refresh", action="store_true", help="ignore cached results but store fresh ones")
+    parser.add_argument("--cache-path", default=DEFAULT_CACHE_PATH, help="SQLite file for cached OCR results")
+    parser.add_argument("--cache-max-mb", type=float, default=DEFAULT_MAX_BYTES / (1024 * 1024),
+                        help="evict least-recently-used results beyond this size")
+
+def cache_from_args(args):
+    return OCRCache(
+        path=args.cache_path,
+        max_bytes=int(args.cache_max_mb * 1024 * 1024),
+        enabled=not args.no_cache,
+        refresh=args.refresh,
+    )
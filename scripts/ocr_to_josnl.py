@@ -5,17 +5,24 @@ import os
 import base64
 import json
 import time
-import fitz  # PyMuPDF
+import argparse
+import threading
 import requests
 from PIL import Image
 from dotenv import load_dotenv
 from tqdm import tqdm
-from collections import defaultdict
+from collections import defaultdict, deque
+from urllib.parse import urlsplit
+from concurrent.futures import ThreadPoolExecutor
+from ocr_cache import OCRCache, add_cache_args, cache_from_args
+from rasterize import iter_page_images, add_raster_args, raster_options_from_args
+from build_manifest import BuildManifest, manifest_path_for, run_incremental
 
 # Load API keys
 load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), ".env"))
 MATHPIX_APP_ID = os.getenv("MATHPIX_APP_ID")
 MATHPIX_APP_KEY = os.getenv("MATHPIX_APP_KEY")
+MATHPIX_API_URL = os.getenv("MATHPIX_API_URL", "https://api.mathpix.com").rstrip("/")
 
 # Paths
 ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
@@ -25,57 +32,159 @@ PDF_FOLDERS = [
 ]
 OUTPUT_IMAGES = os.path.join(ROOT, "output_images")
 OUTPUT_JSONL = os.path.join(ROOT, "data", "kwokbot_fallback.jsonl")
-os.makedirs(OUTPUT_IMAGES, exist_ok=True)
+CACHE = OCRCache()
+RASTER_OPTIONS = {"dpi": 300, "fmt": "png", "quality": 85, "grayscale": False}
+# Part of the cache key and manifest config, so results from a test server (fake_mathpix_server.py)
+# are never served to a run against the real API
+MATHPIX_TEXT_CACHE_OPTIONS = {"formats": ["text"], "endpoint": MATHPIX_API_URL}
+SAVE_IMAGES = True
 
 # Helpers
-def convert_pdf_to_images(pdf_path):
-    doc = fitz.open(pdf_path)
-    images = []
-    for page_num in range(len(doc)):
-        pix = doc.load_page(page_num).get_pixmap(dpi=300)
-        img_path = os.path.join(OUTPUT_IMAGES, f"{os.path.basename(pdf_path).replace('.pdf','')}_page_{page_num}.png")
-        pix.save(img_path)
-        images.append((page_num, img_path))
-    return images
-
-def mathpix_image_ocr(image_path):
-    with open(image_path, "rb") as f:
-        b64_img = base64.b64encode(f.read()).decode()
+def iter_pdf_images(pdf_path):
+    # Rasterize lazily so OCR of page N can overlap rendering of page N+1;
+    # pages are kept in output_images/ (for the pix2text scripts) unless --no-save-images
+    save_dir = OUTPUT_IMAGES if SAVE_IMAGES else None
+    return iter_page_images(pdf_path, save_dir=save_dir, **RASTER_OPTIONS)
+
+def mathpix_image_ocr(img_bytes, mime="image/png", limiter=None):
+    cache_key = CACHE.key("mathpix_text", img_bytes, MATHPIX_TEXT_CACHE_OPTIONS)
+    cached = CACHE.get(cache_key)
+    if cached is not None:
+        return cached
+    b64_img = base64.b64encode(img_bytes).decode()
     headers = {
         "app_id": MATHPIX_APP_ID,
         "app_key": MATHPIX_APP_KEY,
         "Content-type": "application/json"
     }
     payload = {
-        "src": f"data:image/png;base64,{b64_img}",
+        "src": f"data:{mime};base64,{b64_img}",
         "formats": ["text"]
     }
-    res = requests.post("https://api.mathpix.com/v3/text", headers=headers, json=payload)
-    return res.json().get("text", "")
+    if limiter:
+        limiter.wait(f"{MATHPIX_API_URL}/v3/text")
+    result = requests.post(f"{MATHPIX_API_URL}/v3/text", headers=headers, json=payload).json()
+    text = result.get("text", "")
+    if "error" not in result:
+        CACHE.put(cache_key, text)
+    return text
+
+def make_entry(pdf_path, page_num, text, tag_counter):
+    if len(text.strip()) < 10:
+        return None
+    tags = ["ocr"]
+    tag_counter["ocr"] += 1
+    return {
+        "instruction": "Explain or derive the following expression or concept from EE 140 class:",
+        "input": "",
+        "output": text.strip(),
+        "meta": {
+            "source": os.path.basename(pdf_path),
+            "page": page_num,
+            "tags": tags
+        }
+    }
 
 def process_pdf(pdf_path, tag_counter):
     entries = []
     print(f"[🧠] OCR-only processing: {os.path.basename(pdf_path)}")
-    for page_num, image_path in convert_pdf_to_images(pdf_path):
-        text = mathpix_image_ocr(image_path)
-        if len(text.strip()) < 10:
-            continue
-        tags = ["ocr"]
-        tag_counter["ocr"] += 1
-        entries.append({
-            "instruction": "Explain or derive the following expression or concept from EE 140 class:",
-            "input": "",
-            "output": text.strip(),
-            "meta": {
-                "source": os.path.basename(pdf_path),
-                "page": page_num,
-                "tags": tags
-            }
-        })
+    for page in iter_pdf_images(pdf_path):
+        entry = make_entry(pdf_path, page.page_num, mathpix_image_ocr(page.data, page.mime), tag_counter)
+        if entry:
+            entries.append(entry)
     return entries
 
+# -------------- Pipelined mode -------------- #
+class HostRateLimiter:
+    # Spaces out requests to each host so we never exceed `rate` requests/sec per host
+    def __init__(self, rate=None):
+        self.interval = 1.0 / rate if rate else 0.0
+        self.next_slot = defaultdict(float)
+        self.lock = threading.Lock()
+
+    def wait(self, url):
+        if not self.interval:
+            return
+        host = urlsplit(url).netloc
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot[host])
+            self.next_slot[host] = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+def ocr_pages_pipelined(pdf_files, workers=8, rate=None):
+    # Yields (pdf_path, page_num, text) in (source, page) order while keeping up to
+    # `workers` OCR requests in flight and rasterizing the next pages meanwhile
+    limiter = HostRateLimiter(rate)
+    slots = threading.BoundedSemaphore(workers)
+    pending = deque()
+
+    def ocr_page(page):
+        try:
+            return mathpix_image_ocr(page.data, page.mime, limiter)
+        finally:
+            slots.release()
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for pdf_path in pdf_files:
+            for page in iter_pdf_images(pdf_path):
+                slots.acquire()
+                pending.append((pdf_path, page.page_num, pool.submit(ocr_page, page)))
+                while pending and pending[0][2].done():
+                    done_pdf, done_page, fut = pending.popleft()
+                    yield done_pdf, done_page, fut.result()
+        while pending:
+            done_pdf, done_page, fut = pending.popleft()
+            yield done_pdf, done_page, fut.result()
+
+def process_pdfs_serial(pdf_files, tag_counter, on_source_done=None):
+    entries = []
+    with tqdm(total=len(pdf_files), desc="OCR Fallback Progress", unit="pdf") as overall:
+        for pdf_path in pdf_files:
+            pdf_entries = process_pdf(pdf_path, tag_counter)
+            if on_source_done:
+                on_source_done(pdf_path, pdf_entries)
+            entries.extend(pdf_entries)
+            overall.update(1)
+    return entries
+
+def process_pdfs_pipelined(pdf_files, tag_counter, workers=8, rate=None, on_source_done=None):
+    entries_by_pdf = {pdf_path: [] for pdf_path in pdf_files}
+    done, current = set(), None
+    with tqdm(desc="OCR Fallback Progress", unit="page") as overall:
+        for pdf_path, page_num, text in ocr_pages_pipelined(pdf_files, workers, rate):
+            # Pages arrive in (source, page) order, so a new source means the previous one is complete
+            if on_source_done and current not in (None, pdf_path):
+                on_source_done(current, entries_by_pdf[current])
+                done.add(current)
+            current = pdf_path
+            entry = make_entry(pdf_path, page_num, text, tag_counter)
+            if entry:
+                entries_by_pdf[pdf_path].append(entry)
+            overall.update(1)
+    if on_source_done:
+        for pdf_path in pdf_files:
+            if pdf_path not in done:
+                on_source_done(pdf_path, entries_by_pdf[pdf_path])
+    return [e for pdf_path in pdf_files for e in entries_by_pdf[pdf_path]]
+
 if __name__ == "__main__":
-    all_entries = []
+    parser = argparse.ArgumentParser(description="KwokBot OCR-only fallback extractor")
+    parser.add_argument("--pipelined", action="store_true", help="overlap rasterization with concurrent OCR requests")
+    parser.add_argument("--workers", type=int, default=8, help="max OCR requests in flight (pipelined mode)")
+    parser.add_argument("--rate", type=float, default=None, help="max requests/sec per host (pipelined mode)")
+    parser.add_argument("--output", default=OUTPUT_JSONL, help="output JSONL path")
+    parser.add_argument("--incremental", action="store_true",
+                        help="only reprocess new/changed PDFs (tracked in <output>.manifest); resumes after a crash")
+    add_cache_args(parser)
+    add_raster_args(parser, save_default=True)
+    args = parser.parse_args()
+    OUTPUT_JSONL = args.output
+    RASTER_OPTIONS = raster_options_from_args(args)
+    SAVE_IMAGES = args.save_images
+    CACHE = cache_from_args(args)
+
     tag_counter = defaultdict(int)
 
     pdf_files = []
@@ -83,14 +192,22 @@ if __name__ == "__main__":
         if os.path.exists(folder):
             pdf_files.extend([os.path.join(folder, f) for f in os.listdir(folder) if f.endswith(".pdf")])
 
-    with tqdm(total=len(pdf_files), desc="OCR Fallback Progress", unit="pdf") as overall:
-        for pdf_path in pdf_files:
-            all_entries.extend(process_pdf(pdf_path, tag_counter))
-            overall.update(1)
+    def run(files, on_source_done=None):
+        if args.pipelined:
+            return process_pdfs_pipelined(files, tag_counter, args.workers, args.rate, on_source_done)
+        return process_pdfs_serial(files, tag_counter, on_source_done)
+
+    if args.incremental:
+        manifest = BuildManifest(manifest_path_for(OUTPUT_JSONL), config=dict(RASTER_OPTIONS, endpoint=MATHPIX_API_URL))
+        all_entries = run_incremental(pdf_files, manifest, run, tag_counter)
+    else:
+        all_entries = run(pdf_files)
 
     with open(OUTPUT_JSONL, "w") as f:
         for e in all_entries:
             f.write(json.dumps(e) + "\n")
 
     print(f"\n[✓] Fallback OCR done! {len(all_entries)} entries saved to {OUTPUT_JSONL}")
+    print(f"[💾] OCR cache: {CACHE.summary()}")
+    CACHE.close()
 
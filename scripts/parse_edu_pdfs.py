@@ -1,63 +1,59 @@
-import os
-import json
+import argparse
 from pathlib import Path
 from datetime import datetime
-from pix2text import Pix2Text
+from pix2text_pages import run_pages, add_pool_args
 
 # Paths
 INPUT_DIR = Path("~/Documents/FKwokBot/output_images").expanduser()
 OUTPUT_PATH = Path("~/Documents/FKwokBot/data/kwokbot_textbook_pix2text.jsonl").expanduser()
 OUTPUT_PATH.parent.mkdir(parents=True, exist_ok=True)
 
-# Pix2Text Init
-p2t = Pix2Text()
-
 # Helper to get chapter number
 def guess_chapter_from_filename(name: str):
     import re
     match = re.search(r"Chapter[_\s]*(\d+)", name)
     return int(match.group(1)) if match else None
 
+# One entry per Pix2Text chunk
+def page_entries(img_path, result):
+    # Normalize result
+    if isinstance(result, dict):
+        result = [result]
+
+    chapter = guess_chapter_from_filename(img_path.name)
+
+    entries = []
+    for i, chunk in enumerate(result):
+        text = chunk.get("text", "").strip()
+        if not text or len(text) < 10:
+            continue
+        now = datetime.now().isoformat()
+        entries.append({
+            "instruction": "Use this textbook image chunk for reference.",
+            "input": "",
+            "output": text,
+            "meta": {
+                "source": str(img_path),
+                "filename": img_path.name,
+                "chunk_id": i,
+                "type": "TextBook",
+                "timestamp": now,
+                "timestamp_cleaned": now,
+                "cleaned": True,
+                "chapter": chapter
+            }
+        })
+    return entries
+
 # Main Parsing Loop
-entries = []
-for img_path in sorted(INPUT_DIR.glob("*.png")):
-    print(f"🔍 Scanning {img_path.name}...")
-    try:
-        result = p2t(img_path)
-
-        # Normalize result
-        if isinstance(result, dict):
-            result = [result]
-
-        chapter = guess_chapter_from_filename(img_path.name)
-
-        for i, chunk in enumerate(result):
-            text = chunk.get("text", "").strip()
-            if not text or len(text) < 10:
-                continue
-            entries.append({
-                "instruction": "Use this textbook image chunk for reference.",
-                "input": "",
-                "output": text,
-                "meta": {
-                    "source": str(img_path),
-                    "filename": img_path.name,
-                    "chunk_id": i,
-                    "type": "TextBook",
-                    "timestamp": datetime.now().isoformat(),
-                    "timestamp_cleaned": datetime.now().isoformat(),
-                    "cleaned": True,
-                    "chapter": chapter
-                }
-            })
-    except Exception as e:
-        print(f"❌ Failed on {img_path.name}: {e}")
-
-# Save
-with open(OUTPUT_PATH, "w") as f:
-    for entry in entries:
-        json.dump(entry, f)
-        f.write("\n")
-
-print(f"\n✅ DONE — Parsed {len(entries)} chunks from PNGs in {INPUT_DIR}")
-print(f"📄 Saved to {OUTPUT_PATH}")
\ No newline at end of file
+if __name__ == "__main__":
+    parser = add_pool_args(argparse.ArgumentParser(description="Parse textbook page PNGs into per-chunk entries with Pix2Text"))
+    args = parser.parse_args()
+
+    count, failed = run_pages(INPUT_DIR.glob("*.png"), page_entries, OUTPUT_PATH, args.workers,
+                              config={"parser": "parse_edu_pdfs"})
+
+    print(f"\n✅ DONE — Parsed {count} chunks from PNGs in {INPUT_DIR}")
+    print(f"📄 Saved to {OUTPUT_PATH}")
+    if failed:
+        print(f"❌ {len(failed)} page(s) failed and will be retried on the next run: {', '.join(failed)}")
@@ -1,16 +1,13 @@
-import os
-import json
+import argparse
 from pathlib import Path
 from datetime import datetime
-from pix2text import Pix2Text
 from collections.abc import Iterable
+from pix2text_pages import run_pages, add_pool_args
 
 INPUT_DIR = Path("~/Documents/FKwokBot/output_images").expanduser()
 OUTPUT_PATH = Path("~/Documents/FKwokBot/data/kwokbot_textbook_pix2text.jsonl").expanduser()
 OUTPUT_PATH.parent.mkdir(parents=True, exist_ok=True)
 
-p2t = Pix2Text()
-
 ALLOWED_TYPES = {"title", "plain text", "text", "isolate_formula", "formula", "caption", "embedding"}
 
 def guess_chapter_from_filename(name: str):
@@ -24,62 +21,58 @@ def ensure_list(x):
     else:
         return [x]
 
-all_entries = []
-
-for img_path in sorted(INPUT_DIR.glob("*.png")):
-    print(f"🔍 Scanning {img_path.name}...")
-    try:
-        result = p2t(img_path)
-        chunks = ensure_list(result)
-
-        page_text = []
-        for chunk in chunks:
-            text = ""
-            label = ""
-
-            if isinstance(chunk, dict):
-                text = chunk.get("text", "").strip()
-                label = chunk.get("type", "").lower()
-            elif hasattr(chunk, "text"):
-                text = str(chunk.text).strip()
-                label = getattr(chunk, "type", "").lower()
-            else:
-                continue
-
-            if text and len(text) > 10 and label in ALLOWED_TYPES:
-                page_text.append(text)
-
-        if not page_text:
-            print(f"⚠️  No usable content in {img_path.name}")
+def page_entries(img_path, result):
+    # One entry per page: the allowed chunks joined in reading order
+    chunks = ensure_list(result)
+
+    page_text = []
+    for chunk in chunks:
+        text = ""
+        label = ""
+
+        if isinstance(chunk, dict):
+            text = chunk.get("text", "").strip()
+            label = chunk.get("type", "").lower()
+        elif hasattr(chunk, "text"):
+            text = str(chunk.text).strip()
+            label = getattr(chunk, "type", "").lower()
+        else:
             continue
 
-        chapter = guess_chapter_from_filename(img_path.name)
-        full_text = "\n".join(page_text)
-
-        all_entries.append({
-            "instruction": "Use this textbook image chunk for reference.",
-            "input": "",
-            "output": full_text,
-            "meta": {
-                "source": str(img_path),
-                "filename": img_path.name,
-                "chunk_id": 0,
-                "type": "TextBook",
-                "timestamp": datetime.now().isoformat(),
-                "timestamp_cleaned": datetime.now().isoformat(),
-                "cleaned": True,
-                "chapter": chapter
-            }
-        })
-
-    except Exception as e:
-        print(f"❌ Failed on {img_path.name}: {e}")
-
-with open(OUTPUT_PATH, "w") as f:
-    for entry in all_entries:
-        json.dump(entry, f)
-        f.write("\n")
-
-print(f"\n✅ DONE — {len(all_entries)} textbook image chunks saved to:")
-print(f"📄 {OUTPUT_PATH}")
-
+        if text and len(text) > 10 and label in ALLOWED_TYPES:
+            page_text.append(text)
+
+    if not page_text:
+        return []
+
+    chapter = guess_chapter_from_filename(img_path.name)
+    full_text = "\n".join(page_text)
+    now = datetime.now().isoformat()
+
+    return [{
+        "instruction": "Use this textbook image chunk for reference.",
+        "input": "",
+        "output": full_text,
+        "meta": {
+            "source": str(img_path),
+            "filename": img_path.name,
+            "chunk_id": 0,
+            "type": "TextBook",
+            "timestamp": now,
+            "timestamp_cleaned": now,
+            "cleaned": True,
+            "chapter": chapter
+        }
+    }]
+
+if __name__ == "__main__":
+    parser = add_pool_args(argparse.ArgumentParser(description="Parse textbook page PNGs with Pix2Text"))
+    args = parser.parse_args()
+
+    count, failed = run_pages(INPUT_DIR.glob("*.png"), page_entries, OUTPUT_PATH, args.workers,
+                              config={"parser": "parse_png_textbook"})
+
+    print(f"\n✅ DONE — {count} textbook image chunks saved to:")
+    print(f"📄 {OUTPUT_PATH}")
+    if failed:
+        print(f"❌ {len(failed)} page(s) failed and will be retried on the next run: {', '.join(failed)}")
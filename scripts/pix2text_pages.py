@@ -0,0 +1,100 @@
+# pix2text_pages.py – Process-pool Pix2Text page parsing shared by parse_png_textbook.py / parse_edu_pdfs.py
+#
+# Each worker process loads Pix2Text once (pool initializer) and pulls one page at a time, so a
+# slow page never holds up a pre-assigned batch. Per-worker BLAS/ONNX threads are capped at
+# cpus // workers so the workers don't oversubscribe the machine.
+#
+# Output is streamed to the JSONL in sorted filename order: finished pages wait in a reorder
+# buffer until every page before them is written. Every parsed page is checkpointed in a
+# BuildManifest (<output>.manifest, fsync'd per page, keyed by the PNG's hash); a rerun reuses
+# those pages and only parses new, changed or previously failed ones.
+
+import os
+import json
+import traceback
+from multiprocessing import Pool
+from build_manifest import BuildManifest, manifest_path_for
+
+_p2t = None
+
+def available_cpus():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:  # macOS
+        return os.cpu_count() or 1
+
+def init_worker(threads=None):
+    global _p2t
+    if threads:
+        for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+            os.environ[var] = str(threads)
+    from pix2text import Pix2Text  # after the thread caps, so the runtimes pick them up
+    _p2t = Pix2Text()
+
+def parse_page(task):
+    # -> (path, entries, error); runs in a worker
+    img_path, build_entries = task
+    try:
+        return img_path, build_entries(img_path, _p2t(img_path)), None
+    except Exception as e:
+        return img_path, None, f"{e.__class__.__name__}: {e}\n{traceback.format_exc(limit=3)}"
+
+def run_pages(img_paths, build_entries, output_path, workers=1, config=None):
+    # build_entries(img_path, pix2text_result) -> [entry, ...] must be a module-level function
+    # (it is sent to the workers). Returns (entries written, failed page names).
+    img_paths = sorted(img_paths, key=lambda p: os.path.basename(str(p)))
+    manifest = BuildManifest(manifest_path_for(str(output_path)), config)
+    pending = [p for p in img_paths if not manifest.is_current(str(p))]
+    print(f"[📒] Checkpoint: reusing {len(img_paths) - len(pending)} parsed page(s), parsing {len(pending)}")
+
+    ready, failed = {}, []
+    next_idx, written = 0, 0
+    with open(output_path, "w", encoding="utf-8") as out:
+        def flush():
+            # Write every page that is next in filename order and finished (or failed)
+            nonlocal next_idx, written
+            while next_idx < len(img_paths):
+                key = str(img_paths[next_idx])
+                if manifest.is_current(key):
+                    entries = manifest.entries(key)
+                elif key in ready:
+                    entries = ready.pop(key)
+                else:
+                    return
+                for entry in entries or []:
+                    out.write(json.dumps(entry) + "\n")
+                    written += 1
+                out.flush()
+                next_idx += 1
+
+        def on_result(img_path, entries, error):
+            name = os.path.basename(str(img_path))
+            if error is not None:
+                print(f"❌ Failed on {name}: {error.splitlines()[0]}")
+                failed.append(name)
+                ready[str(img_path)] = None  # skipped in the output, not checkpointed -> retried next run
+            else:
+                manifest.record(str(img_path), entries)
+                print(f"{'✅' if entries else '⚠️ '} {name}: {len(entries)} chunk(s)")
+            flush()
+
+        flush()
+        tasks = [(p, build_entries) for p in pending]
+        if workers <= 1 or len(tasks) <= 1:
+            if tasks:
+                init_worker()
+            for task in tasks:
+                on_result(*parse_page(task))
+        else:
+            workers = min(workers, len(tasks))
+            with Pool(workers, initializer=init_worker, initargs=(max(1, available_cpus() // workers),)) as pool:
+                for result in pool.imap_unordered(parse_page, tasks, chunksize=1):
+                    on_result(*result)
+        flush()
+    manifest.compact([str(p) for p in img_paths])
+    return written, failed
+
+def add_pool_args(parser):
+    parser.add_argument("--workers", type=int, default=1,
+                        help="parse pages in this many processes, each with its own Pix2Text (default: 1)")
+    return parser
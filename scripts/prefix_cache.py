@@ -0,0 +1,119 @@
+# prefix_cache.py – Reusable KV cache for token prefixes shared by many prompts
+#
+# Almost every KwokBot prompt starts the same way: the Alpaca preamble from prompt_format.py in
+# serving, and "Explain or derive the following expression or concept from EE 140 class:" in the
+# eval/training data. PrefixCache prefills such a prefix once, keeps its keys/values (LRU over
+# token-id prefixes), and forks a copy for each batch that starts with it, so only the
+# per-prompt suffix is prefilled.
+#
+# A batch that shares a prefix is laid out as [prefix][pad ...][suffix] (middle padding) with the
+# pads masked out; position ids come from the attention mask, so every row sees exactly the
+# positions it would see unpadded.
+
+import time
+from collections import OrderedDict
+import torch
+from prompt_format import PREAMBLE
+
+try:
+    from transformers import DynamicCache
+except ImportError:
+    DynamicCache = None
+
+def template_prefix_ids(tokenizer):
+    # Token ids of the prompt_format template up to the instruction text. The last token is
+    # dropped because it may merge with the first characters of the instruction.
+    return tokenizer(PREAMBLE + "\n\n### Instruction:\n")["input_ids"][:-1]
+
+def find_shared_prefixes(rows, min_len=8, min_rows=2):
+    # Groups rows by their first min_len tokens and returns each group's longest common prefix
+    groups = {}
+    for row in rows:
+        if len(row) > min_len:
+            groups.setdefault(tuple(row[:min_len]), []).append(row)
+    prefixes = []
+    for members in groups.values():
+        if len(members) < min_rows:
+            continue
+        first = members[0]
+        n = min(len(r) for r in members) - 1  # leave at least one suffix token per row
+        for r in members[1:]:
+            i = min_len
+            while i < n and r[i] == first[i]:
+                i += 1
+            n = i
+        prefixes.append(list(first[:n]))
+    return prefixes
+
+def middle_pad(rows, prefix_len, pad_token_id):
+    # [prefix][pads][suffix] layout; returns (input_ids, attention_mask) lists
+    longest = max(len(r) for r in rows)
+    input_ids, mask = [], []
+    for r in rows:
+        pad = longest - len(r)
+        input_ids.append(r[:prefix_len] + [pad_token_id] * pad + r[prefix_len:])
+        mask.append([1] * prefix_len + [0] * pad + [1] * (len(r) - prefix_len))
+    return input_ids, mask
+
+class PrefixCache:
+    def __init__(self, model, max_entries=8):
+        self.model = model
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # tuple(prefix ids) -> {"past": legacy ((k, v), ...), "seconds": prefill time}
+        self.stats = {"built": 0, "evicted": 0, "hit_rows": 0, "miss_rows": 0, "reused_tokens": 0,
+                      "build_seconds": 0.0, "saved_seconds": 0.0}
+
+    def add(self, prefix_ids):
+        key = tuple(prefix_ids)
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            return key
+        start = time.perf_counter()
+        with torch.no_grad():
+            out = self.model(input_ids=torch.tensor([list(key)], device=self.model.device), use_cache=True)
+        past = out.past_key_values
+        legacy = past.to_legacy_cache() if hasattr(past, "to_legacy_cache") else past
+        seconds = time.perf_counter() - start
+        self.entries[key] = {"past": legacy, "seconds": seconds}
+        self.stats["built"] += 1
+        self.stats["build_seconds"] += seconds
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.stats["evicted"] += 1
+        return key
+
+    def longest(self, row):
+        # Longest cached prefix of row that still leaves a suffix token (no stats, no LRU update)
+        best = None
+        for key in self.entries:
+            if len(row) > len(key) and (best is None or len(key) > len(best)) and tuple(row[:len(key)]) == key:
+                best = key
+        return best
+
+    def match(self, rows):
+        # Longest cached prefix shared by every row; updates LRU order and hit/miss stats
+        best = None
+        for key in self.entries:
+            n = len(key)
+            if (best is None or n > len(best)) and all(len(r) > n and tuple(r[:n]) == key for r in rows):
+                best = key
+        if best is None:
+            self.stats["miss_rows"] += len(rows)
+            return None
+        self.entries.move_to_end(best)
+        self.stats["hit_rows"] += len(rows)
+        self.stats["reused_tokens"] += len(best) * len(rows)
+        self.stats["saved_seconds"] += self.entries[best]["seconds"]  # ≈ one prefix prefill per batch
+        return best
+
+    def fork(self, key, batch_size=1):
+        # Fresh per-batch copy: the model appends to it, the cached entry stays untouched
+        legacy = tuple((k.repeat(batch_size, 1, 1, 1), v.repeat(batch_size, 1, 1, 1))
+                       for k, v in self.entries[key]["past"])
+        return DynamicCache.from_legacy_cache(legacy) if DynamicCache is not None else legacy
+
+    def summary(self):
+        s = self.stats
+        return (f"prefix cache: {len(self.entries)} entr{'y' if len(self.entries) == 1 else 'ies'}, "
+                f"{s['hit_rows']} prompt(s) hit / {s['miss_rows']} missed, {s['reused_tokens']} prefix tokens not re-prefilled; "
+                f"built in {s['build_seconds'] * 1000:.0f} ms, ≈{s['saved_seconds'] * 1000:.0f} ms of prefill saved")
@@ -0,0 +1,32 @@
+# prompt_format.py – The Alpaca prompt template KwokBot is fine-tuned on (finetune_kwokbot_lora.py)
+#
+# Kept in its own module so chat/serving code can build prompts exactly the way training did
+# without importing (and running) the training script.
+
+PREAMBLE = "Below is an instruction that describes a task. Write a response that appropriately completes the request."
+
+def format_prompt(entry):
+    return f"""{PREAMBLE}
+
+### Instruction:
+{entry['instruction']}
+
+### Response:
+{entry['output']}"""
+
+def format_turn(instruction, output=""):
+    return f"""### Instruction:
+{instruction}
+
+### Response:
+{output}"""
+
+def with_context(instruction, context=None):
+    # Instruction text for the current turn only, e.g. retrieved notes ahead of the question
+    return f"{context}\n{instruction}" if context else instruction
+
+def format_conversation(turns, instruction):
+    # turns: [(instruction, response), ...] already answered. With no history this is exactly
+    # format_prompt({"instruction": instruction, "output": ""}); later turns repeat the same block.
+    blocks = [format_turn(inst, out) for inst, out in turns] + [format_turn(instruction)]
+    return PREAMBLE + "\n\n" + "\n\n".join(blocks)
@@ -0,0 +1,55 @@
+# rasterize.py – Streaming PDF page rasterizer that hands encoded buffers straight to OCR
+#
+# Pages are rendered one at a time and encoded in memory (PNG or JPEG, RGB or grayscale),
+# so nothing has to round-trip through output_images/ unless save_dir is given.
+
+import os
+import hashlib
+from collections import namedtuple
+import fitz  # PyMuPDF
+
+PageImage = namedtuple("PageImage", ["page_num", "data", "mime", "path"])
+
+FORMATS = {
+    "png": ("png", "image/png"),
+    "jpeg": ("jpg", "image/jpeg"),
+}
+
+def page_image_name(pdf_path, page_num, ext):
+    # Same-named PDFs in Slides/ and TextBook/ must not overwrite each other's pages
+    stem = os.path.splitext(os.path.basename(pdf_path))[0]
+    path_hash = hashlib.sha1(os.path.abspath(pdf_path).encode()).hexdigest()[:8]
+    return f"{stem}_{path_hash}_page_{page_num}.{ext}"
+
+def iter_page_images(pdf_path, dpi=300, fmt="png", quality=85, grayscale=False, save_dir=None):
+    ext, mime = FORMATS[fmt]
+    colorspace = fitz.csGRAY if grayscale else fitz.csRGB
+    if save_dir:
+        os.makedirs(save_dir, exist_ok=True)
+    with fitz.open(pdf_path) as doc:
+        for page_num in range(len(doc)):
+            pix = doc.load_page(page_num).get_pixmap(dpi=dpi, colorspace=colorspace, alpha=False)
+            if fmt == "jpeg":
+                data = pix.tobytes(output="jpeg", jpg_quality=quality)
+            else:
+                data = pix.tobytes(output="png")
+            path = None
+            if save_dir:
+                path = os.path.join(save_dir, page_image_name(pdf_path, page_num, ext))
+                with open(path, "wb") as f:
+                    f.write(data)
+            yield PageImage(page_num, data, mime, path)
+
+def add_raster_args(parser, save_default=False):
+    parser.add_argument("--dpi", type=int, default=300, help="rasterization resolution")
+    parser.add_argument("--image-format", choices=sorted(FORMATS), default="png", help="encoding sent to OCR")
+    parser.add_argument("--jpeg-quality", type=int, default=85, help="JPEG quality (1-100) when --image-format jpeg")
+    parser.add_argument("--grayscale", action="store_true", help="render pages in grayscale (smaller uploads)")
+    if save_default:
+        parser.add_argument("--no-save-images", dest="save_images", action="store_false",
+                            help="don't keep rendered pages in output_images/")
+    else:
+        parser.add_argument("--save-images", action="store_true", help="also keep rendered pages in output_images/")
+
+def raster_options_from_args(args):
+    return {"dpi": args.dpi, "fmt": args.image_format, "quality": args.jpeg_quality, "grayscale": args.grayscale}
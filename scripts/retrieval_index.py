@@ -0,0 +1,312 @@
+# retrieval_index.py – Persistent search index over the course chunks for grounded chat answers
+#
+# Indexes the "output" chunks of kwokbot_train.jsonl / kwokbot_fallback.jsonl (with meta.source /
+# meta.page) so chat_kwokbot.py can look up the top-k passages for a question and prepend them
+# to that turn's prompt (format_notes -> ChatSession.ask(context=...); not kept in the history).
+#
+#   BM25    – in-memory inverted index (term -> doc ids / term freqs), persisted as index.json.
+#   dense   – optional: mean-pooled embeddings from a small CPU encoder, appended as raw float32
+#             rows to embeddings.f32 and memory-mapped at query time; merged with BM25 by
+#             reciprocal-rank fusion.
+#   updates – for every input file the byte offset already indexed (and a hash of those bytes) is
+#             kept; update() reads only what was appended since. A file that was rewritten
+#             rather than appended to triggers a full rebuild. Chunks with identical text (train
+#             and fallback overlap heavily) are indexed once.
+#
+# Usage:
+#   python retrieval_index.py update                 # build or extend cache/retrieval
+#   python retrieval_index.py update --dense         # ... with embeddings
+#   python retrieval_index.py query "skin depth of a good conductor" -k 5
+
+import os
+import re
+import json
+import math
+import time
+import heapq
+import hashlib
+import argparse
+from collections import Counter
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+DEFAULT_INDEX_DIR = os.path.join(ROOT, "cache", "retrieval")
+DEFAULT_SOURCES = [os.path.join(ROOT, "data", "kwokbot_train.jsonl"), os.path.join(ROOT, "data", "kwokbot_fallback.jsonl")]
+DEFAULT_ENCODER = "sentence-transformers/all-MiniLM-L6-v2"
+INDEX_FILE = "index.json"
+CHUNKS_FILE = "chunks.jsonl"
+EMBEDDINGS_FILE = "embeddings.f32"
+BM25_K1, BM25_B = 1.2, 0.75
+RRF_K = 60
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+
+def tokenize(text):
+    # Lowercased alphanumeric runs; LaTeX commands reduce to their names (\nabla -> nabla)
+    return _TOKEN.findall(text.lower())
+
+def _sha256_prefix(path, n_bytes):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        while n_bytes > 0:
+            block = f.read(min(n_bytes, 1 << 20))
+            if not block:
+                break
+            h.update(block)
+            n_bytes -= len(block)
+    return h.hexdigest()
+
+def _write_atomic(path, write):
+    tmp = path + f".tmp{os.getpid()}"
+    with open(tmp, "w") as f:
+        write(f)
+    os.replace(tmp, path)
+
+class Encoder:
+    # Small transformers encoder, mean-pooled and L2-normalized; CPU by default
+    def __init__(self, name=DEFAULT_ENCODER, device="cpu"):
+        import torch
+        from transformers import AutoTokenizer, AutoModel
+        self.torch = torch
+        self.name = name
+        self.device = device
+        self.tokenizer = AutoTokenizer.from_pretrained(name)
+        self.model = AutoModel.from_pretrained(name).to(device).eval()
+
+    def encode(self, texts, batch_size=64):
+        import numpy as np
+        torch = self.torch
+        out = []
+        for i in range(0, len(texts), batch_size):
+            batch = self.tokenizer(texts[i:i + batch_size], padding=True, truncation=True, max_length=256,
+                                   return_tensors="pt").to(self.device)
+            with torch.no_grad():
+                hidden = self.model(**batch).last_hidden_state
+            mask = batch["attention_mask"].unsqueeze(-1).to(hidden.dtype)
+            pooled = (hidden * mask).sum(1) / mask.sum(1).clamp(min=1)
+            out.append(torch.nn.functional.normalize(pooled, dim=-1).float().cpu().numpy())
+        return np.concatenate(out) if out else np.zeros((0, 0), dtype=np.float32)
+
+class RetrievalIndex:
+    def __init__(self, index_dir=DEFAULT_INDEX_DIR):
+        self.index_dir = index_dir
+        self.docs = []        # [{"text", "source", "page"}] in doc-id order
+        self.postings = {}    # term -> [[doc ids], [term freqs]]
+        self.doc_len = []
+        self.hashes = set()   # sha1 of chunk text, to skip duplicates
+        self.files = {}       # input path -> {"offset": bytes indexed, "sha256": hash of those bytes}
+        self.encoder_name = None
+        self.encoder = None
+        self._embeddings = None
+        self.load()
+
+    # -------------- Persistence -------------- #
+    def _path(self, name):
+        return os.path.join(self.index_dir, name)
+
+    def load(self):
+        if not os.path.isfile(self._path(INDEX_FILE)):
+            return
+        with open(self._path(INDEX_FILE)) as f:
+            state = json.load(f)
+        self.postings = state["postings"]
+        self.doc_len = state["doc_len"]
+        self.hashes = set(state["hashes"])
+        self.files = state["files"]
+        self.encoder_name = state.get("encoder")
+        with open(self._path(CHUNKS_FILE)) as f:
+            self.docs = [json.loads(line) for line in f]
+
+    def save(self, new_docs):
+        os.makedirs(self.index_dir, exist_ok=True)
+        with open(self._path(CHUNKS_FILE), "a") as f:
+            for doc in new_docs:
+                f.write(json.dumps(doc, ensure_ascii=False) + "\n")
+        state = {"postings": self.postings, "doc_len": self.doc_len, "hashes": sorted(self.hashes),
+                 "files": self.files, "encoder": self.encoder_name}
+        _write_atomic(self._path(INDEX_FILE), lambda f: json.dump(state, f))
+
+    def clear(self):
+        for name in (INDEX_FILE, CHUNKS_FILE, EMBEDDINGS_FILE):
+            if os.path.exists(self._path(name)):
+                os.remove(self._path(name))
+        self.docs, self.postings, self.doc_len, self.hashes, self.files = [], {}, [], set(), {}
+        self._embeddings = None
+
+    # -------------- Indexing -------------- #
+    def _read_new(self, path):
+        # Yields records appended since the last update; None if the file was rewritten
+        size = os.path.getsize(path)
+        seen = self.files.get(path)
+        offset = 0
+        if seen is not None:
+            if size < seen["offset"] or _sha256_prefix(path, seen["offset"]) != seen["sha256"]:
+                return None, None
+            offset = seen["offset"]
+        records = []
+        with open(path, "rb") as f:
+            f.seek(offset)
+            for raw in f:
+                if not raw.endswith(b"\n"):
+                    break  # partial last line still being written; picked up next time
+                offset += len(raw)
+                line = raw.decode("utf-8").strip()
+                if line:
+                    try:
+                        records.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        continue  # same policy as the salvage scripts: skip, keep going
+        return records, offset
+
+    def update(self, paths=DEFAULT_SOURCES, dense=False, encoder_name=DEFAULT_ENCODER):
+        # Returns the number of chunks added
+        pending = {}
+        for path in paths:
+            path = os.path.abspath(path)
+            records, offset = self._read_new(path)
+            if records is None:
+                print(f"[!] {os.path.basename(path)} was rewritten; rebuilding the index")
+                self.clear()
+                return self.update(paths, dense, encoder_name)
+            pending[path] = (records, offset)
+
+        new_docs = []
+        for path, (records, offset) in pending.items():
+            for record in records:
+                text = (record.get("output") or "").strip()
+                digest = hashlib.sha1(text.encode()).hexdigest()
+                if not text or digest in self.hashes:
+                    continue
+                self.hashes.add(digest)
+                meta = record.get("meta") or {}
+                new_docs.append({"text": text, "source": meta.get("source", os.path.basename(path)), "page": meta.get("page")})
+            self.files[path] = {"offset": offset, "sha256": _sha256_prefix(path, offset)}
+
+        for doc in new_docs:
+            doc_id = len(self.doc_len)
+            counts = Counter(tokenize(doc["text"]))
+            for term, tf in counts.items():
+                ids, tfs = self.postings.setdefault(term, [[], []])
+                ids.append(doc_id)
+                tfs.append(tf)
+            self.doc_len.append(sum(counts.values()))
+        self.docs.extend(new_docs)
+
+        if dense or self.encoder_name:
+            self._append_embeddings(new_docs, encoder_name if not self.encoder_name else self.encoder_name,
+                                    backfill=self.encoder_name is None)
+        self.save(new_docs)
+        return len(new_docs)
+
+    def _append_embeddings(self, new_docs, encoder_name, backfill=False):
+        # First --dense run embeds every doc already in the index; later runs only the new ones
+        self.encoder_name = encoder_name
+        docs = self.docs if backfill else new_docs
+        if not docs:
+            return
+        if backfill and os.path.exists(self._path(EMBEDDINGS_FILE)):
+            os.remove(self._path(EMBEDDINGS_FILE))
+        vectors = self._encoder().encode([d["text"] for d in docs])
+        os.makedirs(self.index_dir, exist_ok=True)
+        with open(self._path(EMBEDDINGS_FILE), "ab") as f:
+            f.write(vectors.astype("float32").tobytes())
+        self._embeddings = None
+
+    def _encoder(self):
+        if self.encoder is None:
+            self.encoder = Encoder(self.encoder_name)
+        return self.encoder
+
+    def embeddings(self):
+        if self._embeddings is None and self.encoder_name and os.path.exists(self._path(EMBEDDINGS_FILE)):
+            import numpy as np
+            rows = len(self.docs)
+            dim = os.path.getsize(self._path(EMBEDDINGS_FILE)) // (4 * rows) if rows else 0
+            if dim:
+                self._embeddings = np.memmap(self._path(EMBEDDINGS_FILE), dtype=np.float32, mode="r", shape=(rows, dim))
+        return self._embeddings
+
+    # -------------- Search -------------- #
+    def bm25(self, query, k=5):
+        n = len(self.doc_len)
+        if not n:
+            return []
+        avgdl = sum(self.doc_len) / n
+        scores = {}
+        for term in set(tokenize(query)):
+            entry = self.postings.get(term)
+            if entry is None:
+                continue
+            ids, tfs = entry
+            idf = math.log(1 + (n - len(ids) + 0.5) / (len(ids) + 0.5))
+            for doc_id, tf in zip(ids, tfs):
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self.doc_len[doc_id] / avgdl)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (BM25_K1 + 1) / (tf + norm)
+        return heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+
+    def dense(self, query, k=5):
+        import numpy as np
+        matrix = self.embeddings()
+        if matrix is None:
+            return []
+        sims = matrix @ self._encoder().encode([query])[0]
+        top = np.argpartition(-sims, min(k, len(sims) - 1))[:k]
+        return sorted(((int(i), float(sims[i])) for i in top), key=lambda item: -item[1])
+
+    def search(self, query, k=5, mode="auto"):
+        # mode: "bm25", "dense" or "hybrid"; "auto" is hybrid when embeddings exist, else bm25.
+        # Returns [{"text", "source", "page", "score"}]
+        if mode == "auto":
+            mode = "hybrid" if self.embeddings() is not None else "bm25"
+        if mode == "bm25":
+            ranked = self.bm25(query, k)
+        elif mode == "dense":
+            ranked = self.dense(query, k)
+        else:
+            fused = {}
+            for hits in (self.bm25(query, 4 * k), self.dense(query, 4 * k)):
+                for rank, (doc_id, _) in enumerate(hits):
+                    fused[doc_id] = fused.get(doc_id, 0.0) + 1 / (RRF_K + rank + 1)
+            ranked = heapq.nlargest(k, fused.items(), key=lambda item: item[1])
+        return [dict(self.docs[doc_id], score=score) for doc_id, score in ranked]
+
+def format_notes(hits, max_chars=600):
+    # Per-turn context for ChatSession.ask(context=...): the passages, then a lead-in to the question
+    if not hits:
+        return ""
+    passages = []
+    for i, hit in enumerate(hits, 1):
+        page = f" p.{hit['page']}" if hit.get("page") is not None else ""
+        text = hit["text"] if len(hit["text"]) <= max_chars else hit["text"][:max_chars].rstrip() + " …"
+        passages.append(f"[{i}] {hit['source']}{page}:\n{text}")
+    return "Course notes:\n" + "\n\n".join(passages) + "\n\nUsing the notes where relevant, answer:"
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build / update / query the KwokBot retrieval index")
+    parser.add_argument("command", choices=["update", "rebuild", "query"])
+    parser.add_argument("text", nargs="?", help="query text")
+    parser.add_argument("--index-dir", default=DEFAULT_INDEX_DIR)
+    parser.add_argument("--sources", nargs="+", default=DEFAULT_SOURCES, help="JSONL files to index")
+    parser.add_argument("--dense", action="store_true", help="also store embeddings (needs numpy + transformers)")
+    parser.add_argument("--encoder", default=DEFAULT_ENCODER)
+    parser.add_argument("-k", type=int, default=5)
+    parser.add_argument("--mode", choices=["auto", "bm25", "dense", "hybrid"], default="auto")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    index = RetrievalIndex(args.index_dir)
+    print(f"📚 Loaded {len(index.docs)} chunks in {(time.perf_counter() - start) * 1000:.0f} ms")
+    if args.command in ("update", "rebuild"):
+        if args.command == "rebuild":
+            index.clear()
+        start = time.perf_counter()
+        added = index.update(args.sources, args.dense, args.encoder)
+        print(f"[✓] Indexed {added} new chunk(s) ({len(index.docs)} total, {len(index.postings)} terms) "
+              f"in {time.perf_counter() - start:.2f}s → {args.index_dir}")
+    else:
+        if not args.text:
+            parser.error("query needs text")
+        start = time.perf_counter()
+        hits = index.search(args.text, args.k, args.mode)
+        print(f"🔎 {len(hits)} hit(s) in {(time.perf_counter() - start) * 1000:.1f} ms")
+        for hit in hits:
+            print(f"  {hit['score']:.3f}  {hit['source']} p.{hit['page']}: {hit['text'][:100]!r}")
@@ -0,0 +1,111 @@
+# runtime.py – One place to pick device, dtype, CPU threads and torch.compile for every KwokBot script
+#
+# Device: cuda > mps > cpu unless told otherwise. Dtype: cuda: bf16 (fp16 on pre-Ampere), mps: fp16,
+# cpu: bf16 if the CPU has native bf16 (AVX512-BF16 / AMX), else float32. CPU fp16 is never picked:
+# it is emulated and slow. Training uses the same dtypes for the frozen base weights (a 7B base in
+# float32 does not fit next to activations on the Mac); upcast_trainable() keeps the LoRA
+# parameters in float32. A script that needs something else passes dtype= to select_runtime().
+# Threads: intra-op defaults to the CPUs this process may run on, inter-op to 1 (generation is a
+# sequential chain of ops; extra inter-op threads only contend). Everything can be overridden by
+# command-line flags (add_runtime_args) or environment variables:
+#   KWOKBOT_DEVICE, KWOKBOT_DTYPE, KWOKBOT_THREADS, KWOKBOT_INTEROP_THREADS, KWOKBOT_COMPILE=1
+
+import os
+import torch
+
+DTYPES = {"float32": torch.float32, "fp32": torch.float32, "bf16": torch.bfloat16, "bfloat16": torch.bfloat16,
+          "fp16": torch.float16, "float16": torch.float16}
+
+def available_cpus():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:  # macOS
+        return os.cpu_count() or 1
+
+def cpu_has_native_bf16():
+    try:
+        return bool(torch.ops.mkldnn._is_mkldnn_bf16_supported())
+    except (AttributeError, RuntimeError):
+        pass
+    try:
+        with open("/proc/cpuinfo") as f:
+            flags = f.read()
+        return "avx512_bf16" in flags or "amx_bf16" in flags
+    except OSError:
+        return False
+
+def detect_device():
+    if torch.cuda.is_available():
+        return "cuda"
+    if torch.backends.mps.is_available():
+        return "mps"
+    return "cpu"
+
+def default_dtype(device):
+    if device.startswith("cuda"):
+        return torch.bfloat16 if torch.cuda.is_bf16_supported() else torch.float16
+    if device == "mps":
+        return torch.float16
+    return torch.bfloat16 if cpu_has_native_bf16() else torch.float32
+
+class Runtime:
+    def __init__(self, device, dtype, threads, interop_threads, compile):
+        self.device = device
+        self.dtype = dtype
+        self.threads = threads
+        self.interop_threads = interop_threads
+        self.compile = compile
+
+    def describe(self):
+        dtype = str(self.dtype).replace("torch.", "")
+        threads = f", {self.threads} threads / {self.interop_threads} inter-op" if self.device == "cpu" else ""
+        return f"{self.device} · {dtype}{threads}{' · torch.compile' if self.compile else ''}"
+
+def select_runtime(device=None, dtype=None, threads=None, interop_threads=None, compile=None):
+    # Explicit arguments win over KWOKBOT_* environment variables, which win over autodetection
+    device = device or os.environ.get("KWOKBOT_DEVICE") or detect_device()
+    dtype = dtype or os.environ.get("KWOKBOT_DTYPE")
+    dtype = DTYPES[dtype] if isinstance(dtype, str) else (dtype or default_dtype(device))
+    threads = threads or int(os.environ.get("KWOKBOT_THREADS", 0)) or available_cpus()
+    interop_threads = interop_threads or int(os.environ.get("KWOKBOT_INTEROP_THREADS", 0)) or 1
+    if compile is None:
+        compile = os.environ.get("KWOKBOT_COMPILE", "0") == "1"
+
+    torch.set_num_threads(threads)
+    try:
+        torch.set_num_interop_threads(interop_threads)
+    except RuntimeError:
+        pass  # only settable before the first parallel op; keep whatever is in place
+    return Runtime(device, dtype, threads, interop_threads, compile)
+
+def maybe_compile(model, runtime):
+    # Compiles the forward pass only (generate()'s Python loop stays eager); dynamic shapes since
+    # prompt and KV lengths change every call
+    if not runtime.compile:
+        return model
+    if not hasattr(torch, "compile"):
+        print("[!] torch.compile needs torch >= 2.0; running eagerly")
+        return model
+    model.forward = torch.compile(model.forward, dynamic=True)
+    return model
+
+def upcast_trainable(model):
+    # Only the trainable (LoRA) parameters get optimizer updates; keeping them in float32 avoids
+    # training in pure bf16/fp16 with bf16=False/fp16=False and no fp32 master weights. PEFT casts
+    # the adapter input to the adapter dtype and the result back, so the base stays half precision.
+    for param in model.parameters():
+        if param.requires_grad and param.dtype != torch.float32:
+            param.data = param.data.float()
+    return model
+
+def add_runtime_args(parser):
+    group = parser.add_argument_group("runtime")
+    group.add_argument("--device", default=None, help="cuda / mps / cpu (default: autodetect)")
+    group.add_argument("--dtype", choices=sorted(DTYPES), default=None, help="default: fastest supported on the device")
+    group.add_argument("--threads", type=int, default=None, help="intra-op CPU threads (default: available CPUs)")
+    group.add_argument("--interop-threads", type=int, default=None, help="inter-op CPU threads (default: 1)")
+    group.add_argument("--compile", action="store_true", default=None, help="torch.compile the model forward")
+    return parser
+
+def runtime_from_args(args):
+    return select_runtime(args.device, args.dtype, args.threads, args.interop_threads, args.compile)
@@ -1,32 +1,14 @@
 # salvage_kwokbot_jsonl.py – Attempt to recover valuable entries from broken JSON fragments
 
 import os
-import json
-from tqdm import tqdm
+from jsonl_salvage import salvage_file
 
 INPUT_FILE = os.path.abspath(os.path.join(os.path.dirname(__file__), "../data/kwokbot_train.jsonl"))
 OUTPUT_FILE = os.path.abspath(os.path.join(os.path.dirname(__file__), "../data/kwokbot_salvaged.jsonl"))
 
-buffer = []
-salvaged = 0
-
-with open(INPUT_FILE, "r") as infile, open(OUTPUT_FILE, "w") as outfile:
-    for line in tqdm(infile, desc="Scanning for salvageable entries"):
-        stripped = line.strip()
-        if not stripped:
-            continue
-
-        buffer.append(stripped)
-
-        # Try to join the buffer and parse it as JSON
-        try:
-            candidate = json.loads("".join(buffer))
-            if all(k in candidate for k in ["instruction", "output"]):
-                outfile.write(json.dumps(candidate) + "\n")
-                salvaged += 1
-            buffer = []  # clear the buffer
-        except json.JSONDecodeError:
-            continue  # wait for more lines to complete the object
-
-print(f"[✓] Salvaged {salvaged} entries and saved to: {OUTPUT_FILE}")
+# Linear-time raw_decode scan; corrupt fragments are skipped instead of poisoning the buffer
+report = salvage_file(INPUT_FILE, OUTPUT_FILE)
 
+print(f"[✓] Salvaged {report.recovered} entries and saved to: {OUTPUT_FILE}")
+if report.skipped:
+    print(f"[!] Skipped {len(report.skipped)} corrupt span(s) — run jsonl_salvage.py --report for details")
@@ -0,0 +1,152 @@
+# score_answers.py – Answer scoring for KwokBot evals beyond substring match
+#
+# Metrics per item (answer = model output with the echoed question removed):
+#   contains   – the old check: expected.lower() in got.lower()
+#   exact      – exact match after normalization (lowercase, no punctuation/articles, collapsed spaces)
+#   f1         – token-level F1 over normalized tokens
+#   rouge_l    – ROUGE-L F1 (longest common token subsequence)
+#   latex      – share of the expected answer's equations ($...$, $$...$$, \(...\), \[...\]) that
+#                appear in the answer after LaTeX normalization (1–2 character ones written without
+#                delimiters only as a whole word); None when there are none
+#
+# The LCS uses a bit-parallel algorithm (one Python big-int operation per answer token covers
+# every expected-token position at once), so ROUGE-L costs O(n·m/word) instead of an O(n·m)
+# DP in Python. Items are scored in chunks, in a process pool for large result sets.
+#
+# Re-score a saved run without regenerating:
+#   python score_answers.py eval_results_greedy.json --workers 8 --output eval_results_scored.json
+
+import re
+import json
+import string
+import argparse
+from collections import Counter
+from multiprocessing import Pool
+
+METRICS = ("contains", "exact", "f1", "rouge_l", "latex")
+PARALLEL_MIN_ITEMS = 2000
+
+# -------------- Normalization -------------- #
+_ARTICLES = re.compile(r"\b(a|an|the)\b")
+_PUNCT = str.maketrans("", "", string.punctuation)
+
+def normalize_text(text):
+    text = text.lower().translate(_PUNCT)
+    return " ".join(_ARTICLES.sub(" ", text).split())
+
+_MATH = re.compile(r"\$\$(.+?)\$\$|\$(.+?)\$|\\\[(.+?)\\\]|\\\((.+?)\\\)", re.S)
+_LATEX_SPACING = re.compile(r"\\(?:left|right|big|Big|bigg|Bigg)(?![a-zA-Z])|\\[,;:! ]|\\q?quad(?![a-zA-Z])|\s+")
+_LATEX_WRAPPERS = re.compile(r"\\(?:mathrm|text|textrm|mathit|operatorname|displaystyle)\s*\{([^{}]*)\}")
+_LATEX_ALIASES = [(re.compile(r"\\[dt]frac(?![a-zA-Z])"), r"\\frac"), (re.compile(r"\\times(?![a-zA-Z])"), r"\\cdot"),
+                  (re.compile(r"\\varepsilon(?![a-zA-Z])"), r"\\epsilon"), (re.compile(r"\\displaystyle(?![a-zA-Z])"), "")]
+_SINGLE_BRACED = re.compile(r"([_^])\{(\\?[a-zA-Z0-9])\}")
+_WORD_EDGES = ".,;:!?()\"'"
+
+def extract_equations(text):
+    return [next(g for g in m.groups() if g is not None) for m in _MATH.finditer(text)]
+
+def normalize_latex(expr):
+    expr = _LATEX_WRAPPERS.sub(r"\1", expr)
+    for pattern, repl in _LATEX_ALIASES:
+        expr = pattern.sub(repl, expr)
+    expr = _LATEX_SPACING.sub("", expr)
+    return _SINGLE_BRACED.sub(r"\1\2", expr)  # x^{2} -> x^2, E_{0} -> E_0
+
+# -------------- Metrics -------------- #
+def lcs_length(a, b):
+    # Bit-parallel LCS (Hyyrö): bit i of v tracks position i of the shorter sequence
+    if len(a) < len(b):
+        a, b = b, a
+    if not b:
+        return 0
+    masks = {}
+    for i, tok in enumerate(b):
+        masks[tok] = masks.get(tok, 0) | (1 << i)
+    full = (1 << len(b)) - 1
+    v = full
+    for tok in a:
+        u = v & masks.get(tok, 0)
+        v = ((v + u) | (v - u)) & full
+    return len(b) - bin(v).count("1")
+
+def f1_from_overlap(overlap, n_pred, n_ref):
+    if not n_pred or not n_ref or not overlap:
+        return float(n_pred == n_ref == 0)
+    precision, recall = overlap / n_pred, overlap / n_ref
+    return 2 * precision * recall / (precision + recall)
+
+def latex_match(answer, expected):
+    wanted = [normalize_latex(e) for e in extract_equations(expected)]
+    wanted = [w for w in wanted if w]
+    if not wanted:
+        return None
+    found = {normalize_latex(e) for e in extract_equations(answer)}
+    # Equations the model wrote without delimiters: short ones ("x", "E_0") only as a whole word,
+    # since as substrings they match inside any ordinary word ("x" in "next")
+    flat = normalize_latex(answer)
+    words = {normalize_latex(w.strip(_WORD_EDGES)) for w in answer.split()}
+    return sum(w in found or (w in flat if len(w) >= 3 else w in words) for w in wanted) / len(wanted)
+
+def strip_question(got, question):
+    # evaluate_kwokbot.py decodes prompt + continuation; score only the continuation
+    return got[len(question):].strip() if question and got.startswith(question) else got
+
+def score_item(item):
+    expected = item["expected"]
+    answer = strip_question(item["got"], item.get("question", ""))
+    pred_norm, ref_norm = normalize_text(answer), normalize_text(expected)
+    pred_tokens, ref_tokens = pred_norm.split(), ref_norm.split()
+    overlap = sum((Counter(pred_tokens) & Counter(ref_tokens)).values())
+    return {
+        "contains": float(expected.lower() in item["got"].lower()),
+        "exact": float(pred_norm == ref_norm),
+        "f1": f1_from_overlap(overlap, len(pred_tokens), len(ref_tokens)),
+        "rouge_l": f1_from_overlap(lcs_length(pred_tokens, ref_tokens), len(pred_tokens), len(ref_tokens)),
+        "latex": latex_match(answer, expected),
+    }
+
+def score_chunk(items):
+    return [score_item(item) for item in items]
+
+def score_results(results, workers=1, chunk_size=256):
+    # Per-item score dicts, in order; a process pool is used only where it pays for itself
+    chunks = [results[i:i + chunk_size] for i in range(0, len(results), chunk_size)]
+    if workers > 1 and len(results) >= PARALLEL_MIN_ITEMS:
+        with Pool(workers) as pool:
+            scored = pool.map(score_chunk, chunks)
+    else:
+        scored = [score_chunk(chunk) for chunk in chunks]
+    return [s for chunk in scored for s in chunk]
+
+def summarize(scores):
+    summary = {}
+    for metric in METRICS:
+        values = [s[metric] for s in scores if s[metric] is not None]
+        summary[metric] = {"mean": sum(values) / len(values) if values else None, "n": len(values)}
+    return summary
+
+def format_summary(summary):
+    parts = []
+    for metric in METRICS:
+        mean = summary[metric]["mean"]
+        label = f"{metric} (n={summary[metric]['n']})" if metric == "latex" else metric
+        parts.append(f"{label} {mean * 100:.1f}%" if mean is not None else f"{label} –")
+    return " · ".join(parts)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Re-score saved KwokBot eval results")
+    parser.add_argument("results", nargs="?", default="eval_results_greedy.json")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--output", default=None, help="write the results with per-item scores here")
+    args = parser.parse_args()
+
+    with open(args.results) as f:
+        results = json.load(f)
+    scores = score_results(results, args.workers)
+    print(f"[📊] {len(results)} items: {format_summary(summarize(scores))}")
+    if args.output:
+        for item, s in zip(results, scores):
+            item["scores"] = s
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"[✓] Scored results saved to {args.output}")
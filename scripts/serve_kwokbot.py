@@ -0,0 +1,452 @@
+# serve_kwokbot.py – Local HTTP inference server for KwokBot with dynamic request batching
+#
+# The model is loaded once. Requests are queued and a single engine thread groups them into
+# batches: once a request is waiting, it collects more for up to --max-wait-ms (or until
+# --max-batch are queued), then prefills the left-padded batch and decodes all rows together,
+# streaming each row's text back as it is produced (StreamDecoder from chat_session.py).
+#
+#   POST /v1/completions  {"instruction": "...", "max_new_tokens": 128, "temperature": 0.7,
+#                          "top_p": 0.9, "stream": true}
+#       stream=true  -> chunked NDJSON: {"text": "..."} lines, then {"done": true, "stats": {...}}
+#       stream=false -> {"text": "...", "stats": {...}}
+#       "prompt" may be sent instead of "instruction" to skip the Alpaca template.
+#       400 unless max_new_tokens >= 1, temperature >= 0 and 0 < top_p <= 1; max_new_tokens is
+#       clamped to the context. A request whose client disconnects is dropped from its batch, and a
+#       sampling failure only fails its own request.
+#   GET /metrics          queue depth, batch sizes, queue-wait / TTFT / latency percentiles,
+#                         prefix-cache hits and prefill saved
+#
+# Usage:
+#   python serve_kwokbot.py --port 8000                      # merged export if present, else base + LoRA
+#   python serve_kwokbot.py --tiny --port 8000               # tiny random model on CPU (load tests)
+
+import json
+import math
+import time
+import asyncio
+import argparse
+import threading
+from collections import deque
+import torch
+from prompt_format import format_prompt
+from chat_session import StreamDecoder, sample_token
+from merged_model import MERGED_PATH, is_merged_export, load_merged
+from runtime import add_runtime_args, runtime_from_args, maybe_compile
+from prefix_cache import PrefixCache, template_prefix_ids, find_shared_prefixes, middle_pad
+
+BASE_MODEL_PATH = "/Users/mdanylchuk/Documents/FKwokBot/models/mistral-7b-hf"
+LORA_PATH = "/Users/mdanylchuk/Documents/FKwokBot/output/kwokbot-lora"
+
+# -------------- Metrics -------------- #
+def percentile(values, q):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+class Metrics:
+    def __init__(self, window=2000):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.counters = {"requests": 0, "completed": 0, "errors": 0, "cancelled": 0, "batches": 0, "batched_requests": 0,
+                         "new_tokens": 0}
+        self.queue_wait = deque(maxlen=window)
+        self.ttft = deque(maxlen=window)
+        self.latency = deque(maxlen=window)
+        self.queue_depth = 0
+        self.in_flight = 0
+
+    def add(self, key, n=1):
+        with self.lock:
+            self.counters[key] += n
+
+    def observe(self, series, value):
+        with self.lock:
+            getattr(self, series).append(value)
+
+    def snapshot(self):
+        with self.lock:
+            c = dict(self.counters)
+            series = {name: list(getattr(self, name)) for name in ("queue_wait", "ttft", "latency")}
+            depth, in_flight = self.queue_depth, self.in_flight
+        uptime = time.time() - self.started
+        out = {
+            "uptime_s": round(uptime, 1),
+            "queue_depth": depth,
+            "in_flight": in_flight,
+            **c,
+            "mean_batch_size": round(c["batched_requests"] / c["batches"], 2) if c["batches"] else 0.0,
+            "tokens_per_sec": round(c["new_tokens"] / uptime, 1) if uptime else 0.0,
+        }
+        for name, values in series.items():
+            out[f"{name}_ms"] = {"p50": round(percentile(values, 0.5) * 1000, 1),
+                                 "p95": round(percentile(values, 0.95) * 1000, 1),
+                                 "n": len(values)}
+        return out
+
+# -------------- Batching engine -------------- #
+class Request:
+    def __init__(self, prompt_ids, max_new_tokens, temperature, top_p, tokenizer, loop):
+        self.prompt_ids = prompt_ids
+        self.max_new_tokens = max_new_tokens
+        self.temperature = temperature
+        self.top_p = top_p
+        self.decoder = StreamDecoder(tokenizer)
+        self.loop = loop
+        self.events = asyncio.Queue()
+        self.generated = 0
+        self.t_arrival = time.perf_counter()
+        self.t_start = self.t_first = None
+        self.finished = False   # done or error sent
+        self.cancelled = False  # client went away; set from the event loop, read by the engine
+
+    def emit(self, kind, payload):
+        # Called from the engine thread; hands the event to the request's event loop
+        self.loop.call_soon_threadsafe(self.events.put_nowait, (kind, payload))
+
+class BatchEngine(threading.Thread):
+    def __init__(self, model, tokenizer, metrics, max_batch=8, max_wait_ms=20, max_context=4096, prefix_cache=None):
+        super().__init__(daemon=True)
+        self.model = model
+        self.tokenizer = tokenizer
+        self.metrics = metrics
+        self.prefix_cache = prefix_cache
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.max_context = min(max_context, getattr(model.config, "max_position_embeddings", max_context))
+        self.pending = deque()
+        self.cond = threading.Condition()
+
+    def submit(self, request):
+        budget = max(1, self.max_context - request.max_new_tokens)
+        if len(request.prompt_ids) > budget:
+            request.prompt_ids = request.prompt_ids[:1] + request.prompt_ids[len(request.prompt_ids) - budget + 1:]
+        with self.cond:
+            self.pending.append(request)
+            self.metrics.queue_depth = len(self.pending)
+            self.cond.notify()
+
+    def _next_batch(self):
+        with self.cond:
+            while not self.pending:
+                self.cond.wait()
+            # Dynamic batching: give concurrent requests up to max_wait to join the first one
+            deadline = self.pending[0].t_arrival + self.max_wait
+            while len(self.pending) < self.max_batch:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                self.cond.wait(remaining)
+            batch = [self.pending.popleft() for _ in range(min(self.max_batch, len(self.pending)))]
+            self.metrics.queue_depth = len(self.pending)
+        return batch
+
+    def run(self):
+        while True:
+            batch = [r for r in self._next_batch() if not self._dropped(r)]
+            if not batch:
+                continue
+            self.metrics.in_flight = len(batch)
+            self.metrics.add("batches")
+            self.metrics.add("batched_requests", len(batch))
+            try:
+                self.generate(batch)
+            except Exception as e:
+                for request in batch:
+                    if not request.finished:
+                        self._fail(request, str(e))
+            self.metrics.in_flight = 0
+
+    def _dropped(self, request):
+        if request.cancelled and not request.finished:
+            request.finished = True
+            self.metrics.add("cancelled")
+        return request.cancelled
+
+    def _fail(self, request, message):
+        request.finished = True
+        self.metrics.add("errors")
+        request.emit("error", message)
+
+    def _finish(self, request, active, i):
+        active[i] = False
+        request.finished = True
+        chunk = request.decoder.finish()
+        if chunk:
+            request.emit("text", chunk)
+        now = time.perf_counter()
+        self.metrics.observe("latency", now - request.t_arrival)
+        self.metrics.add("completed")
+        self.metrics.add("new_tokens", request.generated)
+        request.emit("done", {
+            "prompt_tokens": len(request.prompt_ids),
+            "new_tokens": request.generated,
+            "queue_wait_ms": round((request.t_start - request.t_arrival) * 1000, 1),
+            "ttft_ms": round(((request.t_first or now) - request.t_arrival) * 1000, 1),
+            "latency_ms": round((now - request.t_arrival) * 1000, 1),
+        })
+
+    def generate(self, batch):
+        pad = self.tokenizer.pad_token_id
+        eos = self.tokenizer.eos_token_id
+        device = self.model.device
+        rows = [r.prompt_ids for r in batch]
+        start = time.perf_counter()
+        for r in batch:
+            r.t_start = start
+            self.metrics.observe("queue_wait", start - r.t_arrival)
+
+        # A shared cached prefix (the Alpaca preamble at least) is not prefilled again: the batch
+        # is laid out [prefix][pads][suffix] and continues from a fork of the prefix's KV cache
+        prefix = self.prefix_cache.match(rows) if self.prefix_cache is not None else None
+        if prefix is not None:
+            ids, mask = middle_pad(rows, len(prefix), pad)
+        else:
+            longest = max(len(r) for r in rows)
+            ids = [[pad] * (longest - len(r)) + r for r in rows]
+            mask = [[0] * (longest - len(r)) + [1] * len(r) for r in rows]
+        input_ids = torch.tensor(ids, device=device)
+        mask = torch.tensor(mask, device=device)
+        position_ids = (mask.cumsum(-1) - 1).clamp(min=0)
+        skip = len(prefix) if prefix is not None else 0
+        past = self.prefix_cache.fork(prefix, len(batch)) if prefix is not None else None
+
+        active = [True] * len(batch)
+        with torch.no_grad():
+            out = self.model(input_ids=input_ids[:, skip:], attention_mask=mask, position_ids=position_ids[:, skip:],
+                             past_key_values=past, use_cache=True)
+            for _ in range(max(r.max_new_tokens for r in batch)):
+                logits = out.logits[:, -1]
+                next_tokens = []
+                for i, r in enumerate(batch):
+                    if active[i] and self._dropped(r):
+                        active[i] = False  # client disconnected: stop spending decode steps on it
+                    if not active[i]:
+                        next_tokens.append(pad)
+                        continue
+                    try:
+                        token = sample_token(logits[i], r.temperature, r.top_p)
+                    except Exception as e:  # e.g. non-finite logits in this row; the rest of the batch goes on
+                        active[i] = False
+                        self._fail(r, f"sampling failed: {e}")
+                        next_tokens.append(pad)
+                        continue
+                    next_tokens.append(token)
+                    r.generated += 1
+                    if r.t_first is None:
+                        r.t_first = time.perf_counter()
+                        self.metrics.observe("ttft", r.t_first - r.t_arrival)
+                    if token == eos:
+                        self._finish(r, active, i)
+                        continue
+                    chunk = r.decoder.push(token)
+                    if chunk:
+                        r.emit("text", chunk)
+                    if r.decoder.stopped or r.generated >= r.max_new_tokens:
+                        self._finish(r, active, i)
+                if not any(active):
+                    break
+                step_mask = torch.tensor([[int(a)] for a in active], device=device)
+                mask = torch.cat([mask, step_mask], dim=-1)
+                position_ids = position_ids[:, -1:] + 1
+                out = self.model(input_ids=torch.tensor([[t] for t in next_tokens], device=device), attention_mask=mask,
+                                 position_ids=position_ids, past_key_values=out.past_key_values, use_cache=True)
+        self._learn_prefixes(rows, prefix)
+
+    def _learn_prefixes(self, rows, prefix):
+        # Rows in this batch sharing a longer prefix than the cached one (e.g. the same EE 140
+        # instruction) get that prefix cached for later batches; LRU keeps the set bounded
+        if self.prefix_cache is None or len(rows) < 2:
+            return
+        for shared in find_shared_prefixes(rows, min_len=max(len(prefix or ()) + 1, 32)):
+            if len(shared) > len(prefix or ()):
+                self.prefix_cache.add(shared)
+
+# -------------- HTTP -------------- #
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 500: "Internal Server Error"}
+
+async def write_response(writer, status, body):
+    data = json.dumps(body).encode()
+    writer.write(f"HTTP/1.1 {status} {REASONS[status]}\r\nContent-Type: application/json\r\n"
+                 f"Content-Length: {len(data)}\r\nConnection: close\r\n\r\n".encode() + data)
+    await writer.drain()
+
+async def write_chunk(writer, obj):
+    data = (json.dumps(obj) + "\n").encode()
+    writer.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+    await writer.drain()
+
+async def next_event(request, hangup):
+    # The request's next engine event, or None once the client has closed the connection
+    get = asyncio.ensure_future(request.events.get())
+    await asyncio.wait({get, hangup}, return_when=asyncio.FIRST_COMPLETED)
+    if get.done():
+        return get.result()
+    get.cancel()
+    return None
+
+class Server:
+    def __init__(self, engine, tokenizer, metrics, default_max_new_tokens=256):
+        self.engine = engine
+        self.tokenizer = tokenizer
+        self.metrics = metrics
+        self.default_max_new_tokens = default_max_new_tokens
+
+    async def handle(self, reader, writer):
+        try:
+            request_line = (await reader.readline()).decode("latin-1").split()
+            headers = {}
+            while True:
+                line = (await reader.readline()).decode("latin-1").strip()
+                if not line:
+                    break
+                name, _, value = line.partition(":")
+                headers[name.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers.get("content-length", 0)))
+            if len(request_line) < 2:
+                return await write_response(writer, 400, {"error": "malformed request line"})
+            method, path = request_line[0], request_line[1]
+            if method == "GET" and path == "/metrics":
+                snapshot = self.metrics.snapshot()
+                if self.engine.prefix_cache is not None:
+                    snapshot["prefix_cache"] = dict(self.engine.prefix_cache.stats, entries=len(self.engine.prefix_cache.entries))
+                return await write_response(writer, 200, snapshot)
+            if method == "POST" and path == "/v1/completions":
+                return await self.complete(reader, writer, body)
+            return await write_response(writer, 404, {"error": f"no route for {method} {path}"})
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    def parse_params(self, body):
+        # -> (prompt, max_new_tokens, temperature, top_p, stream); ValueError with a client-facing message
+        params = json.loads(body or b"{}")
+        if not isinstance(params, dict):
+            raise ValueError("body must be a JSON object")
+        if "prompt" in params:
+            prompt = params["prompt"]
+        else:
+            prompt = format_prompt({"instruction": params["instruction"], "output": ""})
+        if not isinstance(prompt, str) or not prompt:
+            raise ValueError("prompt/instruction must be a non-empty string")
+        max_new_tokens = int(params.get("max_new_tokens", self.default_max_new_tokens))
+        temperature = float(params.get("temperature", 0.7))
+        top_p = float(params.get("top_p", 0.9))
+        if max_new_tokens < 1:
+            raise ValueError("max_new_tokens must be >= 1")
+        if not (math.isfinite(temperature) and temperature >= 0):
+            raise ValueError("temperature must be >= 0")
+        if not (math.isfinite(top_p) and 0 < top_p <= 1):
+            raise ValueError("top_p must be in (0, 1]")
+        # Leave at least one prompt token in the context window
+        max_new_tokens = min(max_new_tokens, self.engine.max_context - 1)
+        return prompt, max_new_tokens, temperature, top_p, bool(params.get("stream", False))
+
+    async def complete(self, reader, writer, body):
+        try:
+            prompt, max_new_tokens, temperature, top_p, stream = self.parse_params(body)
+        except (ValueError, KeyError, TypeError) as e:
+            return await write_response(writer, 400, {"error": f"bad request body: {e}"})
+
+        self.metrics.add("requests")
+        request = Request(self.tokenizer(prompt)["input_ids"], max_new_tokens, temperature, top_p,
+                          self.tokenizer, asyncio.get_running_loop())
+        # Connection: close, so the client sends nothing more; EOF here means it hung up
+        hangup = asyncio.ensure_future(reader.read())
+        self.engine.submit(request)
+        try:
+            if stream:
+                writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/x-ndjson\r\n"
+                             b"Transfer-Encoding: chunked\r\nConnection: close\r\n\r\n")
+                while True:
+                    event = await next_event(request, hangup)
+                    if event is None:
+                        return
+                    kind, payload = event
+                    if kind == "text":
+                        await write_chunk(writer, {"text": payload})
+                    elif kind == "done":
+                        await write_chunk(writer, {"done": True, "stats": payload})
+                        break
+                    else:
+                        await write_chunk(writer, {"error": payload})
+                        break
+                writer.write(b"0\r\n\r\n")
+                await writer.drain()
+                return
+
+            parts = []
+            while True:
+                event = await next_event(request, hangup)
+                if event is None:
+                    return
+                kind, payload = event
+                if kind == "text":
+                    parts.append(payload)
+                elif kind == "done":
+                    return await write_response(writer, 200, {"text": "".join(parts).strip(), "stats": payload})
+                else:
+                    return await write_response(writer, 500, {"error": payload})
+        finally:
+            hangup.cancel()
+            if not request.finished:
+                request.cancelled = True  # disconnect or failed write: the engine drops it at the next step
+
+# -------------- Model loading -------------- #
+def load_model(args, runtime):
+    if args.tiny:
+        from tiny_model import tiny_llama, ByteTokenizer
+        return tiny_llama(layers=args.tiny_layers, hidden_size=args.tiny_hidden), ByteTokenizer()
+    if is_merged_export(args.merged):
+        return load_merged(args.merged, dtype=runtime.dtype, device=runtime.device)
+    from transformers import AutoTokenizer, AutoModelForCausalLM
+    from peft import PeftModel
+    tokenizer = AutoTokenizer.from_pretrained(args.base_model)
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+    model = AutoModelForCausalLM.from_pretrained(args.base_model, torch_dtype=runtime.dtype, device_map={"": runtime.device})
+    if args.lora:
+        model = PeftModel.from_pretrained(model, args.lora)
+    return model.eval(), tokenizer
+
+async def main(args):
+    print("🧠 Loading model once for all requests...")
+    runtime = runtime_from_args(args)
+    print(f"💻 Runtime: {runtime.describe()}")
+    model, tokenizer = load_model(args, runtime)
+    model = maybe_compile(model, runtime)
+    metrics = Metrics()
+    prefix_cache = None
+    if args.prefix_cache_entries > 0:
+        prefix_cache = PrefixCache(model, args.prefix_cache_entries)
+        prefix_cache.add(template_prefix_ids(tokenizer))
+    engine = BatchEngine(model, tokenizer, metrics, args.max_batch, args.max_wait_ms, args.max_context, prefix_cache)
+    engine.start()
+    server = Server(engine, tokenizer, metrics, args.max_new_tokens)
+    listener = await asyncio.start_server(server.handle, args.host, args.port)
+    print(f"🚀 KwokBot server on http://{args.host}:{args.port} (max batch {args.max_batch}, max wait {args.max_wait_ms} ms)")
+    async with listener:
+        await listener.serve_forever()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve KwokBot over HTTP with dynamic batching")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--base-model", default=BASE_MODEL_PATH)
+    parser.add_argument("--lora", default=LORA_PATH, help="adapter to apply ('' for the base model alone)")
+    parser.add_argument("--merged", default=MERGED_PATH, help="merged_model.py export; used instead of base + LoRA if present")
+    parser.add_argument("--max-batch", type=int, default=8)
+    parser.add_argument("--max-wait-ms", type=float, default=20, help="how long a request waits for others to batch with")
+    parser.add_argument("--max-new-tokens", type=int, default=256, help="default when a request doesn't say")
+    parser.add_argument("--max-context", type=int, default=4096)
+    parser.add_argument("--prefix-cache-entries", type=int, default=8, help="shared-prefix KV cache size (0 disables)")
+    parser.add_argument("--tiny", action="store_true", help="serve a tiny random model (CPU load testing)")
+    parser.add_argument("--tiny-layers", type=int, default=2)
+    parser.add_argument("--tiny-hidden", type=int, default=64)
+    add_runtime_args(parser)
+    args = parser.parse_args()
+    try:
+        asyncio.run(main(args))
+    except KeyboardInterrupt:
+        pass
@@ -3,77 +3,72 @@
 
 import os
 import json
-import re
-from collections import defaultdict
+import argparse
+from itertools import islice
+from collections import defaultdict, deque
+from multiprocessing import Pool
 from tqdm import tqdm
+from concept_tagger import CONCEPT_TAGS, infer_concept_tags as infer_tags  # spicy rules live in concept_tagger
 
 INPUT_JSONL = os.path.abspath(os.path.join(os.path.dirname(__file__), "../data/kwokbot_fallback.jsonl"))
 OUTPUT_JSONL = os.path.abspath(os.path.join(os.path.dirname(__file__), "../data/kwokbot_tagged.jsonl"))
 
-# Spicy concept tagging rules
-CONCEPT_TAGS = {
-    r"gauss.*law|∇•e|flux|∮e": "gauss_law",
-    r"faraday|∇×e|∂b/∂t": "faradays_law",
-    r"lhcp": "left_hand_circular_polarization",
-    r"rhcp": "right_hand_circular_polarization",
-    r"reflection coefficient": "reflection_coefficient",
-    r"transmission coefficient": "transmission_coefficient",
-    r"z₀": "impedance",
-    r"∇×h": "ampere_law",
-    r"∇•b": "gauss_magnetic",
-    r"wave impedance": "impedance",
-    r"β|gamma|propagation": "propagation_constant",
-    r"lossy|conductivity|σ": "lossy_medium",
-    r"plane wave": "plane_wave",
-    r"electric field|e field": "electric_field",
-    r"magnetic field|b field": "magnetic_field",
-    r"cylindrical": "coordinate_system_cylindrical",
-    r"spherical": "coordinate_system_spherical",
-    r"cartesian": "coordinate_system_cartesian",
-    r"boundary condition": "boundary_conditions",
-    r"vector algebra|dot product|cross product": "vector_algebra",
-    r"transmission line": "transmission_lines",
-    r"matching|impedance match": "impedance_matching",
-    r"eigenvalue|eigenvector": "linear_algebra",
-    r"divergence|curl|gradient": "vector_operators",
-    r"∫|∮|∬": "integration",
-    r"∂": "partial_derivative",
-    r"∇": "del_operator"
-}
+def tag_line(line):
+    obj = json.loads(line)
+    text = obj.get("output", "")
+    tags = infer_tags(text)
 
-def infer_tags(text):
-    tags = set()
-    lowered = text.lower()
-    for pattern, tag in CONCEPT_TAGS.items():
-        if re.search(pattern, lowered):
-            tags.add(tag)
-    return sorted(tags)
+    if "meta" not in obj:
+        obj["meta"] = {}
+    obj["meta"]["concept_tags"] = tags
 
-def tag_file():
-    if not os.path.exists(INPUT_JSONL):
-        print("[✗] Input JSONL not found!")
-        return
+    return json.dumps(obj) + "\n"
 
-    tagged = []
-    with open(INPUT_JSONL, "r") as f:
-        lines = f.readlines()
+def tag_chunk(lines):
+    return [tag_line(line) for line in lines]
 
-    for line in tqdm(lines, desc="Tagging KwokBot entries with spicy concepts"):
-        obj = json.loads(line)
-        text = obj.get("output", "")
-        tags = infer_tags(text)
+def iter_chunks(lines, chunk_size):
+    while True:
+        chunk = list(islice(lines, chunk_size))
+        if not chunk:
+            return
+        yield chunk
 
-        if "meta" not in obj:
-            obj["meta"] = {}
-        obj["meta"]["concept_tags"] = tags
+def tag_stream(lines, workers=1, chunk_size=1000):
+    # Yields tagged lines in input order. With workers > 1, chunks are tagged in a process
+    # pool but at most 2 * workers chunks are in flight, so memory stays constant.
+    if workers <= 1:
+        for line in lines:
+            yield tag_line(line)
+        return
+    with Pool(workers) as pool:
+        pending = deque()
+        for chunk in iter_chunks(lines, chunk_size):
+            pending.append(pool.apply_async(tag_chunk, (chunk,)))
+            if len(pending) >= 2 * workers:
+                yield from pending.popleft().get()
+        while pending:
+            yield from pending.popleft().get()
 
-        tagged.append(obj)
+def tag_file(input_path=INPUT_JSONL, output_path=OUTPUT_JSONL, workers=1, chunk_size=1000):
+    if not os.path.exists(input_path):
+        print("[✗] Input JSONL not found!")
+        return
 
-    with open(OUTPUT_JSONL, "w") as out:
-        for entry in tagged:
-            out.write(json.dumps(entry) + "\n")
+    count = 0
+    with open(input_path, "r") as f, open(output_path, "w") as out:
+        lines = (line for line in f if line.strip())
+        for tagged in tqdm(tag_stream(lines, workers, chunk_size), desc="Tagging KwokBot entries with spicy concepts"):
+            out.write(tagged)
+            count += 1
 
-    print(f"[🔥] Tagged {len(tagged)} entries and saved to: {OUTPUT_JSONL}")
+    print(f"[🔥] Tagged {count} entries and saved to: {output_path}")
 
 if __name__ == "__main__":
-    tag_file()
+    parser = argparse.ArgumentParser(description="Add concept-level tags to a KwokBot JSONL file")
+    parser.add_argument("--input", default=INPUT_JSONL)
+    parser.add_argument("--output", default=OUTPUT_JSONL)
+    parser.add_argument("--workers", type=int, default=1, help="tag chunks in this many processes (order is preserved)")
+    parser.add_argument("--chunk-size", type=int, default=1000, help="lines per worker task")
+    args = parser.parse_args()
+    tag_file(args.input, args.output, args.workers, args.chunk_size)
@@ -0,0 +1,32 @@
+# tiny_model.py – A tiny randomly initialized Llama + byte-level tokenizer for CPU checks and load tests
+#
+# Lets bench_packing.py / serve_kwokbot.py --tiny exercise the real transformers code paths
+# without downloading or loading the 7B checkpoint. Output text is gibberish by design.
+
+import torch
+from transformers import LlamaConfig, LlamaForCausalLM
+
+class ByteTokenizer:
+    # ids 0-2 are pad/bos/eos, byte b is id b + 3
+    pad_token_id, bos_token_id, eos_token_id = 0, 1, 2
+    pad_token, eos_token = "<pad>", "</s>"
+    vocab_size = 259
+
+    def __call__(self, texts, **kwargs):
+        if isinstance(texts, str):
+            return {"input_ids": self.encode(texts)}
+        return {"input_ids": [self.encode(t) for t in texts]}
+
+    def encode(self, text):
+        return [self.bos_token_id] + [b + 3 for b in text.encode("utf-8")]
+
+    def decode(self, ids, skip_special_tokens=True):
+        return bytes(i - 3 for i in ids if i >= 3).decode("utf-8", errors="replace")
+
+def tiny_llama(vocab_size=ByteTokenizer.vocab_size, hidden_size=64, layers=2, max_positions=2048, seed=0):
+    config = LlamaConfig(vocab_size=vocab_size, hidden_size=hidden_size, intermediate_size=2 * hidden_size,
+                         num_hidden_layers=layers, num_attention_heads=4, num_key_value_heads=4,
+                         max_position_embeddings=max_positions, pad_token_id=0, bos_token_id=1, eos_token_id=2)
+    config._attn_implementation = "eager"
+    torch.manual_seed(seed)
+    return LlamaForCausalLM(config).eval()
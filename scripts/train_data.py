@@ -0,0 +1,250 @@
+# train_data.py – Dynamic-padding training data path shared by the KwokBot fine-tuning scripts
+#
+# Samples are tokenized without padding (prompt tokens masked out of the loss with -100),
+# Trainer's group_by_length puts similar lengths in the same batch, and the collator pads
+# each batch only to its own longest sample. TokenStatsTrainer logs real tokens/sec and the
+# fraction of pad tokens so the savings vs. padding="max_length" are visible in the logs.
+# With packing, several samples share one row (see pack_samples / PackedCollator below).
+
+import os
+import json
+import time
+import shutil
+import hashlib
+from bisect import bisect_left, insort
+import torch
+from datasets import load_dataset, load_from_disk
+from transformers import Trainer
+from build_manifest import file_sha256
+
+IGNORE_INDEX = -100
+
+def tokenize_prompts(tokenizer, prompts, max_length=None):
+    # Prompt-only (generation/eval): input_ids / attention_mask / length, no padding
+    enc = tokenizer(prompts, truncation=max_length is not None, max_length=max_length)
+    return {"input_ids": enc["input_ids"], "attention_mask": enc["attention_mask"], "length": [len(ids) for ids in enc["input_ids"]]}
+
+def tokenize_prompt_response(tokenizer, prompts, responses, max_length=512):
+    # Batched: returns input_ids / attention_mask / labels / length with the prompt masked
+    full = tokenizer([p + r for p, r in zip(prompts, responses)], truncation=True, max_length=max_length - 1)
+    prompt_lens = [len(ids) for ids in tokenizer(prompts, truncation=True, max_length=max_length)["input_ids"]]
+    batch = {"input_ids": [], "attention_mask": [], "labels": [], "length": []}
+    for ids, n_prompt in zip(full["input_ids"], prompt_lens):
+        ids = ids + [tokenizer.eos_token_id]
+        n_masked = min(n_prompt, len(ids))
+        labels = [IGNORE_INDEX] * n_masked + ids[n_masked:]
+        batch["input_ids"].append(ids)
+        batch["attention_mask"].append([1] * len(ids))
+        batch["labels"].append(labels)
+        batch["length"].append(len(ids))
+    return batch
+
+class DynamicPaddingCollator:
+    # Pads input_ids/attention_mask/labels to the longest sample in the batch (right padding)
+    def __init__(self, tokenizer, pad_to_multiple_of=None):
+        self.pad_token_id = tokenizer.pad_token_id
+        self.pad_to_multiple_of = pad_to_multiple_of
+
+    def __call__(self, features):
+        longest = max(len(f["input_ids"]) for f in features)
+        if self.pad_to_multiple_of:
+            longest = -(-longest // self.pad_to_multiple_of) * self.pad_to_multiple_of
+        batch = {"input_ids": [], "attention_mask": [], "labels": []}
+        for f in features:
+            pad = longest - len(f["input_ids"])
+            batch["input_ids"].append(list(f["input_ids"]) + [self.pad_token_id] * pad)
+            batch["attention_mask"].append(list(f["attention_mask"]) + [0] * pad)
+            batch["labels"].append(list(f["labels"]) + [IGNORE_INDEX] * pad)
+        return {k: torch.tensor(v, dtype=torch.long) for k, v in batch.items()}
+
+def pad_fraction_at_max_length(lengths, max_length=512):
+    return 1 - sum(lengths) / (len(lengths) * max_length) if lengths else 0.0
+
+def pad_fraction_grouped(lengths, batch_size):
+    # Estimate for length-grouped batches (sorted chunks, padded to each chunk's longest)
+    ordered = sorted(lengths)
+    padded = sum(max(chunk) * len(chunk) for chunk in (ordered[i:i + batch_size] for i in range(0, len(ordered), batch_size)))
+    return 1 - sum(lengths) / padded if padded else 0.0
+
+def report_padding(lengths, max_length, batch_size):
+    print(f"📏 {len(lengths)} samples, mean length {sum(lengths) / max(len(lengths), 1):.0f} tokens")
+    print(f"   pad fraction with padding='max_length' ({max_length}): {pad_fraction_at_max_length(lengths, max_length):.1%}")
+    print(f"   pad fraction with length-grouped dynamic padding (batch {batch_size}): {pad_fraction_grouped(lengths, batch_size):.1%}")
+
+class TokenStatsTrainer(Trainer):
+    # Adds tokens_per_sec and pad_fraction (measured on real batches) to every log line
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.real_tokens = 0
+        self.total_tokens = 0
+        self.stats_start = None
+
+    def training_step(self, model, inputs, *args, **kwargs):
+        if self.stats_start is None:
+            self.stats_start = time.perf_counter()
+        mask = inputs.get("attention_mask")
+        if mask is not None:
+            real, total = real_token_count(mask)
+            self.real_tokens += real
+            self.total_tokens += total
+        return super().training_step(model, inputs, *args, **kwargs)
+
+    def token_stats(self):
+        elapsed = time.perf_counter() - self.stats_start if self.stats_start else 0.0
+        return {
+            "tokens_per_sec": round(self.real_tokens / elapsed, 1) if elapsed else 0.0,
+            "pad_fraction": round(1 - self.real_tokens / self.total_tokens, 4) if self.total_tokens else 0.0,
+        }
+
+    def log(self, logs, *args, **kwargs):
+        logs.update(self.token_stats())
+        super().log(logs, *args, **kwargs)
+
+# -------------- Sequence packing -------------- #
+# Short samples are bin-packed (best-fit decreasing) into rows of up to max_length tokens.
+# position_ids restart at 0 for every sample, and PackedCollator turns them into a
+# block-diagonal causal 4D mask, so a token only attends to earlier tokens of its own sample
+# and each sample sees the same positions/attention it would get unpacked.
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+PACKED_CACHE_DIR = os.path.join(ROOT, "cache", "packed")
+TOKENIZED_CACHE_DIR = os.path.join(ROOT, "cache", "tokenized")
+
+def pack_samples(input_ids, labels, max_length=512):
+    # Returns columns input_ids / labels / position_ids / length, one row per packed sequence
+    order = sorted(range(len(input_ids)), key=lambda i: len(input_ids[i]), reverse=True)
+    bins, free = [], []  # free: sorted (remaining capacity, bin index)
+    for i in order:
+        size = len(input_ids[i])
+        slot = bisect_left(free, (size, -1))
+        if slot < len(free):
+            remaining, b = free.pop(slot)
+        else:
+            remaining, b = max_length, len(bins)
+            bins.append([])
+        bins[b].append(i)
+        insort(free, (remaining - size, b))
+    packed = {"input_ids": [], "labels": [], "position_ids": [], "length": []}
+    for members in bins:
+        row_ids, row_labels, row_pos = [], [], []
+        for i in members:
+            row_ids += input_ids[i]
+            row_labels += labels[i]
+            row_pos += range(len(input_ids[i]))
+        packed["input_ids"].append(row_ids)
+        packed["labels"].append(row_labels)
+        packed["position_ids"].append(row_pos)
+        packed["length"].append(len(row_ids))
+    return packed
+
+def tokenizer_fingerprint(tokenizer):
+    h = hashlib.sha256()
+    h.update(f"{type(tokenizer).__name__}|{tokenizer.name_or_path}|{len(tokenizer)}|{tokenizer.eos_token_id}|{tokenizer.pad_token_id}".encode())
+    backend = getattr(tokenizer, "backend_tokenizer", None)
+    if backend is not None:
+        h.update(backend.to_str().encode())
+    else:
+        h.update(json.dumps(sorted(tokenizer.get_vocab().items())).encode())
+    return h.hexdigest()
+
+def cache_key(**parts):
+    return hashlib.sha256(json.dumps(parts, sort_keys=True).encode()).hexdigest()[:16]
+
+def load_or_build(key, build, cache_dir=PACKED_CACHE_DIR, refresh=False):
+    # build() -> datasets.Dataset; saved as Arrow under cache_dir/key and memory-mapped on reuse
+    path = os.path.join(cache_dir, key)
+    if os.path.isdir(path) and not refresh:
+        print(f"📦 Loading cached dataset {key}")
+        return load_from_disk(path)
+    dataset = build()
+    tmp = path + f".tmp{os.getpid()}"
+    shutil.rmtree(tmp, ignore_errors=True)
+    dataset.save_to_disk(tmp)
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp, path)
+    return load_from_disk(path)
+
+def report_packing(sample_lengths, packed_lengths, max_length, batch_size):
+    steps_before = -(-len(sample_lengths) // batch_size)
+    steps_after = -(-len(packed_lengths) // batch_size)
+    fill = sum(packed_lengths) / (len(packed_lengths) * max_length) if packed_lengths else 0.0
+    print(f"🧳 Packed {len(sample_lengths)} samples into {len(packed_lengths)} sequences of ≤{max_length} tokens ({fill:.1%} full)")
+    print(f"   optimizer steps per epoch (batch {batch_size}): {steps_before} → {steps_after} ({steps_before / max(steps_after, 1):.1f}x fewer)")
+
+class PackedCollator:
+    # Right-pads packed rows and builds the (batch, 1, L, L) additive mask: 0 where a token may
+    # attend (same sample, not in the future), dtype-min elsewhere. Pad positions get segment 0.
+    def __init__(self, tokenizer, dtype=torch.float32):
+        self.pad_token_id = tokenizer.pad_token_id
+        self.dtype = dtype
+
+    def __call__(self, features):
+        longest = max(len(f["input_ids"]) for f in features)
+        batch = {"input_ids": [], "labels": [], "position_ids": []}
+        segments = []
+        for f in features:
+            pad = longest - len(f["input_ids"])
+            positions = list(f["position_ids"])
+            seg, current = [], 0
+            for p in positions:
+                current += p == 0
+                seg.append(current)
+            batch["input_ids"].append(list(f["input_ids"]) + [self.pad_token_id] * pad)
+            batch["labels"].append(list(f["labels"]) + [IGNORE_INDEX] * pad)
+            batch["position_ids"].append(positions + [0] * pad)
+            segments.append(seg + [0] * pad)
+        out = {k: torch.tensor(v, dtype=torch.long) for k, v in batch.items()}
+        seg = torch.tensor(segments, dtype=torch.long)
+        causal = torch.ones(longest, longest, dtype=torch.bool).tril()
+        allowed = (seg[:, :, None] == seg[:, None, :]) & (seg[:, :, None] > 0) & causal
+        mask = torch.zeros(allowed.shape, dtype=self.dtype).masked_fill(~allowed, torch.finfo(self.dtype).min)
+        out["attention_mask"] = mask[:, None]
+        return out
+
+def real_token_count(mask):
+    # 2D padding mask: count ones. 4D packed mask: a real token can attend to itself.
+    if mask.dim() == 2:
+        return int(mask.sum()), mask.numel()
+    diagonal = mask[:, 0].diagonal(dim1=-2, dim2=-1)
+    return int((diagonal == 0).sum()), diagonal.numel()
+
+# -------------- Tokenized-dataset store -------------- #
+# load_tokenized() tokenizes a JSONL file once (batched, multi-process) and keeps the result as
+# Arrow under cache/tokenized/<key>; later runs memory-map it instead of re-tokenizing. The key
+# covers the data file hash, the tokenizer, the prompt template and max_length, so the training
+# scripts and evaluate_kwokbot.py share entries whenever those match.
+
+def template_hash(prompt_fn):
+    # Formatting sentinel fields captures the template text without depending on the function's source
+    return hashlib.sha256(prompt_fn({"instruction": "\0I", "input": "\0N", "output": "\0O"}).encode()).hexdigest()
+
+def default_num_proc(rows):
+    # Worker start-up costs more than it saves on small files
+    return min(os.cpu_count() or 1, 8) if rows >= 2000 else None
+
+def load_tokenized(data_path, tokenizer, prompt_fn, max_length=512, with_response=True, num_proc=None, refresh=False):
+    # Returns (dataset, key). with_response=False tokenizes prompts only (no labels), untruncated if max_length is None
+    key = cache_key(
+        data=file_sha256(data_path),
+        tokenizer=tokenizer_fingerprint(tokenizer),
+        template=template_hash(prompt_fn),
+        max_length=max_length,
+        with_response=with_response,
+    )
+
+    def tokenize(batch):
+        entries = [dict(zip(batch, values)) for values in zip(*batch.values())]
+        prompts = [prompt_fn(entry) for entry in entries]
+        if with_response:
+            return tokenize_prompt_response(tokenizer, prompts, [entry["output"] for entry in entries], max_length)
+        return tokenize_prompts(tokenizer, prompts, max_length)
+
+    def build():
+        raw = load_dataset("json", data_files=data_path)["train"]
+        start = time.perf_counter()
+        procs = num_proc if num_proc is not None else default_num_proc(len(raw))
+        tokenized = raw.map(tokenize, batched=True, batch_size=1000, num_proc=procs, remove_columns=raw.column_names)
+        print(f"🔤 Tokenized {len(raw)} rows in {time.perf_counter() - start:.1f}s ({procs or 1} process(es))")
+        return tokenized
+
+    return load_or_build(key, build, TOKENIZED_CACHE_DIR, refresh), key